@@ -0,0 +1,52 @@
+WORD_MASK = 0xffff
+
+
+def ones_complement_sum(data: bytes):
+    """
+    compute the 16 bit ones' complement sum of a buffer, read as big endian words (RFC 1071).
+    instead of summing the words in a python loop, the whole buffer is read as one big integer.
+    since 2**16 == 1 (mod 0xffff), the ones' complement sum of the words is that integer folded modulo 0xffff.
+    :param data: bytes-like object. an odd length buffer is padded with a zero byte.
+    :return: the folded sum, between 0 and 0xffff. 0 only for a buffer of zeros.
+    """
+    total = int.from_bytes(data, byteorder='big')
+    if len(data) % 2:
+        total <<= 8
+
+    folded = total % WORD_MASK
+    if folded == 0 and total:
+        return WORD_MASK
+    return folded
+
+
+def add(*sums: int):
+    """
+    ones' complement addition of partial sums, for combining the sums of separate buffers (like a header and a payload).
+    :param sums: 16 bit ones' complement sums. buffers other than the last must have an even length.
+    :return: the folded sum.
+    """
+    total = sum(sums)
+    while total > WORD_MASK:
+        total = (total & WORD_MASK) + (total >> 16)
+    return total
+
+
+def internet_checksum(data: bytes):
+    """
+    compute the internet checksum of a buffer.
+    :param data: bytes-like object to compute the checksum of.
+    :return: the checksum, as a big endian 16 bit value.
+    """
+    return ~ones_complement_sum(data) & WORD_MASK
+
+
+def update_checksum(checksum: int, old_word: int, new_word: int):
+    """
+    incrementally update a checksum after a single 16 bit word of the buffer changed, without summing the buffer again.
+    uses equation 3 of RFC 1624: HC' = ~(~HC + ~m + m')
+    :param checksum: the checksum before the change.
+    :param old_word: the value of the word before the change.
+    :param new_word: the value of the word after the change.
+    :return: the updated checksum.
+    """
+    return ~add(~checksum & WORD_MASK, ~old_word & WORD_MASK, new_word) & WORD_MASK
@@ -1,7 +1,9 @@
+import socket
 import asyncio
 import logging
 import collections
-from TCPoverICMP import client_session, exceptions
+from typing import Callable, Awaitable
+from TCPoverICMP import client_session, exceptions, compression
 
 
 log = logging.getLogger(__name__)
@@ -11,36 +13,131 @@ ClientInfo = collections.namedtuple('ClientInfo', ('session', 'task'))
 
 
 class ClientManager:
+    DEFAULT_SEGMENT_SIZE = 1024
+    DEFAULT_KEEPALIVE = 60.0
+    KEEPALIVE_INTERVAL = 10.0
+    KEEPALIVE_PROBES = 6
+    SWEEP_INTERVAL = 5.0
+
     def __init__(
             self,
             stale_connections: asyncio.Queue,
-            incoming_tcp_packets: asyncio.Queue
+            send_segment: Callable[[memoryview, int, int, bool], Awaitable],
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            receive_buffer_size: int = client_session.ClientSession.DEFAULT_RECEIVE_BUFFER_SIZE,
+            compression_level: int = compression.StreamCompressor.DEFAULT_LEVEL,
+            max_clients: int = 0,
+            max_clients_per_peer: int = 0,
+            idle_timeout: float = 0.0,
+            keepalive: float = DEFAULT_KEEPALIVE,
     ):
+        """
+        :param max_clients: maximal number of clients, 0 for no limit.
+        :param max_clients_per_peer: maximal number of clients of a single peer address, 0 for no limit.
+        :param idle_timeout: seconds without data in either direction after which a client is ended, 0 to never end
+        idle clients.
+        :param keepalive: seconds without data after which tcp keepalive probes check the connection of a client, so
+        connections whose peer went away are found and ended. 0 turns keepalive off.
+        """
         self.clients = {}
         self.stale_connections = stale_connections
-        self.incoming_tcp_packets = incoming_tcp_packets
+        self.send_segment = send_segment
+        self.segment_size = segment_size
+        self.receive_buffer_size = receive_buffer_size
+        self.compression = False
+        self.compression_level = compression_level
+        self.max_clients = max_clients
+        self.max_clients_per_peer = max_clients_per_peer
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.peers = collections.Counter()  # peer -> clients and admitted clients of the peer.
+        self.admitted = 0  # clients that were admitted, and werent added yet.
 
     def client_exists(self, client_id: int):
         """
         check if client exists
         """
-        return client_id in self.clients.keys()
+        return client_id in self.clients
+
+    def admit(self, peer: str):
+        """
+        take a place for a new client of a peer, if the limits allow it. the place is kept until the client is added
+        with the same peer, or given back with release.
+        :param peer: the address the client is counted against.
+        :return: boolean representing whether the client was admitted.
+        """
+        if self.max_clients and len(self.clients) + self.admitted >= self.max_clients:
+            return False
+        if self.max_clients_per_peer and self.peers[peer] >= self.max_clients_per_peer:
+            return False
+        self.admitted += 1
+        self.peers[peer] += 1
+        return True
 
-    def add_client(self, client_id: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    def release(self, peer: str):
+        """
+        give back the place of an admitted client that wasnt added.
+        """
+        self.admitted -= 1
+        self.forget_peer(peer)
+
+    def forget_peer(self, peer: str):
+        """
+        stop counting a client against its peer.
+        """
+        self.peers[peer] -= 1
+        if not self.peers[peer]:
+            del self.peers[peer]
+
+    def add_client(
+            self,
+            client_id: int,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            early_data_size: int = 0,
+            peer: str = None,
+    ):
         """
         add a client to be managed. create a task that constantly reads from the client.
+        :param early_data_size: the size of the data that was already read from the client, and sent along with its
+        start request. 0 if there was none.
+        :param peer: the peer the client was admitted for, see admit. None if it wasnt.
         """
         if self.client_exists(client_id):
             raise exceptions.ClientAlreadyExistsError()
 
-        new_client_session = client_session.ClientSession(client_id, reader, writer)
+        new_client_session = client_session.ClientSession(client_id, reader, writer, self.receive_buffer_size, peer)
+        if early_data_size:
+            new_client_session.sent_early_data(early_data_size)
+        if peer is not None:
+            self.admitted -= 1  # the place it was admitted to is now taken.
+        if self.keepalive:
+            self.enable_keepalive(writer)
         new_task = asyncio.create_task(self.read_from_client(client_id))
         self.clients[client_id] = ClientInfo(new_client_session, new_task)
         log.debug(f'adding client: (client_id={client_id})')
 
+    def enable_keepalive(self, writer: asyncio.StreamWriter):
+        """
+        have the kernel probe the connection once it was idle for keepalive seconds. if the peer went away without
+        closing it, the probes fail, and the next read from the connection fails.
+        """
+        sock = writer.get_extra_info('socket')
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):  # linux only. elsewhere, the system defaults are used.
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(int(self.keepalive), 1))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(self.KEEPALIVE_INTERVAL))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.KEEPALIVE_PROBES)
+        except OSError as e:
+            log.debug(f'cant enable keepalive ({e})')
+
     async def remove_client(self, client_id: int):
         """
         remove a managed client. cancel the task and stop the client session.
+        the client stops existing right away, so packets handled while it is stopped see it as removed.
         Dont call directly from client_manager, instead put client_id in stale_connections.
         :param client_id: the client_id to remove
         """
@@ -48,29 +145,101 @@ class ClientManager:
             raise exceptions.RemovingClientThatDoesntExistError(client_id, self.clients.keys())
 
         log.debug(f'removing client: (client_id={client_id})')
-        self.clients[client_id].task.cancel()
-        await self.clients[client_id].task
-        await self.clients[client_id].session.stop()
-        self.clients.pop(client_id)
+        client = self.clients.pop(client_id)
+        if client.session.peer is not None:
+            self.forget_peer(client.session.peer)
+        client.task.cancel()
+        await asyncio.wait((client.task,))  # awaiting the task itself raises if it was cancelled before it started.
+        await client.session.stop()
+
+    def mark_stale(self, client_id: int):
+        """
+        put a client in stale_connections, without waiting. a client is put there once.
+        """
+        client = self.clients.get(client_id)
+        if client is not None:
+            if client.session.stale:
+                return
+            client.session.stale = True
+        try:
+            self.stale_connections.put_nowait(client_id)
+        except asyncio.QueueFull:
+            asyncio.create_task(self.stale_connections.put(client_id))
 
-    async def write_to_client(self, client_id: int, sequence_number: int, data: bytes):
+    def write_to_client(self, client_id: int, sequence_number: int, data: bytes, compressed: bool = False):
         """
-        function for writing to a managed client.
+        function for writing to a managed client. it never blocks, see ClientSession.write.
         :param client_id: the client_id of the client to write to.
         :param sequence_number: the sequence number of the write. used for validation and ordering of packets.
         :param data: the data to write.
+        :param compressed: whether the data is a segment of the compressed stream of the client.
+        :return: boolean representing whether the data was accepted by the client, and should be acked.
         """
-        if not self.client_exists(client_id):
+        client = self.clients.get(client_id)
+        if client is None:
             raise exceptions.WriteAttemptedToNonExistentClient()
 
         try:
-            await self.clients[client_id].session.write(sequence_number, data)
+            return client.session.write(sequence_number, data, compressed)
         except exceptions.ClientClosedConnectionError:
-            await self.stale_connections.put(client_id)
+            self.mark_stale(client_id)
+            return False
+        except exceptions.CorruptedStreamError as e:
+            log.info(f'(client_id={client_id}): cant decompress the data ({e}). removing client.')
+            self.mark_stale(client_id)
+            return False
+
+    def acked_up_to(self, client_id: int):
+        """
+        the highest sequence number that was written in order to a managed client. used for cumulative acks.
+        :param client_id: the client_id of the client.
+        :return: the sequence number, or 0 if the client doesnt exist.
+        """
+        client = self.clients.get(client_id)
+        if client is None:
+            return 0
+        return client.session.last_written
+
+    def sack_blocks(self, client_id: int):
+        """
+        the ranges of sequence numbers a managed client received out of order, for selective acks.
+        :param client_id: the client_id of the client.
+        :return: tuple of (first, last) pairs, empty if the client doesnt exist or has no gaps.
+        """
+        client = self.clients.get(client_id)
+        if client is None:
+            return ()
+        return client.session.sack_blocks()
+
+    def receive_window(self, client_id: int):
+        """
+        the amount of bytes a managed client can still buffer, to advertise to the other endpoint.
+        :param client_id: the client_id of the client.
+        :return: the amount of bytes, or 0 if the client doesnt exist.
+        """
+        client = self.clients.get(client_id)
+        if client is None:
+            return 0
+        return client.session.receive_window
+
+    def send_window(self, client_id: int):
+        """
+        get the send window of a managed client.
+        :param client_id: the client_id of the client.
+        :return: the SendWindow of the client, or None if the client doesnt exist.
+        """
+        client = self.clients.get(client_id)
+        if client is None:
+            return None
+        return client.session.send_window
 
     async def read_from_client(self, client_id: int):
         """
-        constantly read from a client, and put in incoming_tcp_packets queue.
+        constantly read from a client, and send the data on the tunnel with send_segment.
+        the data is read in big blocks, and split into segments of segment_size, each with its own sequence number.
+        if compression is on, every block is compressed before it is split.
+        stops reading while the send window of the client is full, and reads no more than the other endpoint can
+        receive, so a slow destination pushes back all the way to the client.
         :param client_id: the client to read from.
         """
         if not self.client_exists(client_id):
@@ -80,12 +249,58 @@ class ClientManager:
 
         try:
             while True:
+                await client.send_window.wait_for_space()
+                segment_size = self.segment_size  # might change while the block is being split.
+                block_size = client.RECV_BLOCK_SIZE
+                if client.send_window.available is not None:
+                    block_size = min(max(client.send_window.available, segment_size), block_size)
                 try:
-                    data = await client.read()
+                    data = await client.read(block_size)
                 except exceptions.ClientClosedConnectionError:
-                    await self.stale_connections.put(client_id)
+                    self.mark_stale(client_id)
                     return
 
-                await self.incoming_tcp_packets.put((data, client.client_id, next(client.sequence_number)))
+                compressed = False
+                if self.compression:
+                    if client.compressor is None:
+                        client.compressor = compression.StreamCompressor(self.compression_level)
+                    data, compressed = client.compressor.compress(data)
+
+                view = memoryview(data)
+                for offset in range(0, len(view), segment_size):
+                    segment = view[offset:offset + segment_size]
+                    await client.send_window.wait_for_space(len(segment))
+                    sequence_number = client.take_sequence_number()
+                    client.send_window.add(sequence_number, len(segment))
+                    await self.send_segment(segment, client.client_id, sequence_number, compressed)
         except asyncio.CancelledError:
             pass
+
+    def reap(self, now: float):
+        """
+        mark the clients that should be ended as stale: clients that were idle for idle_timeout, and clients whose
+        connection was found dead by keepalive, or closed, while noone was reading from it (the send window of the
+        client might be full).
+        :param now: the current time.
+        :return: the number of clients that were marked.
+        """
+        idle_since = now - self.idle_timeout if self.idle_timeout else None
+        reaped = 0
+        for client_id, client in self.clients.items():  # marking a client doesnt remove it, nothing is allocated.
+            session = client.session
+            if session.stale:
+                continue
+            idle = idle_since is not None and session.last_active < idle_since
+            if idle or session.reader.exception() is not None or session.writer.is_closing():
+                log.debug(f'(client_id={client_id}): {"idle" if idle else "connection closed"}. removing client.')
+                self.mark_stale(client_id)
+                reaped += 1
+        return reaped
+
+    async def reap_forever(self):
+        """
+        reap the clients every SWEEP_INTERVAL seconds, in a single sweep, instead of a timer for every client.
+        """
+        while True:
+            await asyncio.sleep(min(self.SWEEP_INTERVAL, self.idle_timeout or self.SWEEP_INTERVAL))
+            self.reap(asyncio.get_running_loop().time())
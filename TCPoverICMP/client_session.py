@@ -1,70 +1,244 @@
 import asyncio
 import logging
-import itertools
-from TCPoverICMP import exceptions
+from TCPoverICMP import exceptions, send_window, compression
 
 
 log = logging.getLogger(__name__)
 
 
 class ClientSession:
+    """
+    the state of a single client. an endpoint might have tens of thousands of them, so the state is kept in slots, and
+    the state that most clients never need is created on first use.
+    """
     INITIAL_SEQUENCE_NUMBER = 1
-    RECV_BLOCK_SIZE = 1024
+    RECV_BLOCK_SIZE = 65536
+    DEFAULT_RECEIVE_BUFFER_SIZE = 256 * 1024
+    MAX_SACK_BLOCKS = 4
+    MIN_DECOMPRESS_SIZE = 65536  # decompressed even if the receive window is closed, so the stream keeps moving.
+    __slots__ = (
+        'client_id',
+        'reader',
+        'writer',
+        'next_sequence_number',
+        'last_written',
+        'packets',
+        'packets_size',
+        'receive_buffer_size',
+        'send_window',
+        'compressor',
+        'decompressor',
+        'decompress_task',
+        'bytes_read',
+        'bytes_written',
+        'last_active',
+        'peer',
+        'stale',
+    )
 
     def __init__(
             self,
             client_id: int,
             reader: asyncio.StreamReader,
             writer: asyncio.StreamWriter,
+            receive_buffer_size: int = DEFAULT_RECEIVE_BUFFER_SIZE,
+            peer: str = None,
     ):
+        """
+        :param peer: the address the client is counted against for the session limits, None if it isnt.
+        """
         self.client_id = client_id
         self.reader = reader
         self.writer = writer
-        self.sequence_number = itertools.count(self.INITIAL_SEQUENCE_NUMBER)
+        self.next_sequence_number = self.INITIAL_SEQUENCE_NUMBER
         self.last_written = self.INITIAL_SEQUENCE_NUMBER - 1
         self.packets = {}
+        self.packets_size = 0
+        self.receive_buffer_size = receive_buffer_size
+        self.send_window = send_window.SendWindow()
+        self.compressor = None  # created on first use, the zlib state is big.
+        self.decompressor = None
+        self.decompress_task = None  # decompresses the rest of a segment that didnt fit, as the client drains.
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.last_active = asyncio.get_running_loop().time()  # the last time data was read from or written to it.
+        self.peer = peer
+        self.stale = False  # whether it was marked stale, and is waiting to be ended.
+
+    @property
+    def buffered_size(self):
+        """
+        the amount of bytes received from the other endpoint, that werent written to the client yet.
+        this includes the packets waiting for a missing sequence number, the compressed data that wasnt decompressed
+        yet, and the write buffer of the socket.
+        """
+        pending_size = self.decompressor.pending_size if self.decompressor is not None else 0
+        return self.packets_size + pending_size + self.writer.transport.get_write_buffer_size()
+
+    @property
+    def decompressing(self):
+        """
+        whether a compressed segment wasnt fully written yet, since it inflated beyond the receive window.
+        """
+        return self.decompressor is not None and self.decompressor.pending
+
+    @property
+    def receive_window(self):
+        """
+        the amount of bytes the other endpoint can send before the receive buffer is full.
+        """
+        return max(self.receive_buffer_size - self.buffered_size, 0)
+
+    def take_sequence_number(self):
+        """
+        :return: the sequence number of the next segment read from the client.
+        """
+        sequence_number = self.next_sequence_number
+        self.next_sequence_number += 1
+        return sequence_number
+
+    def sent_early_data(self, size: int):
+        """
+        account for the first segment of the client, that was read before the session was created, and was sent and
+        acked along with the start request (0-RTT). it took the first sequence number.
+        :param size: the size of the segment.
+        """
+        self.take_sequence_number()
+        self.bytes_read += size
+
+    def sack_blocks(self, max_blocks: int = MAX_SACK_BLOCKS):
+        """
+        the ranges of sequence numbers that were received out of order, and wait for the missing ones before them.
+        the other endpoint tells the missing segments from them, and resends only those.
+        :param max_blocks: the maximal number of ranges to return. the lowest ones are returned, since the lowest
+        missing segment holds up the rest.
+        :return: tuple of (first, last) pairs, lowest first.
+        """
+        if not self.packets:
+            return ()
+        blocks = []
+        for sequence_number in sorted(self.packets):
+            if blocks and blocks[-1][1] == sequence_number - 1:
+                blocks[-1][1] = sequence_number
+            elif len(blocks) < max_blocks:
+                blocks.append([sequence_number, sequence_number])
+            else:
+                break
+        return tuple((first, last) for first, last in blocks)
 
     async def stop(self):
         """
         close the underlying socket, thus stopping the client session
         """
         log.debug(f'(client_id={self.client_id}): Shutting down..')
+        if self.decompress_task is not None:
+            self.decompress_task.cancel()
         self.writer.close()
         await self.writer.wait_closed()
 
-    async def read(self):
+    async def read(self, size: int = RECV_BLOCK_SIZE):
         """
-        read RECV_BLOCK_SIZE from the reader
+        read up to size bytes from the reader
+        :param size: maximal length of data to read.
         :return: the data that was just read
         """
         try:
-            data = await self.reader.read(self.RECV_BLOCK_SIZE)
+            data = await self.reader.read(size)
         except ConnectionResetError:
             raise exceptions.ClientClosedConnectionError()
 
         if not data:
             raise exceptions.ClientClosedConnectionError()
 
+        self.bytes_read += len(data)
+        self.last_active = asyncio.get_running_loop().time()
         return data
 
-    async def write(self, sequence_number: int, data: bytes):
+    def write(self, sequence_number: int, data: bytes, compressed: bool = False):
         """
         write a packet to the current client, sequentially
+        the socket isnt drained, instead the receive buffer is bounded by receive_buffer_size, and a packet that
+        doesnt fit is dropped, to be resent by the other endpoint. packets that are next in sequence are allowed to
+        overshoot the budget, up to twice its size, since the other endpoint might have sent them on a stale window.
         :param sequence_number: the sequence number of the packet. this enables packets to be written in sequence, without duplicates
         :param data: the data to be written
+        :param compressed: whether the data is a segment of the compressed stream of the client.
+        :return: boolean representing whether the packet was accepted. repeated packets count as accepted.
         """
         if self.writer.is_closing():
             raise exceptions.ClientClosedConnectionError()
 
-        if sequence_number in self.packets.keys():
+        if sequence_number <= self.last_written or sequence_number in self.packets:
             log.debug(f'ignoring repeated packet: (seq_num={sequence_number})')
-            return
+            return True
+
+        budget = self.receive_buffer_size
+        if sequence_number == self.last_written + 1:
+            budget *= 2
+        if self.buffered_size + len(data) > budget:
+            log.debug(f'receive buffer is full, dropping packet: (seq_num={sequence_number})')
+            return False
 
-        self.packets[sequence_number] = data
-        while (self.last_written + 1) in self.packets.keys():
+        self.packets[sequence_number] = (data, compressed)
+        self.packets_size += len(data)
+        self.write_in_sequence()
+        return True
+
+    def write_in_sequence(self):
+        """
+        write the packets that are next in sequence to the client.
+        a compressed segment is only decompressed as far as the receive window allows, since it might inflate to a
+        thousand times its size. the rest of it is decompressed as the client drains, and the packets after it wait
+        until it is written.
+        """
+        while not self.decompressing and (self.last_written + 1) in self.packets:
             self.last_written += 1
 
-            self.writer.write(self.packets[self.last_written])
-            await self.writer.drain()
+            data, compressed = self.packets.pop(self.last_written)
+            self.packets_size -= len(data)
+            if compressed:  # the compressed stream is decompressed in sequence, like it was compressed.
+                if self.decompressor is None:
+                    self.decompressor = compression.StreamDecompressor()
+                data = self.decompressor.decompress(data, max(self.receive_window, self.MIN_DECOMPRESS_SIZE))
+                if self.decompressing and self.decompress_task is None:
+                    self.decompress_task = asyncio.create_task(self.decompress_as_drained())
+            self.write_decompressed(data)
+
+    def write_decompressed(self, data: bytes):
+        """
+        write data that is in sequence, and decompressed if it was compressed, to the client.
+        """
+        self.writer.write(data)
+        self.bytes_written += len(data)
+        self.last_active = asyncio.get_running_loop().time()
+
+    async def decompress_as_drained(self):
+        """
+        decompress the rest of a compressed segment whenever the client drained its write buffer, then write the
+        packets that waited for it.
+        """
+        try:
+            while self.decompressing:
+                await self.writer.drain()
+                self.write_decompressed(
+                    self.decompressor.decompress(b'', max(self.receive_window, self.MIN_DECOMPRESS_SIZE)),
+                )
+        except ConnectionError:
+            return  # the client is ended once the closed connection is found.
+        except exceptions.CorruptedStreamError as e:
+            self.close_corrupted(e)
+            return
+        finally:
+            self.decompress_task = None
+        try:
+            self.write_in_sequence()
+        except exceptions.CorruptedStreamError as e:
+            self.close_corrupted(e)
 
-            self.packets.pop(self.last_written)
+    def close_corrupted(self, error: exceptions.CorruptedStreamError):
+        """
+        close the connection of a client whose compressed stream is corrupted, outside of a write. the client is ended
+        once the closed connection is found.
+        """
+        log.info(f'(client_id={self.client_id}): cant decompress the data ({error}). closing the connection.')
+        self.writer.close()
@@ -0,0 +1,68 @@
+import asyncio
+from typing import Callable
+from TCPoverICMP import icmp_packet
+
+
+class Coalescer:
+    """
+    combine small encoded tunnel packets, of any client, into a single icmp payload (Nagle-like).
+    a payload is sent once it cant fit another packet, or flush_delay seconds after its first packet was added.
+    the packets must be self delimiting, so the other endpoint can split the payload again.
+    packets are only combined with packets that go in an icmp packet of the same type and sequence number, to the same
+    address.
+    """
+    DEFAULT_MAX_PAYLOAD_SIZE = 1472  # 1500 bytes ethernet MTU, without the IP and ICMP headers.
+    DEFAULT_FLUSH_DELAY = 0.001
+
+    def __init__(
+            self,
+            send: Callable[[icmp_packet.ICMPType, bytes, int, str], None],
+            max_payload_size: int = DEFAULT_MAX_PAYLOAD_SIZE,
+            flush_delay: float = DEFAULT_FLUSH_DELAY,
+    ):
+        self.send = send
+        self.max_payload_size = max_payload_size
+        self.flush_delay = flush_delay
+        self._pending = {}  # (icmp_type, sequence_number, address) -> list of records.
+        self._pending_size = {}
+        self._flush_handles = {}
+
+    def add(self, icmp_type: icmp_packet.ICMPType, record: bytes, sequence_number: int, address: str):
+        """
+        add an encoded packet to the payload that is being built for the icmp type, sequence number and address.
+        :param icmp_type: the type of the icmp packet to send the record in.
+        :param record: the encoded tunnel packet.
+        :param sequence_number: the sequence number of the icmp packet to send the record in.
+        :param address: the address to send the icmp packet to.
+        """
+        key = (icmp_type, sequence_number, address)
+        if self._pending_size.get(key, 0) + len(record) > self.max_payload_size:
+            self.flush(key)
+        if key not in self._pending:
+            self._pending[key] = []
+            self._pending_size[key] = 0
+
+        self._pending[key].append(record)
+        self._pending_size[key] += len(record)
+
+        if self._pending_size[key] >= self.max_payload_size:
+            self.flush(key)
+        elif key not in self._flush_handles:
+            self._flush_handles[key] = asyncio.get_running_loop().call_later(self.flush_delay, self.flush, key)
+
+    def flush(self, key: tuple):
+        """
+        send the payload that was built for the icmp type, sequence number and address, if there is one.
+        :param key: tuple of the icmp type, sequence number and address of the pending icmp packet.
+        """
+        flush_handle = self._flush_handles.pop(key, None)
+        if flush_handle is not None:
+            flush_handle.cancel()
+
+        records = self._pending.pop(key, None)
+        self._pending_size.pop(key, None)
+        if not records:
+            return
+
+        icmp_type, sequence_number, address = key
+        self.send(icmp_type, records[0] if len(records) == 1 else b''.join(records), sequence_number, address)
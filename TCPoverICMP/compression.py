@@ -0,0 +1,85 @@
+import zlib
+from TCPoverICMP import exceptions
+
+
+class StreamCompressor:
+    """
+    compress the data of a single client as one deflate stream, so every block is compressed using the history of
+    the blocks before it. every block is flushed on its own (Z_SYNC_FLUSH), so it can be decompressed once it and all
+    the blocks before it arrived.
+    the compression ratio is measured, and compression is switched off for streams that dont compress, like already
+    compressed or encrypted data. it is retried after RETRY_AFTER bytes, in case the stream changed.
+    """
+    DEFAULT_LEVEL = 1
+    MAX_RATIO = 0.9
+    RETRY_AFTER = 1024 * 1024
+
+    def __init__(self, level: int = DEFAULT_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.enabled = True
+        self._skipped = 0
+        self.raw_size = 0
+        self.compressed_size = 0
+
+    def compress(self, data: bytes):
+        """
+        :param data: the next block of the stream.
+        :return: tuple of the block to send, and a boolean representing whether it is compressed.
+        """
+        if not self.enabled:
+            self._skipped += len(data)
+            if self._skipped < self.RETRY_AFTER:
+                return data, False
+            self.enabled = True
+            self._skipped = 0
+
+        # once the compressor consumed the block, the block has to be sent compressed. otherwise, the history of the
+        # decompressor wouldnt match.
+        compressed = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.raw_size += len(data)
+        self.compressed_size += len(compressed)
+        if len(compressed) > len(data) * self.MAX_RATIO:
+            self.enabled = False
+        return compressed, True
+
+
+class StreamDecompressor:
+    """
+    decompress the blocks of a single client, that were compressed by a StreamCompressor, in sequence.
+    the blocks might be split into segments arbitrarily, as long as the segments are decompressed in order.
+    a small segment might inflate to a thousand times its size, so the output is bounded, and the rest of the segment
+    is kept until it is continued.
+    """
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._output_full = False  # whether the last output was cut at its maximal size.
+
+    @property
+    def pending(self):
+        """
+        whether the last segment might have more output, that didnt fit. it is decompressed by calling decompress
+        again, before the next segment.
+        """
+        return self._output_full or bool(self._decompressor.unconsumed_tail)
+
+    @property
+    def pending_size(self):
+        """
+        the size of the compressed data that wasnt decompressed yet.
+        """
+        return len(self._decompressor.unconsumed_tail)
+
+    def decompress(self, data: bytes, max_length: int):
+        """
+        :param data: the next compressed segment of the stream, or b'' to continue the pending one.
+        :param max_length: the maximal size of the decompressed data, at least 1.
+        :return: the decompressed data. might be empty, if the segment ends in the middle of a deflate block.
+        """
+        if self._decompressor.unconsumed_tail:
+            data = self._decompressor.unconsumed_tail + data
+        try:
+            decompressed = self._decompressor.decompress(data, max_length)
+        except zlib.error as e:
+            raise exceptions.CorruptedStreamError(e)
+        self._output_full = len(decompressed) == max_length
+        return decompressed
@@ -0,0 +1,140 @@
+import asyncio
+import collections
+from TCPoverICMP import rtt_estimator
+
+
+class CongestionController:
+    """
+    loss driven AIMD congestion window, shared by all the clients sending on the icmp channel.
+    the window grows exponentially (slow start) up to the slow start threshold, and by one packet per window after it.
+    on loss, the window is halved, at most once per round trip.
+    senders waiting for room in the window are served in order, and only as many of them are woken as there is room for.
+    """
+    INITIAL_WINDOW = 4
+    MIN_WINDOW = 2
+    MAX_WINDOW = 256
+
+    def __init__(self, rtt: rtt_estimator.RTTEstimator, max_window: int = MAX_WINDOW):
+        self.rtt = rtt
+        self.max_window = max(max_window, self.MIN_WINDOW)
+        self.window = float(min(self.INITIAL_WINDOW, self.max_window))
+        self.slow_start_threshold = float(self.max_window)
+        self.in_flight = 0
+        self._recovery_end = 0.0
+        self._waiters = collections.deque()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(window={self.window:.2f}, in_flight={self.in_flight})'
+
+    async def acquire(self):
+        """
+        wait until the window allows another packet in flight, and take its place.
+        """
+        if self.in_flight < int(self.window) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter  # the place is taken for the waiter when it is woken.
+        except asyncio.CancelledError:
+            if not waiter.cancelled():  # woken and cancelled at once, give the place back.
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        """
+        free the place of a packet that was acked or given up.
+        """
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    def on_ack(self):
+        """
+        grow the window after a packet was acked.
+        """
+        if self.window < self.slow_start_threshold:
+            self.window += 1
+        else:
+            self.window += 1 / self.window
+        self.window = min(self.window, self.max_window)
+        self._wake_waiters()
+
+    def on_loss(self):
+        """
+        shrink the window after a packet wasnt acked in time. losses in the same round trip count as one.
+        """
+        now = asyncio.get_running_loop().time()
+        if now < self._recovery_end:
+            return
+
+        self.slow_start_threshold = max(self.window / 2, self.MIN_WINDOW)
+        self.window = self.slow_start_threshold
+        self._recovery_end = now + (self.rtt.srtt if self.rtt.srtt is not None else self.rtt.rto)
+
+    @property
+    def pacing_rate(self):
+        """
+        the rate (packets per second) that spreads a whole window over one round trip.
+        """
+        if self.rtt.srtt is None:
+            return None
+        return self.window / max(self.rtt.srtt, rtt_estimator.RTTEstimator.CLOCK_GRANULARITY)
+
+    def _wake_waiters(self):
+        while self._waiters and self.in_flight < int(self.window):
+            waiter = self._waiters.popleft()
+            if not waiter.done():  # a cancelled waiter is skipped.
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class Pacer:
+    """
+    token bucket that spreads packets over time, instead of sending them in bursts.
+    """
+    MAX_RATE = 5000
+    BURST = 8
+    GAIN = 1.25
+
+    def __init__(self, max_rate: float = MAX_RATE, burst: int = BURST):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = None
+
+    def set_rate(self, rate: float):
+        """
+        update the sending rate. the rate is scaled by GAIN, so the pacer doesnt become the bottleneck.
+        :param rate: the desired rate in packets per second, or None if it isnt known yet.
+        """
+        if rate is None:
+            self.rate = self.max_rate
+        else:
+            self.rate = min(rate * self.GAIN, self.max_rate)
+
+    def take(self):
+        """
+        consume a token for a packet, even if it leaves the bucket in debt.
+        :return: the time until the packet may be sent, in seconds.
+        """
+        now = asyncio.get_running_loop().time()
+        if self._last_refill is not None:
+            self._tokens = min(self._tokens + (now - self._last_refill) * self.rate, self.burst)
+        self._last_refill = now
+
+        self._tokens -= 1
+        return max(-self._tokens / self.rate, 0.0)
+
+    async def wait(self):
+        """
+        wait until a packet may be sent, and consume a token for it.
+        the token is taken right away, so concurrent waiters are served in order.
+        """
+        delay = self.take()
+        if delay:
+            await asyncio.sleep(delay)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import collections
+from TCPoverICMP import resolver
+
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    open the connections of new clients to their destinations, off the dispatch path.
+    destinations are resolved through a ResolverCache, and their addresses are tried in order.
+    optionally, up to size connections to every destination that was connected to are kept open, so a new client takes
+    an established connection instead of waiting for a handshake. the pool of a destination is refilled in the
+    background whenever a connection is taken from it. pooled connections are closed after max_idle seconds, before the
+    destination closes them as idle, and so destinations that arent connected to anymore dont keep connections open.
+    """
+    DEFAULT_SIZE = 0
+    MAX_IDLE = 30.0
+
+    def __init__(self, resolver_cache: resolver.ResolverCache, size: int = DEFAULT_SIZE, max_idle: float = MAX_IDLE):
+        """
+        :param resolver_cache: resolves the destinations.
+        :param size: number of connections to keep open to every destination. 0 turns pooling off.
+        :param max_idle: seconds a pooled connection is kept before it is closed.
+        """
+        self.resolver = resolver_cache
+        self.size = size
+        self.max_idle = max_idle
+        self.idle = {}  # (host, port) -> deque of (reader, writer, time it was opened), oldest first.
+        self._refilling = {}  # (host, port) -> the task refilling its pool.
+
+    async def connect(self, host: str, port: int):
+        """
+        :return: tuple of reader and writer of a connection to the destination, pooled if there is one.
+        :raises OSError: if no address of the destination could be connected to.
+        """
+        connection = self.take(host, port)
+        if self.size:
+            self.refill(host, port)
+        if connection is not None:
+            return connection
+        return await self.open(host, port)
+
+    def take(self, host: str, port: int):
+        """
+        :return: tuple of reader and writer of a pooled connection to the destination, None if there is none.
+        """
+        connections = self.idle.get((host, port))
+        if not connections:
+            return None
+
+        self.expire(connections)
+        while connections:
+            reader, writer, _ = connections.pop()  # the newest, the least likely to be closed by the destination.
+            if not writer.is_closing() and not reader.at_eof() and reader.exception() is None:
+                return reader, writer
+            writer.close()
+        return None
+
+    async def open(self, host: str, port: int):
+        """
+        open a new connection to the destination, trying its addresses in order.
+        :return: tuple of reader and writer of the connection.
+        """
+        error = None
+        for address in await self.resolver.resolve(host, port):
+            try:
+                return await asyncio.open_connection(address, port)
+            except OSError as e:
+                error = e
+        self.resolver.invalidate(host, port)  # the destination might have moved.
+        raise error if error is not None else OSError(f'{host} has no addresses')
+
+    def refill(self, host: str, port: int):
+        """
+        open connections to the destination in the background, until its pool is full.
+        """
+        key = (host, port)
+        if key not in self._refilling:
+            self._refilling[key] = asyncio.create_task(self._refill(host, port))
+
+    async def _refill(self, host: str, port: int):
+        key = (host, port)
+        connections = self.idle.setdefault(key, collections.deque())
+        try:
+            while len(connections) < self.size:
+                reader, writer = await self.open(host, port)
+                connections.append((reader, writer, asyncio.get_running_loop().time()))
+        except OSError as e:
+            log.debug(f'cant open pooled connections to {host}:{port} ({e})')
+        finally:
+            self._refilling.pop(key, None)
+
+    def expire(self, connections: collections.deque):
+        """
+        close the pooled connections that were idle for max_idle seconds.
+        """
+        oldest = asyncio.get_running_loop().time() - self.max_idle
+        while connections and connections[0][2] < oldest:
+            _, writer, _ = connections.popleft()
+            writer.close()
+
+    async def run(self):
+        """
+        close idle pooled connections periodically, and forget the destinations that have none left.
+        all the pooled connections are closed once it is cancelled.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.max_idle / 2)
+                for key, connections in list(self.idle.items()):
+                    self.expire(connections)
+                    if not connections and key not in self._refilling:
+                        del self.idle[key]
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        close all the pooled connections.
+        """
+        for task in self._refilling.values():
+            task.cancel()
+        self._refilling.clear()
+        for connections in self.idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self.idle.clear()
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Callable
+
+
+class DelayedAcks:
+    """
+    acknowledge in order data segments lazily, per client (delayed acks, RFC 1122 4.2.3.2).
+    a single cumulative ack is sent for every segments_per_ack segments, or delay seconds after the first unacked one.
+    if data is sent to the client in the meanwhile, the ack is piggybacked on it instead, and the pending ack is dropped.
+    """
+    DEFAULT_SEGMENTS_PER_ACK = 2
+    DEFAULT_DELAY = 0.01
+
+    def __init__(
+            self,
+            send_ack: Callable[[int], None],
+            segments_per_ack: int = DEFAULT_SEGMENTS_PER_ACK,
+            delay: float = DEFAULT_DELAY,
+    ):
+        self.send_ack = send_ack
+        self.segments_per_ack = segments_per_ack
+        self.delay = delay
+        self._unacked = {}  # client_id -> number of segments received since the last ack.
+        self._timers = {}
+
+    def on_segment(self, client_id: int):
+        """
+        a data segment of the client was received in order.
+        :param client_id: the client of the segment.
+        """
+        unacked = self._unacked.get(client_id, 0) + 1
+        self._unacked[client_id] = unacked
+
+        if unacked >= self.segments_per_ack:
+            self.flush(client_id)
+        elif client_id not in self._timers:
+            self._timers[client_id] = asyncio.get_running_loop().call_later(self.delay, self.flush, client_id)
+
+    def flush(self, client_id: int):
+        """
+        send the pending ack of the client now, if there is one.
+        :param client_id: the client to ack.
+        """
+        if self.take(client_id):
+            self.send_ack(client_id)
+
+    def take(self, client_id: int):
+        """
+        drop the pending ack of the client, because the ack is about to be sent in another packet.
+        :param client_id: the client to ack.
+        :return: boolean representing whether an ack was pending.
+        """
+        timer = self._timers.pop(client_id, None)
+        if timer is not None:
+            timer.cancel()
+        return self._unacked.pop(client_id, None) is not None
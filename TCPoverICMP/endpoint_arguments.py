@@ -0,0 +1,289 @@
+import argparse
+import functools
+from TCPoverICMP import congestion, icmp_socket, coalescer, path_mtu, delayed_ack, client_session, compression
+from TCPoverICMP import client_manager, tunnel_endpoint, transport, udp_transport, packet_tracer, connection_pool, resolver
+
+
+def addresses(value: str):
+    """
+    argument type of the address of the other endpoint: a comma separated list of its addresses, one per path.
+    """
+    return [address.strip() for address in value.split(',') if address.strip()]
+
+
+TRANSPORTS = ('icmp', 'udp')
+
+
+def add_endpoint_arguments(parser: argparse.ArgumentParser, transports: tuple = TRANSPORTS):
+    """
+    add the arguments that tune a tunnel endpoint, shared by the forwarder and the proxy.
+    :param parser: the parser to add the arguments to.
+    :param transports: the transports to choose from, the first is the default.
+    """
+    parser.add_argument(
+        '--transport',
+        choices=transports,
+        default=transports[0],
+        help='the datagram channel to tunnel over. udp needs no root, but has to be allowed on the network',
+    )
+    parser.add_argument(
+        '--udp-port',
+        type=int,
+        default=udp_transport.UDPTransport.DEFAULT_PORT,
+        help='local port of the udp transport',
+    )
+    parser.add_argument(
+        '--udp-peer-port',
+        type=int,
+        help='port of the other endpoint, on the udp transport. the local port by default',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of worker processes, each serving a share of the clients',
+    )
+    parser.add_argument(
+        '--no-kernel-filter',
+        action='store_true',
+        help='dont attach a BPF filter to the icmp socket, and filter every icmp packet on the host in python',
+    )
+    parser.add_argument(
+        '--max-window',
+        type=int,
+        default=congestion.CongestionController.MAX_WINDOW,
+        help='maximal congestion window, in packets',
+    )
+    parser.add_argument(
+        '--max-rate',
+        type=float,
+        default=congestion.Pacer.MAX_RATE,
+        help='maximal sending rate on the icmp channel, in packets per second',
+    )
+    parser.add_argument(
+        '--no-binary-codec',
+        action='store_true',
+        help='always encode tunnel packets with protobuf, even if the other endpoint supports the binary codec',
+    )
+    parser.add_argument(
+        '--receive-batch-size',
+        type=int,
+        default=transport.Transport.DEFAULT_MAX_BATCH_SIZE,
+        help='maximal number of packets read from the icmp socket at once',
+    )
+    parser.add_argument(
+        '--no-coalescing',
+        action='store_true',
+        help='send every tunnel packet in its own icmp packet',
+    )
+    parser.add_argument(
+        '--coalescing-delay',
+        type=float,
+        default=coalescer.Coalescer.DEFAULT_FLUSH_DELAY,
+        help='maximal time to hold a small packet, waiting for more packets to send with it, in seconds',
+    )
+    parser.add_argument(
+        '--no-path-mtu-discovery',
+        action='store_true',
+        help='dont probe the path to the other endpoint, and keep the initial payload size',
+    )
+    parser.add_argument(
+        '--max-payload-size',
+        type=int,
+        default=path_mtu.PathMTUProber.DEFAULT_MAX_PAYLOAD_SIZE,
+        help='maximal icmp payload size that path MTU discovery may settle on, in bytes',
+    )
+    parser.add_argument(
+        '--no-delayed-acks',
+        action='store_true',
+        help='ack every data packet right away',
+    )
+    parser.add_argument(
+        '--segments-per-ack',
+        type=int,
+        default=delayed_ack.DelayedAcks.DEFAULT_SEGMENTS_PER_ACK,
+        help='number of in order data packets acked by a single delayed ack',
+    )
+    parser.add_argument(
+        '--ack-delay',
+        type=float,
+        default=delayed_ack.DelayedAcks.DEFAULT_DELAY,
+        help='maximal time to delay an ack, waiting for more data to ack or to piggyback it on, in seconds',
+    )
+    parser.add_argument(
+        '--no-flow-control',
+        action='store_true',
+        help='dont advertise receive windows, and dont limit the data sent by the windows the other endpoint advertises',
+    )
+    parser.add_argument(
+        '--receive-window',
+        type=int,
+        default=client_session.ClientSession.DEFAULT_RECEIVE_BUFFER_SIZE,
+        help='maximal amount of data buffered for a single client, in bytes',
+    )
+    parser.add_argument(
+        '--max-clients',
+        type=int,
+        default=0,
+        help='maximal number of clients, new clients beyond it are turned away. 0 for no limit',
+    )
+    parser.add_argument(
+        '--max-clients-per-peer',
+        type=int,
+        default=0,
+        help='maximal number of clients of a single address: of the connecting host on the forwarder, of the '
+             'destination on the proxy. 0 for no limit',
+    )
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        default=0.0,
+        help='end clients that sent and received no data for this many seconds. 0 never ends idle clients',
+    )
+    parser.add_argument(
+        '--keepalive',
+        type=float,
+        default=client_manager.ClientManager.DEFAULT_KEEPALIVE,
+        help='seconds without data after which the connection of a client is probed with tcp keepalive, to end the '
+             'clients whose peer went away. 0 turns keepalive off',
+    )
+    parser.add_argument(
+        '--no-compression',
+        action='store_true',
+        help='never compress the data of the clients',
+    )
+    parser.add_argument(
+        '--compression-level',
+        type=int,
+        default=compression.StreamCompressor.DEFAULT_LEVEL,
+        choices=range(1, 10),
+        help='zlib compression level, 1 is the fastest, 9 compresses the best',
+    )
+    parser.add_argument(
+        '--no-selective-ack',
+        action='store_true',
+        help='dont report the data received out of order, and resend lost packets only after their ack timed out',
+    )
+    parser.add_argument(
+        '--no-early-data',
+        action='store_true',
+        help='dont send the first data of a new client along with its start request, but only once it is started',
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='serve prometheus metrics over http on this port. every worker uses the next port after the previous one',
+    )
+    parser.add_argument(
+        '--metrics-host',
+        default=tunnel_endpoint.TunnelEndpoint.DEFAULT_METRICS_HOST,
+        help='address to serve the metrics on',
+    )
+    parser.add_argument(
+        '--trace-capacity',
+        type=int,
+        default=0,
+        help='trace the last packet events in a ring buffer of this many events, dumped on SIGUSR1. 0 turns it off',
+    )
+    parser.add_argument(
+        '--trace-sample-every',
+        type=int,
+        default=packet_tracer.PacketTracer.DEFAULT_SAMPLE_EVERY,
+        help='trace only the packets whose sequence number is a multiple of this',
+    )
+    parser.add_argument(
+        '--trace-path',
+        default=tunnel_endpoint.TunnelEndpoint.DEFAULT_TRACE_PATH,
+        help='file to dump the packet trace to. every worker dumps to this path, suffixed with its shard',
+    )
+
+
+def add_proxy_arguments(parser: argparse.ArgumentParser):
+    """
+    add the arguments that tune how the proxy connects to the destinations.
+    """
+    parser.add_argument(
+        '--connection-pool-size',
+        type=int,
+        default=connection_pool.ConnectionPool.DEFAULT_SIZE,
+        help='connections to keep open to every destination that was connected to, for new clients to take. '
+             '0 opens a connection for every client',
+    )
+    parser.add_argument(
+        '--resolver-ttl',
+        type=float,
+        default=resolver.ResolverCache.DEFAULT_TTL,
+        help='seconds to keep the resolved addresses of a destination. 0 resolves for every client',
+    )
+
+
+def proxy_kwargs(args: argparse.Namespace):
+    """
+    convert the parsed proxy arguments to keyword arguments of Proxy.
+    """
+    return {
+        'connection_pool_size': args.connection_pool_size,
+        'resolver_ttl': args.resolver_ttl,
+    }
+
+
+def check_endpoint_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """
+    exit with a usage error if the endpoint arguments cant be used together.
+    """
+    if args.transport == 'udp' and args.workers > 1:
+        parser.error('--workers needs the icmp transport, workers cant share a udp port')
+    if args.trace_sample_every < 1:
+        parser.error('--trace-sample-every must be positive')
+
+
+def transport_factory(args: argparse.Namespace):
+    """
+    :return: the transport factory for TunnelEndpoint, None for a transport that the caller creates.
+    """
+    if args.transport == 'icmp':
+        return icmp_socket.ICMPSocket
+    if args.transport == 'udp':
+        return functools.partial(udp_transport.UDPTransport, port=args.udp_port, peer_port=args.udp_peer_port)
+    return None
+
+
+def endpoint_kwargs(args: argparse.Namespace):
+    """
+    convert the parsed endpoint arguments to keyword arguments of TunnelEndpoint.
+    :param args: the parsed arguments.
+    :return: dict of keyword arguments.
+    """
+    kwargs = {
+        'kernel_filter': not args.no_kernel_filter,
+        'max_congestion_window': args.max_window,
+        'max_send_rate': args.max_rate,
+        'binary_codec': not args.no_binary_codec,
+        'receive_batch_size': args.receive_batch_size,
+        'coalescing': not args.no_coalescing,
+        'coalescing_delay': args.coalescing_delay,
+        'path_mtu_discovery': not args.no_path_mtu_discovery,
+        'max_payload_size': args.max_payload_size,
+        'delayed_acks': not args.no_delayed_acks,
+        'segments_per_ack': args.segments_per_ack,
+        'ack_delay': args.ack_delay,
+        'flow_control': not args.no_flow_control,
+        'receive_window': args.receive_window,
+        'max_clients': args.max_clients,
+        'max_clients_per_peer': args.max_clients_per_peer,
+        'idle_timeout': args.idle_timeout,
+        'keepalive': args.keepalive,
+        'payload_compression': not args.no_compression,
+        'compression_level': args.compression_level,
+        'selective_ack': not args.no_selective_ack,
+        'early_data': not args.no_early_data,
+        'metrics_port': args.metrics_port,
+        'metrics_host': args.metrics_host,
+        'trace_capacity': args.trace_capacity,
+        'trace_sample_every': args.trace_sample_every,
+        'trace_path': args.trace_path,
+    }
+    factory = transport_factory(args)
+    if factory is not None:
+        kwargs['transport'] = factory
+    return kwargs
@@ -28,3 +28,23 @@ class InvalidICMPCode(Exception):
 
 class RecvReturnedEmptyString(Exception):
     pass
+
+
+class InvalidTunnelPacket(Exception):
+    pass
+
+
+class InvalidICMPType(Exception):
+    pass
+
+
+class TruncatedICMPPacket(Exception):
+    pass
+
+
+class CorruptedStreamError(Exception):
+    pass
+
+
+class InvalidTraceFile(Exception):
+    pass
@@ -1,7 +1,9 @@
+import random
 import asyncio
 import logging
+import itertools
 from TCPoverICMP import tunnel_endpoint, tcp_server
-from TCPoverICMP.proto import Tunnel
+from TCPoverICMP.tunnel_packet import TunnelPacket, Action, Direction, Capability
 
 
 log = logging.getLogger(__name__)
@@ -9,22 +11,43 @@ log = logging.getLogger(__name__)
 
 class Forwarder(tunnel_endpoint.TunnelEndpoint):
     LOCALHOST = ''
+    EARLY_DATA_DELAY = 0.001  # how long a new client is given to send its first data, to send it with the start.
+    MAX_CLIENT_ID = 2 ** 32 - 1
 
-    def __init__(self, other_endpoint, port, destination_host, destination_port):
-        super(Forwarder, self).__init__(other_endpoint)
+    def __init__(self, other_endpoint, port, destination_host, destination_port, **kwargs):
+        super(Forwarder, self).__init__(other_endpoint, **kwargs)
         log.info(f'forwarding to {destination_host}:{destination_port}')
         self.destination_host = destination_host
         self.destination_port = destination_port
         self.incoming_tcp_connections = asyncio.Queue()
-        self.tcp_server = tcp_server.Server(self.LOCALHOST, port, self.incoming_tcp_connections)
+        self.starting_clients = {}  # client_id -> (reader, writer, early data size, peer), until the start is acked.
+        self.tcp_server = tcp_server.Server(
+            self.LOCALHOST,
+            port,
+            self.incoming_tcp_connections,
+            client_ids=self.new_client_ids(),
+            reuse_port=self.shards > 1,
+        )
         self.coroutines_to_run.append(self.tcp_server.serve_forever())
         self.coroutines_to_run.append(self.wait_for_new_connection())
 
     @property
     def direction(self):
-        return Tunnel.Direction.to_proxy
+        return Direction.to_proxy
 
-    async def handle_start_request(self, tunnel_packet: Tunnel):
+    def new_client_ids(self):
+        """
+        generate the ids of the new clients of this worker. the ids start at a random number, rather than at 0, so a
+        worker that was restarted doesnt reuse the ids of its previous run. the proxy might still hold the clients of
+        the previous run, and would take the start request of a new client for a repeated one, and splice its data
+        into the connection of the old client.
+        """
+        for client_id in itertools.count(random.getrandbits(32)):
+            client_id &= self.MAX_CLIENT_ID
+            if self.owns(client_id):
+                yield client_id
+
+    async def handle_start_request(self, tunnel_packet: TunnelPacket):
         """
         not the right endpoint for this action. therefore ignore this packet.
         """
@@ -32,21 +55,117 @@ class Forwarder(tunnel_endpoint.TunnelEndpoint):
 
     async def wait_for_new_connection(self):
         """
-        receive new connections from the server through incoming_tcp_connections queue.
+        receive new connections from the server through incoming_tcp_connections queue, and start every one of them in
+        a task, so a burst of new connections is started concurrently, instead of a round trip after another.
+        connections beyond the limits on the number of clients are closed right away.
         """
         while True:
             client_id, reader, writer = await self.incoming_tcp_connections.get()
+            peername = writer.get_extra_info('peername')
+            peer = peername[0] if peername else ''
+            if not self.client_manager.admit(peer):
+                log.debug(f'too many clients, closing the connection from {peer}')
+                self.metrics.clients_rejected.value += 1
+                writer.close()
+                continue
+            self.create_task(self.start_client(client_id, reader, writer, peer))
 
-            new_tunnel_packet = Tunnel(
-                client_id=client_id,
-                action=Tunnel.Action.start,
-                direction=self.direction,
-                ip=self.destination_host,
-                port=self.destination_port,
+    async def start_client(
+            self,
+            client_id: int,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            peer: str,
+    ):
+        """
+        send a start request for a new client, and add the client once it is acked.
+        if the other endpoint supports early data, the data the client sends right as it connects is sent along with
+        the start request (0-RTT), instead of a round trip later. it is usually the request of the client, so the
+        response is a round trip sooner. clients that wait for the destination to speak first only wait
+        EARLY_DATA_DELAY more.
+        :param client_id: the id of the new client.
+        :param reader: the reader of the client connection.
+        :param writer: the writer of the client connection.
+        :param peer: the address the client was admitted for.
+        """
+        new_tunnel_packet = TunnelPacket(
+            client_id=client_id,
+            action=Action.start,
+            direction=self.direction,
+            ip=self.destination_host,
+            port=self.destination_port,
+            capabilities=self.capabilities,
+        )
+        if self.negotiated_capabilities & Capability.early_data:
+            # the start request and the data have to fit in a packet, like a data segment does.
+            new_tunnel_packet.payload = await self.read_early_data(
+                reader,
+                self.client_manager.segment_size - len(self.codec.encode(new_tunnel_packet)),
             )
-            # only add client if other endpoint acked.
-            if await self.send_icmp_packet_and_wait_for_ack(new_tunnel_packet):
-                self.client_manager.add_client(client_id, reader, writer)
-            else:  # if the other endpoint didnt receive the start request, close the local client.
-                writer.close()
-                await writer.wait_closed()
+
+        # only add client if other endpoint accepted the start. it is added by start_accepted.
+        self.starting_clients[client_id] = (reader, writer, len(new_tunnel_packet.payload), peer)
+        if not await self.send_icmp_packet_and_wait_for_ack(new_tunnel_packet):
+            if self.starting_clients.pop(client_id, None) is None:  # it was accepted, and is ended like any client.
+                return
+            # if the other endpoint didnt receive the start request, close the local client.
+            self.client_manager.release(peer)
+            writer.close()
+            await writer.wait_closed()
+
+    def start_accepted(self, client_id: int):
+        """
+        add a starting client, since the other endpoint accepted its start request. it is added right away, instead of
+        once start_client is resumed: the other endpoint might send data of the client right after the ack (the
+        response to the early data), and it might even arrive in the same icmp packet. it would be dropped if the client
+        wasnt added yet.
+        :param client_id: the client whose start was accepted. nothing is done if it isnt starting.
+        """
+        starting_client = self.starting_clients.pop(client_id, None)
+        if starting_client is not None:
+            reader, writer, early_data_size, peer = starting_client
+            self.client_manager.add_client(client_id, reader, writer, early_data_size, peer)
+
+    def handle_ack_request(self, tunnel_packet: TunnelPacket):
+        self.start_accepted(tunnel_packet.client_id)
+        super(Forwarder, self).handle_ack_request(tunnel_packet)
+
+    def handle_data_request(self, tunnel_packet: TunnelPacket):
+        """
+        data of a starting client means its start was accepted, even if the ack of the start was lost.
+        """
+        self.start_accepted(tunnel_packet.client_id)
+        super(Forwarder, self).handle_data_request(tunnel_packet)
+
+    async def handle_end_request(self, tunnel_packet: TunnelPacket):
+        """
+        an end request of a starting client means the other endpoint refused it (like when it has too many clients),
+        or accepted it and ended it right away while the ack of the start was lost. either way it has nothing to
+        forward, so its connection is closed and its place is given back, without adding it.
+        """
+        starting_client = self.starting_clients.pop(tunnel_packet.client_id, None)
+        if starting_client is None:
+            await super(Forwarder, self).handle_end_request(tunnel_packet)
+            return
+
+        log.debug(f'start refused: (client_id={tunnel_packet.client_id}). closing the client.')
+        _, writer, _, peer = starting_client
+        for packet in self.retransmissions.pop_client(tunnel_packet.client_id):  # stop retransmitting the start.
+            self.finish_packet(packet, False)
+        self.client_manager.release(peer)
+        writer.close()
+        self.send_ack(tunnel_packet)
+
+    async def read_early_data(self, reader: asyncio.StreamReader, size: int):
+        """
+        read the data a new client sends right as it connects, waiting for it no more than EARLY_DATA_DELAY.
+        :param reader: the reader of the client connection.
+        :param size: maximal length of data to read.
+        :return: the data, empty if there was none. errors are left for the reader of the client to find.
+        """
+        if size <= 0:
+            return b''
+        try:
+            return await asyncio.wait_for(reader.read(size), self.EARLY_DATA_DELAY)
+        except (asyncio.TimeoutError, ConnectionError):
+            return b''
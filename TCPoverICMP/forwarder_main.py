@@ -1,29 +1,51 @@
-import asyncio
+import sys
+import signal
 import logging
 import argparse
-from TCPoverICMP import forwarder
+from TCPoverICMP import forwarder, endpoint_arguments, sharding
 
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('proxy_ip', help='IP address of the proxy server')
+    parser.add_argument(
+        'proxy_ip',
+        type=endpoint_arguments.addresses,
+        help='IP address of the proxy server, or several comma separated addresses to stripe the tunnel across',
+    )
     parser.add_argument('listening_port', type=int, help='Port on which the forwarder will listen')
     parser.add_argument('destination_ip', help='IP address to forward to')
     parser.add_argument('destination_port', type=int, help='port to forward to')
-    return parser.parse_args()
-
-
-async def main():
-    args = parse_args()
-    await forwarder.Forwarder(args.proxy_ip, args.listening_port, args.destination_ip, args.destination_port).run()
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+        help='DEBUG logs rare per packet events, like ignored packets. use --trace-capacity to trace every packet',
+    )
+    endpoint_arguments.add_endpoint_arguments(parser)
+    args = parser.parse_args()
+    endpoint_arguments.check_endpoint_arguments(parser, args)
+    return args
+
+
+async def main(args: argparse.Namespace, shard: int = 0, shards: int = 1):
+    await forwarder.Forwarder(
+        args.proxy_ip,
+        args.listening_port,
+        args.destination_ip,
+        args.destination_port,
+        shard=shard,
+        shards=shards,
+        **endpoint_arguments.endpoint_kwargs(args),
+    ).run()
 
 
 def start_asyncio_main():
-    asyncio.run(main())
+    args = parse_args()
+    logging.basicConfig(level=args.log_level)
+    sys.exit(sharding.run_shards(main, args, args.workers, (signal.SIGUSR1,) if args.trace_capacity else ()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,148 @@
+import ctypes
+import socket
+import struct
+from typing import Sequence
+
+
+# classic BPF opcodes, from linux/filter.h.
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_ALU = 0x04
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MSH = 0xa0
+BPF_K = 0x00
+BPF_AND = 0x50
+BPF_MOD = 0x90
+BPF_JA = 0x00
+BPF_JEQ = 0x10
+
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+INSTRUCTION_STRUCT = struct.Struct('HBBI')
+PROGRAM_STRUCT = struct.Struct('HP')  # struct sock_fprog
+
+ACCEPT = 'accept'
+REJECT = 'reject'
+ACCEPT_LENGTH = 0x40000  # accept the whole packet.
+
+
+class Program:
+    """
+    a tiny assembler for classic BPF programs. jump targets are labels, and are resolved by assemble.
+    """
+    def __init__(self):
+        self._instructions = []
+        self._labels = {}
+
+    def label(self, name: str):
+        self._labels[name] = len(self._instructions)
+
+    def add(self, code: int, k: int = 0, true: str = None, false: str = None):
+        """
+        :param code: the opcode.
+        :param k: the constant operand.
+        :param true: label to jump to if a conditional jump is taken, None for the next instruction.
+        :param false: label to jump to if a conditional jump isnt taken, None for the next instruction.
+        """
+        self._instructions.append((code, true, false, k))
+
+    def assemble(self):
+        """
+        :return: the program, as an array of struct sock_filter.
+        """
+        def offset(index: int, label: str):
+            if label is None:
+                return 0
+            return self._labels[label] - index - 1
+
+        return b''.join(
+            INSTRUCTION_STRUCT.pack(code, offset(index, true), offset(index, false), k)
+            for index, (code, true, false, k) in enumerate(self._instructions)
+        )
+
+
+def tunnel_filter(
+        icmp_types: tuple,
+        identifier: int,
+        sequence_number: int,
+        source_addresses: Sequence[str] = (),
+        shard: int = 0,
+        shards: int = 1,
+        marker_offset: int = None,
+        marker: int = 0,
+        direction_offset: int = None,
+        direction_mask: int = 0,
+        direction: int = 0,
+):
+    """
+    build a filter that only accepts the icmp packets of the tunnel, as received on a raw IPPROTO_ICMP socket.
+    :param icmp_types: the accepted icmp types.
+    :param identifier: the icmp identifier of the tunnel.
+    :param sequence_number: the icmp sequence number of packets that arent steered to a shard.
+    :param source_addresses: the IPv4 addresses of the other endpoint, empty to accept any source.
+    :param shard: the shard of this worker. packets steered to other shards are rejected.
+    :param shards: the number of shards. with a single shard, steered packets are rejected.
+    :param marker_offset: offset in the icmp payload of a byte that marks payloads with a direction field.
+    :param marker: the value of the marker byte.
+    :param direction_offset: offset in the icmp payload of the direction field, in marked payloads.
+    :param direction_mask: the bits of the direction field.
+    :param direction: the accepted direction, unmarked payloads are accepted in any direction.
+    :return: the assembled program.
+    """
+    program = Program()
+    if source_addresses:
+        program.add(BPF_LD | BPF_W | BPF_ABS, 12)  # the source address of the IP header.
+        addresses = [int.from_bytes(socket.inet_aton(source_address), 'big') for source_address in source_addresses]
+        for address in addresses[:-1]:
+            program.add(BPF_JMP | BPF_JEQ | BPF_K, address, true='source')
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, addresses[-1], false=REJECT)
+        program.label('source')
+
+    program.add(BPF_LDX | BPF_B | BPF_MSH, 0)  # X = the length of the IP header, the icmp header is right after it.
+    program.add(BPF_LD | BPF_B | BPF_IND, 0)
+    for icmp_type in icmp_types[:-1]:
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, icmp_type, true='type')
+    program.add(BPF_JMP | BPF_JEQ | BPF_K, icmp_types[-1], false=REJECT)
+    program.label('type')
+    program.add(BPF_LD | BPF_B | BPF_IND, 1)
+    program.add(BPF_JMP | BPF_JEQ | BPF_K, 0, false=REJECT)  # the code.
+    program.add(BPF_LD | BPF_H | BPF_IND, 4)
+    program.add(BPF_JMP | BPF_JEQ | BPF_K, identifier, false=REJECT)
+
+    program.add(BPF_LD | BPF_H | BPF_IND, 6)
+    if shards > 1:
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, sequence_number, true='direction')
+        program.add(BPF_ALU | BPF_MOD | BPF_K, shards)
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, shard, false=REJECT)
+    else:
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, sequence_number, false=REJECT)
+
+    program.label('direction')
+    if marker_offset is not None:
+        program.add(BPF_LD | BPF_B | BPF_IND, 8 + marker_offset)
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, marker, false=ACCEPT)
+        program.add(BPF_LD | BPF_B | BPF_IND, 8 + direction_offset)
+        program.add(BPF_ALU | BPF_AND | BPF_K, direction_mask)
+        program.add(BPF_JMP | BPF_JEQ | BPF_K, direction, false=REJECT)
+
+    program.label(ACCEPT)
+    program.add(BPF_RET | BPF_K, ACCEPT_LENGTH)
+    program.label(REJECT)
+    program.add(BPF_RET | BPF_K, 0)
+    return program.assemble()
+
+
+def attach_filter(sock: socket.socket, program: bytes):
+    """
+    attach a classic BPF program to a socket (SO_ATTACH_FILTER). the kernel drops the packets it rejects.
+    :param sock: the socket to filter.
+    :param program: the assembled program.
+    """
+    instructions = ctypes.create_string_buffer(program)
+    fprog = PROGRAM_STRUCT.pack(len(program) // INSTRUCTION_STRUCT.size, ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
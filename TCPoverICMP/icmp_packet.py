@@ -1,8 +1,6 @@
 import struct
-import socket
 import enum
-from dataclasses import dataclass
-from TCPoverICMP import exceptions
+from TCPoverICMP import exceptions, checksum
 
 
 class ICMPType(enum.Enum):
@@ -10,80 +8,107 @@ class ICMPType(enum.Enum):
     EchoRequest = 8
 
 
-@dataclass
 class ICMPPacket:
-    type: ICMPType
-    identifier: int
-    sequence_number: int
-    payload: bytes
+    __slots__ = ('type', 'identifier', 'sequence_number', 'payload', '_checksum', '_summed_header_words', '_summed_payload')
 
     ICMP_STRUCT = struct.Struct('>BBHHH')
     CODE = 0
+    TYPES = {icmp_type.value: icmp_type for icmp_type in ICMPType}
+
+    def __init__(self, type: ICMPType, identifier: int, sequence_number: int, payload: bytes):
+        self.type = type
+        self.identifier = identifier
+        self.sequence_number = sequence_number
+        self.payload = payload
+        self._checksum = None
+        self._summed_header_words = None
+        self._summed_payload = None
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(type={self.type}, identifier={self.identifier}, '
+                f'sequence_number={self.sequence_number}, payload={bytes(self.payload)})')
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.type, self.identifier, self.sequence_number, self.payload) == \
+            (other.type, other.identifier, other.sequence_number, other.payload)
 
     @classmethod
     def deserialize(cls, packet: bytes):
         """
         classmethod for building ICMPPackets based on a stream of bytes
-        :param packet: the packet that needs to be deserialized into ICMPPacket
+        :param packet: the packet that needs to be deserialized into ICMPPacket.
+        if it is a memoryview, the payload is a view of it as well, and isnt copied.
         :return: the built ICMPPacket
         """
-        raw_type, code, checksum, identifier, sequence_number = cls.ICMP_STRUCT.unpack(packet[:cls.ICMP_STRUCT.size])
+        if len(packet) < cls.ICMP_STRUCT.size:
+            raise exceptions.TruncatedICMPPacket()
+
+        raw_type, code, _, identifier, sequence_number = cls.ICMP_STRUCT.unpack_from(packet)
 
         if code != cls.CODE:
             raise exceptions.InvalidICMPCode()
 
-        computed_checksum = cls.compute_checksum(
-            cls.ICMP_STRUCT.pack(raw_type, code, 0, identifier, sequence_number) + packet[cls.ICMP_STRUCT.size:]
-        )
+        if raw_type not in cls.TYPES:
+            raise exceptions.InvalidICMPType()
 
-        if checksum != computed_checksum:
+        # summing a packet together with its checksum gives 0xffff, so there is no need to rebuild it without the checksum.
+        if checksum.ones_complement_sum(packet) != checksum.WORD_MASK:
             raise exceptions.WrongChecksumOnICMPPacket()
 
-        return cls(ICMPType(raw_type), identifier, sequence_number, packet[cls.ICMP_STRUCT.size:])
+        return cls(cls.TYPES[raw_type], identifier, sequence_number, packet[cls.ICMP_STRUCT.size:])
 
     def serialize(self):
         """
         serialize an instance of a ICMPPacket into a stream of bytes
         :return: the current ICMPPacket, serialized
         """
-        packet_without_checksum = self.ICMP_STRUCT.pack(
-            self.type.value,
-            self.CODE,
-            0,
-            self.identifier,
-            self.sequence_number
-        ) + self.payload
-        checksum = self.compute_checksum(data=packet_without_checksum)
+        header = bytearray(self.ICMP_STRUCT.size)
+        self.pack_header_into(header)
+        return bytes(header) + self.payload
 
-        return self.ICMP_STRUCT.pack(
+    def pack_header_into(self, buffer: bytearray, offset: int = 0):
+        """
+        pack the header of the packet, checksum included, into a preallocated buffer.
+        used for sending the header and the payload without concatenating them.
+        :param buffer: writable buffer with room for ICMP_STRUCT.size bytes.
+        :param offset: where to pack the header in the buffer.
+        """
+        self.ICMP_STRUCT.pack_into(
+            buffer,
+            offset,
             self.type.value,
             self.CODE,
-            checksum,
+            self.packet_checksum(),
             self.identifier,
             self.sequence_number
-        ) + self.payload
-
-    # Taken from https://github.com/Akhavi/pyping/blob/master/pyping/core.py
-    @staticmethod
-    def compute_checksum(data: bytes):
-        count_to = (int(len(data) / 2)) * 2
-        total = 0
-        count = 0
-
-        while count < count_to:
-            total += int.from_bytes(data[count:count+2], byteorder='little')
-            count += 2
+        )
 
-        # Handle last byte if applicable (odd-number of bytes)
-        if count_to < len(data):  # Check for odd length
-            total += data[-1]
+    def packet_checksum(self):
+        """
+        compute the checksum of the packet.
+        the payload is summed once. later changes to the header update the checksum incrementally (RFC 1624).
+        :return: the checksum of the packet.
+        """
+        header_words = ((self.type.value << 8) | self.CODE, self.identifier, self.sequence_number)
 
-        total &= 0xffffffff  # Truncate sum to 32 bits (a variance from ping.c, which
-        # uses signed ints, but overflow is unlikely in ping)
+        if self._checksum is None or self._summed_payload is not self.payload:
+            self._checksum = ~checksum.add(*header_words, checksum.ones_complement_sum(self.payload)) & checksum.WORD_MASK
+            self._summed_payload = self.payload
+        else:
+            for old_word, new_word in zip(self._summed_header_words, header_words):
+                if old_word != new_word:
+                    self._checksum = checksum.update_checksum(self._checksum, old_word, new_word)
 
-        total = (total >> 16) + (total & 0xffff)    # Add high 16 bits to low 16 bits
-        total += (total >> 16)					# Add carry from above (if any)
-        result = ~total & 0xffff				# Invert and truncate to 16 bits
-        result = socket.htons(result)
+        self._summed_header_words = header_words
+        return self._checksum
 
-        return result
+    @staticmethod
+    def compute_checksum(data: bytes):
+        """
+        compute the internet checksum of data.
+        :param data: the data to compute the checksum of.
+        :return: the checksum, ready to be packed in network order.
+        """
+        return checksum.internet_checksum(data)
@@ -3,22 +3,44 @@ import asyncio
 import socket
 import logging
 import contextlib
-from TCPoverICMP import icmp_packet, exceptions
+from typing import Callable
+from TCPoverICMP import icmp_packet, exceptions, icmp_filter, metrics, transport
 
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
 
 
-class ICMPSocket(object):
-    IP_HEADER_LENGTH = 20
+class ICMPSocket(transport.Transport):
+    """
+    the icmp transport: a raw socket, that sniffs every icmp packet the host receives.
+    """
     MINIMAL_PACKET = b'\x00\x00'
     DEFAULT_DESTINATION_PORT = 0
     DEFAULT_DESTINATION = ('', DEFAULT_DESTINATION_PORT)
-    DEFAULT_BUFFERSIZE = 4096
+    MAX_HEADERS_SIZE = 60 + icmp_packet.ICMPPacket.ICMP_STRUCT.size  # maximal IP header, and the ICMP header.
+    INVALID_PACKET_ERRORS = (
+        exceptions.InvalidICMPCode,
+        exceptions.InvalidICMPType,
+        exceptions.WrongChecksumOnICMPPacket,
+        exceptions.TruncatedICMPPacket,
+    )
 
-    def __init__(self, incoming_queue: asyncio.Queue):
-        self.incoming_queue = incoming_queue
+    def __init__(
+            self,
+            packet_received: Callable[[icmp_packet.ICMPPacket], None],
+            max_batch_size: int = transport.Transport.DEFAULT_MAX_BATCH_SIZE,
+            max_payload_size: int = transport.Transport.DEFAULT_BUFFERSIZE,
+            sequence_number_filter: Callable[[int], bool] = None,
+            endpoint_metrics: metrics.EndpointMetrics = None,
+    ):
+        super(ICMPSocket, self).__init__(
+            packet_received,
+            max_batch_size,
+            max_payload_size,
+            sequence_number_filter,
+            endpoint_metrics,
+        )
+        self.buffersize = max(self.DEFAULT_BUFFERSIZE, max_payload_size + self.MAX_HEADERS_SIZE)
 
         try:
             self._icmp_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
@@ -26,34 +48,108 @@ class ICMPSocket(object):
             log.fatal(f'{e}. root required for opening raw ICMP socket. rerun as root..')
             sys.exit(1)
         self._icmp_socket.setblocking(False)
+        with contextlib.suppress(OSError):  # a bigger socket buffer absorbs bursts between two drains of the socket.
+            self._icmp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER_SIZE)
+        self._header_buffer = bytearray(icmp_packet.ICMPPacket.ICMP_STRUCT.size)
+        self._receive_buffer = bytearray(self.buffersize)
         self._icmp_socket.sendto(self.MINIMAL_PACKET, self.DEFAULT_DESTINATION)  # need to send one packet, because didnt bind. otherwise exception is raised when using on first packet.
 
-    async def recv(self, buffersize: int = DEFAULT_BUFFERSIZE):
+    def attach_filter(self, program: bytes):
+        """
+        attach a classic BPF program to the socket, so the kernel drops the packets it rejects before they are queued.
+        raises OSError if the kernel refuses the program.
+        :param program: the assembled program, see icmp_filter.
+        """
+        icmp_filter.attach_filter(self._icmp_socket, program)
+
+    @staticmethod
+    def parse(data: memoryview):
+        """
+        parse a raw packet, as received from the socket.
+        :param data: the received packet, including the IP header.
+        :return: an instance of ICMPPacket. the payload is a view of data.
+        """
+        if not data:
+            raise exceptions.RecvReturnedEmptyString()
+        ip_header_length = (data[0] & 0x0f) * 4  # the IHL field, in 32 bit words.
+        return icmp_packet.ICMPPacket.deserialize(data[ip_header_length:])  # packet includes IP header, so remove it.
+
+    async def recv(self, buffersize: int = transport.Transport.DEFAULT_BUFFERSIZE):
         """
         receive a single ICMP packet.
         :param buffersize:  maximal length of data to receive.
         :return: an instance of ICMPPacket, representing a sniffed ICMP packet.
         """
         data = await asyncio.get_event_loop().sock_recv(self._icmp_socket, buffersize)
-        if not data:
-            raise exceptions.RecvReturnedEmptyString()
-        return icmp_packet.ICMPPacket.deserialize(data[self.IP_HEADER_LENGTH:])  # packet includes IP header, so remove it.
+        return self.parse(memoryview(data))
 
     async def wait_for_incoming_packet(self):
         """
-        "listen" on the socket, pretty much sniff raw for ICMP packets, and put them in the incoming ICMP queue.
-        :return:
+        "listen" on the socket, pretty much sniff raw for ICMP packets, and hand them to the endpoint.
+        instead of awaiting every packet, the socket is drained in batches whenever it becomes readable.
         """
-        while True:
-            with contextlib.suppress(exceptions.InvalidICMPCode):
-                packet = await self.recv()
-                await self.incoming_queue.put(packet)
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self._icmp_socket.fileno(), self.drain)
+        try:
+            await loop.create_future()  # never completes, the reader callback does the work.
+        finally:
+            loop.remove_reader(self._icmp_socket.fileno())
+
+    def drain(self):
+        """
+        read all the pending packets from the socket, up to max_batch_size, into the preallocated receive buffer.
+        every valid packet is handed to the endpoint before the next one is read.
+        packets rejected by the sequence number filter are dropped before they are parsed.
+        """
+        receive_buffer = self._receive_buffer
+        for _ in range(self.max_batch_size):
+            try:
+                length = self._icmp_socket.recv_into(receive_buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            if self.sequence_number_filter is not None and length:
+                sequence_number_offset = (receive_buffer[0] & 0x0f) * 4 + 6
+                if length >= sequence_number_offset + 2 and not self.sequence_number_filter(
+                        int.from_bytes(receive_buffer[sequence_number_offset:sequence_number_offset + 2], 'big')):
+                    continue
+
+            try:
+                packet = self.parse(memoryview(receive_buffer)[:length])
+            except exceptions.WrongChecksumOnICMPPacket:
+                self.metrics.drop('bad_checksum', length)
+                continue
+            except self.INVALID_PACKET_ERRORS + (exceptions.RecvReturnedEmptyString,):
+                self.metrics.drop('invalid_icmp', length)
+                continue
+            packet.payload = bytes(packet.payload)  # the receive buffer is reused by the next packet.
+            self.deliver(packet, length)
 
     def sendto(self, packet: icmp_packet.ICMPPacket, destination: str):
         """
         receive an icmp packet, and sent it to the destination.
+        the header is packed into a reusable buffer, and sent together with the payload using scatter-gather io,
+        so the packet is never concatenated.
         :param packet: an instance if ICMPPacket that is to be sent.
         :param destination: the IP of the destination.
         """
-        log.debug(f'sending {packet.payload} to {destination}')
-        self._icmp_socket.sendto(packet.serialize(), (destination, self.DEFAULT_DESTINATION_PORT))
+        packet.pack_header_into(self._header_buffer)
+        self._icmp_socket.sendmsg(
+            (self._header_buffer, packet.payload),
+            (),
+            0,
+            (destination, self.DEFAULT_DESTINATION_PORT),
+        )
+        self.metrics.packets_sent.value += 1
+        self.metrics.bytes_sent.value += len(self._header_buffer) + len(packet.payload)
+
+    def send_probe(self, packet: icmp_packet.ICMPPacket, destination: str):
+        """
+        send a path MTU probe. unlike regular packets, that the kernel fragments if they are bigger than the path MTU
+        it knows of, a probe is always sent with the DF flag, so it is dropped on the way if it is too big.
+        raises OSError if the probe is bigger than the MTU of the local interface.
+        :param packet: an instance if ICMPPacket, padded to the probed size.
+        :param destination: the IP of the destination.
+        """
+        with self.dont_fragment(self._icmp_socket):
+            self.sendto(packet, destination)
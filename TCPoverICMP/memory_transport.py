@@ -0,0 +1,136 @@
+import random
+import asyncio
+from typing import Callable
+from TCPoverICMP import icmp_packet, metrics, transport
+
+
+class MemoryNetwork:
+    """
+    an in-memory network between the memory transports of endpoints that run in the same process. it delivers the
+    packets sent on it as is by default, or impairs them like a real path would: a bandwidth limit, latency and jitter,
+    loss, duplication, reordering, and an MTU. the jitter of every packet is picked on its own, so it reorders them too.
+    """
+    DEFAULT_MTU = 1500
+    HEADERS_SIZE = 20 + icmp_packet.ICMPPacket.ICMP_STRUCT.size  # IP header without options, and the ICMP header.
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            loss: float = 0.0,
+            duplicate: float = 0.0,
+            reorder: float = 0.0,
+            reorder_delay: float = 0.005,
+            bandwidth: float = 0.0,
+            mtu: int = DEFAULT_MTU,
+            seed: int = None,
+    ):
+        """
+        :param latency: one way delay of every packet, in seconds.
+        :param jitter: maximal extra delay of a packet, picked uniformly, in seconds.
+        :param loss: probability of dropping a packet.
+        :param duplicate: probability of delivering a packet twice.
+        :param reorder: probability of holding a packet back by reorder_delay seconds, so later packets overtake it.
+        :param bandwidth: bytes per second each direction of the link can carry, 0 for unlimited.
+        :param mtu: packets bigger than this are fragmented, or dropped if they are sent with the DF flag.
+        :param seed: seed of the random impairments, for reproducible runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.bandwidth = bandwidth
+        self.mtu = mtu
+        self.random = random.Random(seed)
+        self.transports = {}
+        self._link_free_at = {}  # destination -> the time the link to it finishes sending its queued packets.
+
+    def transport(self, address: str):
+        """
+        :return: a transport factory for TunnelEndpoint, that creates a memory transport bound to address.
+        """
+        def create_transport(*args, **kwargs):
+            memory_transport = MemoryTransport(self, address, *args, **kwargs)
+            self.transports[address] = memory_transport
+            return memory_transport
+        return create_transport
+
+    def send(self, packet: icmp_packet.ICMPPacket, destination: str, dont_fragment: bool = False):
+        """
+        send a packet on the network. it is delivered to the transport bound to the destination, if there is one.
+        """
+        size = self.HEADERS_SIZE + len(packet.payload)
+        if dont_fragment and size > self.mtu:
+            return
+        if self.random.random() < self.loss:
+            return
+
+        loop = asyncio.get_running_loop()
+        departure = loop.time()
+        if self.bandwidth:
+            departure = max(departure, self._link_free_at.get(destination, 0.0)) + size / self.bandwidth
+            self._link_free_at[destination] = departure
+
+        packet = icmp_packet.ICMPPacket(
+            type=packet.type,
+            identifier=packet.identifier,
+            sequence_number=packet.sequence_number,
+            payload=bytes(packet.payload),
+        )
+        copies = 2 if self.random.random() < self.duplicate else 1
+        for _ in range(copies):
+            delay = departure - loop.time() + self.latency + self.random.uniform(0, self.jitter)
+            if self.random.random() < self.reorder:
+                delay += self.reorder_delay
+            loop.call_later(delay, self.deliver, packet, destination, size)
+
+    def deliver(self, packet: icmp_packet.ICMPPacket, destination: str, size: int):
+        destination_transport = self.transports.get(destination)
+        if destination_transport is not None:
+            destination_transport.receive(packet, size)
+
+
+class MemoryTransport(transport.Transport):
+    """
+    the memory transport: a transport on a MemoryNetwork. it needs no root, and no sockets, so the protocol layers of
+    the tunnel can be benchmarked and profiled on their own.
+    """
+    def __init__(
+            self,
+            network: MemoryNetwork,
+            address: str,
+            packet_received: Callable[[icmp_packet.ICMPPacket], None],
+            max_batch_size: int = transport.Transport.DEFAULT_MAX_BATCH_SIZE,
+            max_payload_size: int = transport.Transport.DEFAULT_BUFFERSIZE,
+            sequence_number_filter: Callable[[int], bool] = None,
+            endpoint_metrics: metrics.EndpointMetrics = None,
+    ):
+        super(MemoryTransport, self).__init__(
+            packet_received,
+            max_batch_size,
+            max_payload_size,
+            sequence_number_filter,
+            endpoint_metrics,
+        )
+        self.network = network
+        self.address = address
+
+    async def wait_for_incoming_packet(self):
+        await asyncio.get_running_loop().create_future()  # packets are delivered by the network.
+
+    def receive(self, packet: icmp_packet.ICMPPacket, size: int):
+        if self.sequence_number_filter is not None and not self.sequence_number_filter(packet.sequence_number):
+            return
+        self.deliver(packet, size)
+
+    def sendto(self, packet: icmp_packet.ICMPPacket, destination: str):
+        self.metrics.packets_sent.value += 1
+        self.metrics.bytes_sent.value += icmp_packet.ICMPPacket.ICMP_STRUCT.size + len(packet.payload)
+        self.network.send(packet, destination)
+
+    def send_probe(self, packet: icmp_packet.ICMPPacket, destination: str):
+        self.metrics.packets_sent.value += 1
+        self.metrics.bytes_sent.value += icmp_packet.ICMPPacket.ICMP_STRUCT.size + len(packet.payload)
+        self.network.send(packet, destination, dont_fragment=True)
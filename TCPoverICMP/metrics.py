@@ -0,0 +1,260 @@
+import asyncio
+import bisect
+import logging
+from typing import Callable, Sequence
+
+
+log = logging.getLogger(__name__)
+
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def format_labels(label_names: Sequence[str], label_values: Sequence):
+    """
+    :return: the label set of a sample, in the prometheus text format. empty if there are no labels.
+    """
+    labels = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def format_value(value: float):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    a monotonically increasing value. incrementing it is a single attribute update, so it can stay on in the hot path.
+    a counter with label names has a child counter for every set of label values, see labels.
+    """
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.value = 0
+        self._children = {}
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def labels(self, *label_values):
+        """
+        :return: the child counter of the label values. look it up once, and keep it, in hot paths.
+        """
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._children[label_values] = Counter(self.name, self.help)
+        return child
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {COUNTER}'
+        if not self.label_names:
+            yield f'{self.name} {format_value(self.value)}'
+        for label_values, child in self._children.items():
+            yield f'{self.name}{format_labels(self.label_names, label_values)} {format_value(child.value)}'
+
+
+class Histogram:
+    """
+    counts of observed values, in cumulative buckets, along with their sum and count.
+    """
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {HISTOGRAM}'
+        cumulative_count = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            cumulative_count += count
+            yield f'{self.name}_bucket{{le="{format_value(upper_bound)}"}} {cumulative_count}'
+        yield f'{self.name}_sum {format_value(self.sum)}'
+        yield f'{self.name}_count {self.count}'
+
+
+class CollectedMetric:
+    """
+    a metric whose value is collected only when it is scraped, from state that is kept anyway, like queue sizes.
+    it costs nothing between scrapes.
+    """
+    def __init__(
+            self,
+            name: str,
+            help: str,
+            collect: Callable[[], object],
+            label_names: Sequence[str] = (),
+            type: str = GAUGE,
+    ):
+        """
+        :param collect: returns the value, or with label names, a dict of label values tuples to values.
+        :param type: the prometheus type of the metric, GAUGE or COUNTER.
+        """
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label_names = tuple(label_names)
+        self.type = type
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type}'
+        if not self.label_names:
+            yield f'{self.name} {format_value(self.collect())}'
+            return
+        for label_values, value in self.collect().items():
+            yield f'{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}'
+
+
+class Registry:
+    """
+    the metrics of a process, rendered together in the prometheus text format.
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()):
+        return self.register(Counter(name, help, label_names))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def collected(
+            self,
+            name: str,
+            help: str,
+            collect: Callable[[], object],
+            label_names: Sequence[str] = (),
+            type: str = GAUGE,
+    ):
+        return self.register(CollectedMetric(name, help, collect, label_names, type))
+
+    def render(self):
+        """
+        :return: all the metrics, in the prometheus text format.
+        """
+        return ''.join(f'{line}\n' for metric in self.metrics for line in metric.render())
+
+    async def serve(self, host: str, port: int):
+        """
+        serve the metrics over http, for prometheus to scrape, until cancelled.
+        :param host: the address to listen on.
+        :param port: the port to listen on.
+        """
+        server = await asyncio.start_server(self.handle_http_request, host, port)
+        log.info(f'serving metrics on http://{host}:{port}/metrics')
+        async with server:
+            await server.serve_forever()
+
+    async def handle_http_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        answer a single http request, with the metrics if the path is /metrics.
+        """
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():  # skip the headers.
+                pass
+
+            method, path, *_ = request_line.decode('latin-1').split() + ['', '']
+            if method == 'GET' and path.split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b''
+            header = f'HTTP/1.0 {status}\r\nContent-Type: {self.CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n\r\n'
+            writer.write(header.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class EndpointMetrics(Registry):
+    """
+    the counters and histograms of a tunnel endpoint, updated as packets go through it.
+    packets and bytes are counted per icmp packet, as sent and received on the icmp socket.
+    """
+    DROP_REASONS = (
+        'bad_checksum',
+        'invalid_icmp',
+        'wrong_magic',
+        'wrong_direction',
+        'invalid_tunnel_packet',
+        'unknown_client',
+        'receive_buffer_full',
+        'send_failed',
+    )
+
+    def __init__(self):
+        super(EndpointMetrics, self).__init__()
+        self.packets_sent = self.counter('tunnel_packets_sent_total', 'icmp packets sent')
+        self.bytes_sent = self.counter('tunnel_bytes_sent_total', 'bytes of icmp packets sent, with the icmp header')
+        self.packets_received = self.counter('tunnel_packets_received_total', 'valid icmp packets received')
+        self.bytes_received = self.counter(
+            'tunnel_bytes_received_total',
+            'bytes of valid icmp packets received, with the ip header',
+        )
+        self.packets_retransmitted = self.counter(
+            'tunnel_packets_retransmitted_total',
+            'tunnel packets sent again, after their ack timed out or they were reported missing',
+        )
+        self.packets_fast_retransmitted = self.counter(
+            'tunnel_packets_fast_retransmitted_total',
+            'tunnel packets sent again before their ack timed out, because packets sent after them were acked',
+        )
+        self.loss_probes = self.counter(
+            'tunnel_loss_probes_total',
+            'probes sent to elicit the acks of data packets that werent acked within two round trips',
+        )
+        self.bytes_retransmitted = self.counter(
+            'tunnel_bytes_retransmitted_total',
+            'bytes of encoded tunnel packets sent again',
+        )
+        self.clients_rejected = self.counter(
+            'tunnel_clients_rejected_total',
+            'new clients turned away, since the limits on the number of clients were reached',
+        )
+        packets_dropped = self.counter('tunnel_packets_dropped_total', 'received packets dropped', ('reason',))
+        bytes_dropped = self.counter('tunnel_bytes_dropped_total', 'bytes of dropped packets', ('reason',))
+        self.packets_dropped = {reason: packets_dropped.labels(reason) for reason in self.DROP_REASONS}
+        self.bytes_dropped = {reason: bytes_dropped.labels(reason) for reason in self.DROP_REASONS}
+        self.rtt = self.histogram(
+            'tunnel_rtt_seconds',
+            'round trip time of tunnel packets that were acked on their first transmission',
+        )
+        self.ack_latency = self.histogram(
+            'tunnel_ack_latency_seconds',
+            'time from the first transmission of a tunnel packet to its ack, including retransmissions',
+        )
+
+    def drop(self, reason: str, size: int, packets: int = 1):
+        """
+        count dropped packets.
+        :param reason: one of DROP_REASONS.
+        :param size: the total size of the packets, in bytes.
+        :param packets: the number of packets.
+        """
+        self.packets_dropped[reason].value += packets
+        self.bytes_dropped[reason].value += size
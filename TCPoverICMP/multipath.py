@@ -0,0 +1,118 @@
+import time
+import logging
+from typing import Sequence
+from TCPoverICMP import rtt_estimator
+
+
+log = logging.getLogger(__name__)
+
+
+class Path:
+    """
+    a single network path to the other endpoint, identified by the address packets are sent to.
+    keeps its own rtt estimation and a smoothed loss rate, measured on the data packets sent on it.
+    """
+    LOSS_GAIN = 1 / 16
+    DOWN_AFTER_LOSSES = 4
+    DOWN_AFTER_SILENCE = 1.0
+
+    def __init__(self, address: str):
+        self.address = address
+        self.rtt = rtt_estimator.RTTEstimator()
+        self.loss_rate = 0.0
+        self.consecutive_losses = 0
+        self.last_ack = time.monotonic()
+        self.down_since = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(address={self.address!r}, rtt={self.rtt}, ' \
+               f'loss_rate={self.loss_rate:.3f}, is_up={self.is_up})'
+
+    @property
+    def is_up(self):
+        return self.down_since is None
+
+    @property
+    def weight(self):
+        """
+        the share of the packets the path should get: its delivery rate, relative to the other paths.
+        """
+        rtt = self.rtt.srtt if self.rtt.srtt is not None else self.rtt.rto
+        return (1 - self.loss_rate) / max(rtt, rtt_estimator.RTTEstimator.CLOCK_GRANULARITY)
+
+    def on_ack(self, rtt: float = None):
+        """
+        a packet sent on the path was acked.
+        :param rtt: the rtt sample, None if the packet was retransmitted, and the sample is ambiguous.
+        """
+        if rtt is not None:
+            self.rtt.add_sample(rtt)
+        self.loss_rate *= 1 - self.LOSS_GAIN
+        self.consecutive_losses = 0
+        self.last_ack = time.monotonic()
+        if not self.is_up:
+            self.down_since = None
+            log.info(f'path is up again: {self}')
+
+    def on_loss(self):
+        """
+        a packet sent on the path wasnt acked in time. a path that keeps losing packets, and hasnt acked any packet
+        for DOWN_AFTER_SILENCE seconds, is taken down. a burst of losses on a working path doesnt take it down.
+        """
+        self.loss_rate = self.loss_rate * (1 - self.LOSS_GAIN) + self.LOSS_GAIN
+        self.consecutive_losses += 1
+        now = time.monotonic()
+        if self.is_up and self.consecutive_losses >= self.DOWN_AFTER_LOSSES and \
+                now - self.last_ack >= self.DOWN_AFTER_SILENCE:
+            self.down_since = now
+            log.warning(f'path is down: {self}')
+
+
+class PathScheduler:
+    """
+    spread packets over several paths to the other endpoint (striping), in proportion to the weight of each path,
+    using smooth weighted round robin.
+    paths that are down get no packets, except for a single trial packet every RETRY_INTERVAL seconds. an ack of the
+    trial packet brings the path up again. if all the paths are down, the least lossy one is used.
+    """
+    RETRY_INTERVAL = 5.0
+
+    def __init__(self, addresses: Sequence[str]):
+        self.paths = [Path(address) for address in addresses]
+        self._current_weights = {path.address: 0.0 for path in self.paths}
+        self._last_trial = {path.address: 0.0 for path in self.paths}
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def primary(self):
+        return self.paths[0]
+
+    def choose(self):
+        """
+        :return: the Path to send the next packet on.
+        """
+        if len(self.paths) == 1:
+            return self.paths[0]
+
+        now = time.monotonic()
+        for path in self.paths:
+            if not path.is_up and now - self._last_trial[path.address] >= self.RETRY_INTERVAL:
+                self._last_trial[path.address] = now
+                return path
+
+        candidates = [path for path in self.paths if path.is_up]
+        if not candidates:
+            return min(self.paths, key=lambda path: path.loss_rate)
+
+        total_weight = 0.0
+        chosen = None
+        for path in candidates:
+            weight = path.weight
+            total_weight += weight
+            self._current_weights[path.address] += weight
+            if chosen is None or self._current_weights[path.address] > self._current_weights[chosen.address]:
+                chosen = path
+        self._current_weights[chosen.address] -= total_weight
+        return chosen
@@ -0,0 +1,130 @@
+import sys
+import time
+import enum
+import struct
+import logging
+import collections
+from TCPoverICMP import exceptions
+from TCPoverICMP.tunnel_packet import Action
+
+
+log = logging.getLogger(__name__)
+
+
+class TraceEvent(enum.IntEnum):
+    received = 0
+    sent = 1
+    retransmitted = 2
+    acked = 3
+    dropped = 4
+
+
+TraceRecord = collections.namedtuple('TraceRecord', ('timestamp', 'client_id', 'sequence_number', 'action', 'event',
+                                                     'size'))
+
+
+class PacketTracer:
+    """
+    a fixed size ring buffer of per packet events, packed in binary, for offline analysis of the tunnel.
+    recording an event packs a few integers into a preallocated buffer, nothing is formatted or allocated, and once the
+    buffer is full the oldest events are overwritten. the buffer is written to a file on demand, see dump.
+    packets are sampled by their sequence number, so every event of a sampled packet is recorded (sent, retransmitted,
+    acked, and received on the other endpoint), and packets without one (start and end requests) are always recorded.
+    """
+    RECORD_STRUCT = struct.Struct('<dIIBBI')  # timestamp, client_id, sequence_number, action, event, size.
+    HEADER_STRUCT = struct.Struct('<4sHI')  # magic, version, number of records.
+    MAGIC = b'TCPT'
+    VERSION = 1
+    DEFAULT_CAPACITY = 65536
+    DEFAULT_SAMPLE_EVERY = 1
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, sample_every: int = DEFAULT_SAMPLE_EVERY):
+        """
+        :param capacity: the number of events the buffer holds.
+        :param sample_every: record the packets whose sequence number is a multiple of it, 1 records all of them.
+        """
+        self.capacity = capacity
+        self.sample_every = sample_every
+        self._buffer = bytearray(capacity * self.RECORD_STRUCT.size)
+        self._recorded = 0
+
+    def __len__(self):
+        return min(self._recorded, self.capacity)
+
+    def record(self, event: TraceEvent, client_id: int, sequence_number: int, action: Action, size: int):
+        """
+        record an event of a packet, if the packet is sampled.
+        :param event: what happened to the packet.
+        :param client_id: the client of the packet.
+        :param sequence_number: the sequence number of the packet.
+        :param action: the action of the packet.
+        :param size: the size of the payload of the packet, in bytes.
+        """
+        if sequence_number % self.sample_every:
+            return
+        self.RECORD_STRUCT.pack_into(
+            self._buffer,
+            self._recorded % self.capacity * self.RECORD_STRUCT.size,
+            time.time(),
+            client_id,
+            sequence_number,
+            action,
+            event,
+            size,
+        )
+        self._recorded += 1
+
+    def records(self):
+        """
+        :return: the raw records in the buffer, oldest first.
+        """
+        if self._recorded <= self.capacity:
+            return bytes(self._buffer[:self._recorded * self.RECORD_STRUCT.size])
+        oldest = self._recorded % self.capacity * self.RECORD_STRUCT.size
+        return bytes(self._buffer[oldest:] + self._buffer[:oldest])
+
+    def dump(self, path: str):
+        """
+        write the events in the buffer to a file, oldest first. the file is read back with load.
+        :param path: the file to write, replaced if it exists.
+        """
+        with open(path, 'wb') as trace_file:
+            trace_file.write(self.HEADER_STRUCT.pack(self.MAGIC, self.VERSION, len(self)))
+            trace_file.write(self.records())
+        log.info(f'dumped {len(self)} packet events to {path}')
+
+
+def load(path: str):
+    """
+    read a trace written by PacketTracer.dump.
+    :param path: the trace file.
+    :return: list of TraceRecords, oldest first.
+    """
+    with open(path, 'rb') as trace_file:
+        data = trace_file.read()
+    magic, version, count = PacketTracer.HEADER_STRUCT.unpack_from(data)
+    if magic != PacketTracer.MAGIC or version != PacketTracer.VERSION:
+        raise exceptions.InvalidTraceFile(f'{path} isnt a packet trace of version {PacketTracer.VERSION}')
+
+    records = []
+    for timestamp, client_id, sequence_number, action, event, size in PacketTracer.RECORD_STRUCT.iter_unpack(
+            data[PacketTracer.HEADER_STRUCT.size:][:count * PacketTracer.RECORD_STRUCT.size]):
+        records.append(TraceRecord(timestamp, client_id, sequence_number, Action(action), TraceEvent(event), size))
+    return records
+
+
+def main():
+    """
+    print a trace file as csv, for offline analysis.
+    """
+    if len(sys.argv) != 2:
+        sys.exit('usage: python -m TCPoverICMP.packet_tracer TRACE_FILE')
+
+    print(','.join(TraceRecord._fields))
+    for record in load(sys.argv[1]):
+        print(f'{record.timestamp:.6f},{record.client_id},{record.sequence_number},{record.action.name},'
+              f'{record.event.name},{record.size}')
+
+
+if __name__ == '__main__':
+    main()
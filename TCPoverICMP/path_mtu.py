@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Callable
+from TCPoverICMP import rtt_estimator
+
+
+log = logging.getLogger(__name__)
+
+
+class PathMTUProber:
+    """
+    discover the largest icmp payload that gets through to the other endpoint.
+    probes are sent with the DF flag, and a binary search finds the largest probe the other endpoint replies to.
+    the search is repeated periodically, so the payload size follows changes of the path.
+    """
+    MIN_PAYLOAD_SIZE = 548  # 576 bytes, the minimal MTU every IPv4 host accepts, without the IP and ICMP headers.
+    INITIAL_PAYLOAD_SIZE = 1200
+    DEFAULT_MAX_PAYLOAD_SIZE = 1472  # 1500 bytes ethernet MTU, without the IP and ICMP headers.
+    PROBE_ATTEMPTS = 2
+    PROBE_INTERVAL = 300.0
+    RETRY_INTERVAL = 10.0  # after a discovery that no probe got through in, the other endpoint was likely unreachable.
+
+    def __init__(
+            self,
+            send_probe: Callable[[int], None],
+            rtt: rtt_estimator.RTTEstimator,
+            on_change: Callable[[int], None],
+            max_payload_size: int = DEFAULT_MAX_PAYLOAD_SIZE,
+    ):
+        self.send_probe = send_probe
+        self.rtt = rtt
+        self.on_change = on_change
+        self.max_payload_size = max(max_payload_size, self.MIN_PAYLOAD_SIZE)
+        self.payload_size = min(self.INITIAL_PAYLOAD_SIZE, self.max_payload_size)
+        self._probes = {}
+
+    async def run(self):
+        """
+        discover the path MTU now, and again every PROBE_INTERVAL seconds, or RETRY_INTERVAL seconds if no probe got
+        through.
+        """
+        while True:
+            if await self.discover():
+                await asyncio.sleep(self.PROBE_INTERVAL)
+            else:
+                await asyncio.sleep(self.RETRY_INTERVAL)
+
+    async def discover(self):
+        """
+        binary search for the largest payload size that gets through. the maximal size is tried first,
+        since on most paths it is the answer.
+        if no probe got through, not even one of the minimal size, the other endpoint is unreachable for the moment,
+        and the payload size is kept.
+        :return: boolean representing whether any probe got through.
+        """
+        low, high = self.MIN_PAYLOAD_SIZE, self.max_payload_size
+        answered = await self.probe(high)
+        if answered:
+            low = high
+
+        while low < high:
+            size = (low + high + 1) // 2
+            if await self.probe(size):
+                low = size
+                answered = True
+            else:
+                high = size - 1
+
+        if not answered and not await self.probe(low):  # the path might have the minimal MTU.
+            log.info(f'no path MTU probe got through, keeping (payload_size={self.payload_size})')
+            return False
+        if low != self.payload_size:
+            log.info(f'path MTU changed: (payload_size={low})')
+            self.payload_size = low
+            self.on_change(low)
+        return True
+
+    async def probe(self, payload_size: int):
+        """
+        send a probe of a given size, and wait for its reply.
+        :param payload_size: the size of the icmp payload of the probe.
+        :return: boolean representing whether a probe of this size got through.
+        """
+        reply_received = self._probes[payload_size] = asyncio.Event()
+        try:
+            for _ in range(self.PROBE_ATTEMPTS):
+                try:
+                    self.send_probe(payload_size)
+                except OSError:  # the probe is bigger than the MTU of the local interface.
+                    return False
+
+                try:
+                    await asyncio.wait_for(reply_received.wait(), self.rtt.rto)
+                    return True
+                except asyncio.TimeoutError:
+                    continue
+            return False
+        finally:
+            self._probes.pop(payload_size, None)
+
+    def probe_replied(self, payload_size: int):
+        """
+        called when the other endpoint replied to a probe.
+        :param payload_size: the size of the probe that got through.
+        """
+        if payload_size in self._probes:
+            self._probes[payload_size].set()
@@ -19,7 +19,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   package='',
   syntax='proto2',
   serialized_options=None,
-  serialized_pb=_b('\n\x0ctunnel.proto\"\x83\x02\n\x06Tunnel\x12\x11\n\tclient_id\x18\x01 \x01(\r\x12\x17\n\x0fsequence_number\x18\x02 \x01(\r\x12\x1e\n\x06\x61\x63tion\x18\x03 \x01(\x0e\x32\x0e.Tunnel.Action\x12$\n\tdirection\x18\x04 \x01(\x0e\x32\x11.Tunnel.Direction\x12\n\n\x02ip\x18\x05 \x01(\t\x12\x0c\n\x04port\x18\x06 \x01(\r\x12\x0f\n\x07payload\x18\x07 \x01(\x0c\"/\n\x06\x41\x63tion\x12\t\n\x05start\x10\x00\x12\x07\n\x03\x65nd\x10\x01\x12\x08\n\x04\x64\x61ta\x10\x02\x12\x07\n\x03\x61\x63k\x10\x03\"+\n\tDirection\x12\x0c\n\x08to_proxy\x10\x00\x12\x10\n\x0cto_forwarder\x10\x01')
+  serialized_pb=_b('\n\x0ctunnel.proto\"\x82\x03\n\x06Tunnel\x12\x11\n\tclient_id\x18\x01 \x01(\r\x12\x17\n\x0fsequence_number\x18\x02 \x01(\r\x12\x1e\n\x06\x61\x63tion\x18\x03 \x01(\x0e\x32\x0e.Tunnel.Action\x12$\n\tdirection\x18\x04 \x01(\x0e\x32\x11.Tunnel.Direction\x12\n\n\x02ip\x18\x05 \x01(\t\x12\x0c\n\x04port\x18\x06 \x01(\r\x12\x0f\n\x07payload\x18\x07 \x01(\x0c\x12\x12\n\nack_number\x18\x08 \x01(\r\x12\x14\n\x0c\x63\x61pabilities\x18\t \x01(\r\x12\x0e\n\x06window\x18\n \x01(\r\x12\x12\n\ncompressed\x18\x0b \x01(\x08\x12\x13\n\x0bsack_blocks\x18\x0c \x03(\r\"K\n\x06\x41\x63tion\x12\t\n\x05start\x10\x00\x12\x07\n\x03\x65nd\x10\x01\x12\x08\n\x04\x64\x61ta\x10\x02\x12\x07\n\x03\x61\x63k\x10\x03\x12\t\n\x05probe\x10\x04\x12\x0f\n\x0bprobe_reply\x10\x05\"+\n\tDirection\x12\x0c\n\x08to_proxy\x10\x00\x12\x10\n\x0cto_forwarder\x10\x01')
 )
 
 
@@ -46,11 +46,19 @@ _TUNNEL_ACTION = _descriptor.EnumDescriptor(
       name='ack', index=3, number=3,
       serialized_options=None,
       type=None),
+    _descriptor.EnumValueDescriptor(
+      name='probe', index=4, number=4,
+      serialized_options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='probe_reply', index=5, number=5,
+      serialized_options=None,
+      type=None),
   ],
   containing_type=None,
   serialized_options=None,
-  serialized_start=184,
-  serialized_end=231,
+  serialized_start=283,
+  serialized_end=358,
 )
 _sym_db.RegisterEnumDescriptor(_TUNNEL_ACTION)
 
@@ -71,8 +79,8 @@ _TUNNEL_DIRECTION = _descriptor.EnumDescriptor(
   ],
   containing_type=None,
   serialized_options=None,
-  serialized_start=233,
-  serialized_end=276,
+  serialized_start=360,
+  serialized_end=403,
 )
 _sym_db.RegisterEnumDescriptor(_TUNNEL_DIRECTION)
 
@@ -133,6 +141,41 @@ _TUNNEL = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='ack_number', full_name='Tunnel.ack_number', index=7,
+      number=8, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='capabilities', full_name='Tunnel.capabilities', index=8,
+      number=9, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='window', full_name='Tunnel.window', index=9,
+      number=10, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='compressed', full_name='Tunnel.compressed', index=10,
+      number=11, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='sack_blocks', full_name='Tunnel.sack_blocks', index=11,
+      number=12, type=13, cpp_type=3, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -148,7 +191,7 @@ _TUNNEL = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=17,
-  serialized_end=276,
+  serialized_end=403,
 )
 
 _TUNNEL.fields_by_name['action'].enum_type = _TUNNEL_ACTION
@@ -1,27 +1,130 @@
 import asyncio
 import logging
-from TCPoverICMP import tunnel_endpoint
-from TCPoverICMP.proto import Tunnel
+import collections
+from TCPoverICMP import tunnel_endpoint, client_session, connection_pool, resolver
+from TCPoverICMP.tunnel_packet import TunnelPacket, Action, Direction
 
 
 log = logging.getLogger(__name__)
 
 
 class Proxy(tunnel_endpoint.TunnelEndpoint):
+    def __init__(
+            self,
+            other_endpoint,
+            connection_pool_size: int = connection_pool.ConnectionPool.DEFAULT_SIZE,
+            resolver_ttl: float = resolver.ResolverCache.DEFAULT_TTL,
+            **kwargs,
+    ):
+        super(Proxy, self).__init__(other_endpoint, **kwargs)
+        self.connecting_clients = set()
+        self.ended_clients = collections.OrderedDict()  # client_id -> the time it is forgotten at, oldest first.
+        self.rejected_clients = collections.OrderedDict()  # client_id -> the time it is forgotten at, oldest first.
+        self.connection_pool = connection_pool.ConnectionPool(resolver.ResolverCache(resolver_ttl), connection_pool_size)
+        if connection_pool_size:
+            self.coroutines_to_run.append(self.connection_pool.run())
+
     @property
     def direction(self):
-        return Tunnel.Direction.to_forwarder
+        return Direction.to_forwarder
+
+    async def handle_start_request(self, tunnel_packet: TunnelPacket):
+        """
+        connect to the destination of a new client, and ack the start request once connected.
+        start requests are handled in tasks, so connecting doesnt hold up other packets, and a repeated start request
+        might arrive while the client is still connecting. it is ignored, the ack is sent once the connection is open.
+        the connection is taken from the connection pool if it has one to the destination.
+        the start request might carry the first data segment of the client (0-RTT). it is kept until the connection
+        is open, and written to it before the ack, which acks the segment as well.
+        a start request of a client that already ended is a retransmission whose ack was lost. it is acked again,
+        instead of connecting again and replaying its early data to the destination.
+        a client beyond the limits on the number of clients is refused with an end request, so the other endpoint
+        closes it right away, instead of retransmitting its start request until it gives up. the repeated start
+        requests of a refused client are ignored, the end request is sent reliably. a client whose destination cant be
+        connected to is refused the same way.
+        """
+        self.forget_expired_clients(self.ended_clients)
+        self.forget_expired_clients(self.rejected_clients)
+        if self.client_manager.client_exists(tunnel_packet.client_id) or tunnel_packet.client_id in self.ended_clients:
+            log.debug(f'repeated start request: (client_id={tunnel_packet.client_id}). acking again.')
+            self.send_ack(tunnel_packet)
+            return
+        if tunnel_packet.client_id in self.connecting_clients or tunnel_packet.client_id in self.rejected_clients:
+            return
+        if not self.client_manager.admit(tunnel_packet.ip):
+            log.debug(f'too many clients, refusing to connect to {tunnel_packet.ip}:{tunnel_packet.port}')
+            self.metrics.clients_rejected.value += 1
+            await self.refuse_client(tunnel_packet.client_id)
+            return
 
-    async def handle_start_request(self, tunnel_packet: Tunnel):
+        self.connecting_clients.add(tunnel_packet.client_id)
+        writer = None
         try:
-            reader, writer = await asyncio.open_connection(tunnel_packet.ip, tunnel_packet.port)
+            reader, writer = await self.connection_pool.connect(tunnel_packet.ip, tunnel_packet.port)
         except ConnectionRefusedError:
             log.debug(f'{tunnel_packet.ip}:{tunnel_packet.port} refused connection. tunnel not started.')
+        except OSError as e:
+            log.info(f'cant connect to {tunnel_packet.ip}:{tunnel_packet.port} ({e}). tunnel not started.')
+        finally:
+            self.connecting_clients.discard(tunnel_packet.client_id)
+            if writer is None:  # the client wont be added, give back its place.
+                self.client_manager.release(tunnel_packet.ip)
+        if writer is None:
+            await self.refuse_client(tunnel_packet.client_id)
             return
 
         self.client_manager.add_client(
             client_id=tunnel_packet.client_id,
             reader=reader,
             writer=writer,
+            peer=tunnel_packet.ip,
         )
+        if tunnel_packet.payload:
+            self.client_manager.write_to_client(
+                tunnel_packet.client_id,
+                client_session.ClientSession.INITIAL_SEQUENCE_NUMBER,
+                tunnel_packet.payload,
+            )
         self.send_ack(tunnel_packet)
+
+    async def refuse_client(self, client_id: int):
+        """
+        refuse a new client with an end request, so the other endpoint closes it right away, and remember it, so its
+        repeated start requests are ignored.
+        """
+        self.remember_client(self.rejected_clients, client_id)
+        await self.send_icmp_packet_and_wait_for_ack(
+            TunnelPacket(client_id=client_id, action=Action.end, direction=self.direction),
+        )
+
+    async def remove_client(self, client_id: int):
+        """
+        remove a client, and remember that it ended for RETRANSMISSION_BUDGET seconds, as long as the other endpoint
+        might still retransmit its start request.
+        """
+        await super(Proxy, self).remove_client(client_id)
+        self.remember_client(self.ended_clients, client_id)
+
+    def remember_client(self, clients: collections.OrderedDict, client_id: int):
+        """
+        remember a client for RETRANSMISSION_BUDGET seconds, as long as the other endpoint might still retransmit its
+        start request.
+        :param clients: the clients to remember it in, ended_clients or rejected_clients.
+        :param client_id: the client to remember.
+        """
+        self.forget_expired_clients(clients)
+        clients.pop(client_id, None)  # kept in the order they are forgotten.
+        clients[client_id] = asyncio.get_running_loop().time() + self.RETRANSMISSION_BUDGET
+
+    @staticmethod
+    def forget_expired_clients(clients: collections.OrderedDict):
+        """
+        forget the remembered clients whose start requests cant be retransmitted anymore.
+        :param clients: ended_clients or rejected_clients.
+        """
+        now = asyncio.get_running_loop().time()
+        while clients:
+            client_id, forget_time = next(iter(clients.items()))
+            if forget_time > now:
+                return
+            del clients[client_id]
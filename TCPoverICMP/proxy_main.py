@@ -1,26 +1,47 @@
-import asyncio
+import sys
+import signal
 import logging
 import argparse
-from TCPoverICMP import proxy
+from TCPoverICMP import proxy, endpoint_arguments, sharding
 
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('forwarder_ip', help='IP address of the forwarder client')
-    return parser.parse_args()
-
-
-async def main():
-    args = parse_args()
-    await proxy.Proxy(args.forwarder_ip).run()
+    parser.add_argument(
+        'forwarder_ip',
+        type=endpoint_arguments.addresses,
+        help='IP address of the forwarder client, or several comma separated addresses to stripe the tunnel across',
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+        help='DEBUG logs rare per packet events, like ignored packets. use --trace-capacity to trace every packet',
+    )
+    endpoint_arguments.add_endpoint_arguments(parser)
+    endpoint_arguments.add_proxy_arguments(parser)
+    args = parser.parse_args()
+    endpoint_arguments.check_endpoint_arguments(parser, args)
+    return args
+
+
+async def main(args: argparse.Namespace, shard: int = 0, shards: int = 1):
+    await proxy.Proxy(
+        args.forwarder_ip,
+        shard=shard,
+        shards=shards,
+        **endpoint_arguments.proxy_kwargs(args),
+        **endpoint_arguments.endpoint_kwargs(args),
+    ).run()
 
 
 def start_asyncio_main():
-    asyncio.run(main())
+    args = parse_args()
+    logging.basicConfig(level=args.log_level)
+    sys.exit(sharding.run_shards(main, args, args.workers, (signal.SIGUSR1,) if args.trace_capacity else ()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,70 @@
+import socket
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class ResolverCache:
+    """
+    resolve the destinations of new clients, and keep the addresses for ttl seconds.
+    getaddrinfo runs in a thread of the executor, and might wait for a dns server, for every connection. the ttl of the
+    dns records isnt known through getaddrinfo, so a fixed ttl is used. concurrent lookups of the same destination share
+    a single resolution. failed resolutions arent cached.
+    """
+    DEFAULT_TTL = 60.0
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        """
+        :param ttl: seconds to keep resolved addresses. 0 resolves every time.
+        """
+        self.ttl = ttl
+        self._cache = {}  # (host, port) -> (expiry, addresses)
+        self._resolving = {}  # (host, port) -> the task resolving it
+
+    async def resolve(self, host: str, port: int):
+        """
+        :return: list of the ip addresses of the host, in the order getaddrinfo returned them.
+        :raises OSError: if the host cant be resolved.
+        """
+        key = (host, port)
+        cached = self._cache.get(key)
+        if cached is not None:
+            expiry, addresses = cached
+            if asyncio.get_running_loop().time() < expiry:
+                return addresses
+            del self._cache[key]
+
+        resolving = self._resolving.get(key)
+        if resolving is None:
+            resolving = self._resolving[key] = asyncio.create_task(self.lookup(host, port))
+            resolving.add_done_callback(lambda task: self.resolved(key, task))
+        return await asyncio.shield(resolving)  # a waiter that is cancelled doesnt cancel the others.
+
+    def resolved(self, key: tuple, task: asyncio.Task):
+        """
+        cache the addresses of a lookup that finished.
+        """
+        del self._resolving[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.ttl > 0:
+            self._cache[key] = (asyncio.get_running_loop().time() + self.ttl, task.result())
+
+    @staticmethod
+    async def lookup(host: str, port: int):
+        """
+        resolve a host, without the cache.
+        :return: list of the ip addresses of the host, without duplicates.
+        """
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(sockaddr[0] for _, _, _, _, sockaddr in infos))
+        log.debug(f'resolved {host}: {addresses}')
+        return addresses
+
+    def invalidate(self, host: str, port: int):
+        """
+        forget the addresses of a destination, since none of them could be connected to.
+        """
+        self._cache.pop((host, port), None)
@@ -0,0 +1,227 @@
+import math
+import asyncio
+import logging
+from typing import Callable
+from TCPoverICMP.tunnel_packet import Action
+
+
+log = logging.getLogger(__name__)
+
+
+class OutstandingPacket:
+    """
+    a tunnel packet that was sent to the other endpoint, and waits for its ack. it is kept encoded, since
+    retransmissions send the same bytes, along with its retransmission state.
+    """
+    __slots__ = (
+        'client_id',
+        'sequence_number',
+        'action',
+        'payload',
+        'in_window',
+        'waiter',
+        'path',
+        'single_path',
+        'first_sent',
+        'sent',
+        'timeout',
+        'deadline',
+        'retransmitted',
+        'missing_reports',
+        'fast_retransmitted',
+        'done',
+    )
+
+    def __init__(
+            self,
+            client_id: int,
+            sequence_number: int,
+            action: Action,
+            payload: bytes,
+            in_window: bool = False,
+            waiter: asyncio.Future = None,
+    ):
+        """
+        :param client_id: the client of the packet.
+        :param sequence_number: the sequence number of the packet.
+        :param action: the action of the packet.
+        :param payload: the encoded packet.
+        :param in_window: whether the packet holds a place in the congestion window, that is freed when it is done.
+        :param waiter: a future that is set to whether the packet was acked when it is done, None if noone waits.
+        """
+        self.client_id = client_id
+        self.sequence_number = sequence_number
+        self.action = action
+        self.payload = payload
+        self.in_window = in_window
+        self.waiter = waiter
+        self.path = None
+        self.single_path = True  # whether every transmission went on the same path.
+        self.first_sent = 0.0
+        self.sent = 0.0
+        self.timeout = 0.0
+        self.deadline = 0.0
+        self.retransmitted = False
+        self.missing_reports = 0  # acks of packets sent after it, since it was last sent.
+        self.fast_retransmitted = False  # whether it was last sent because it was reported missing.
+        self.done = False
+
+
+class RetransmissionQueue:
+    """
+    the packets that wait for their ack, indexed per client, and a hashed timer wheel of their retransmission deadlines.
+    a single timer ticks the wheel and expires the deadlines that passed, instead of a timer (and a task) for every
+    packet, so the cost of a packet in flight doesnt depend on how many packets are in flight. deadlines are rounded up
+    to a tick, so a packet is never retransmitted early, and at most one tick late. the timer is armed for the next
+    tick whose slot has packets, so the wheel doesnt tick while there is nothing to expire.
+    acked packets are only marked as done, and are dropped from the wheel when their slot comes up. likewise, a deadline
+    may be pushed back without scheduling the packet again, it is moved to its new slot when its old one comes up.
+    """
+    TICK = 0.005
+    SLOTS = 1024  # a turn of the wheel is longer than the maximal retransmission timeout, so deadlines rarely wrap.
+
+    def __init__(self, expired: Callable[[OutstandingPacket], None], tick: float = TICK, slots: int = SLOTS):
+        """
+        :param expired: called with every packet whose deadline passed. it may schedule the packet again.
+        :param tick: the time between two ticks, in seconds.
+        :param slots: the number of slots of the wheel.
+        """
+        self.expired = expired
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.clients = {}  # client_id -> {sequence_number: OutstandingPacket}
+        self._count = 0
+        self._current_tick = 0  # the last tick whose slot was expired.
+        self._timer = None  # armed whenever the wheel isnt empty.
+        self._timer_tick = None
+        self._expiring = False
+
+    def __len__(self):
+        return self._count
+
+    def add(self, packet: OutstandingPacket):
+        """
+        add a packet that was just sent. its deadline must be set.
+        """
+        packets = self.clients.get(packet.client_id)
+        if packets is None:
+            packets = self.clients[packet.client_id] = {}
+        packets[packet.sequence_number] = packet
+        self._count += 1
+        self.schedule(packet)
+
+    def schedule(self, packet: OutstandingPacket):
+        """
+        put a packet in the slot of its deadline.
+        """
+        if self._timer is None and not self._expiring:  # the wheel is empty, skip the ticks it was idle for.
+            self._current_tick = int(asyncio.get_running_loop().time() / self.tick)
+        tick = max(math.ceil(packet.deadline / self.tick), self._current_tick + 1)
+        self.slots[tick % len(self.slots)].append(packet)
+        if not self._expiring and (self._timer_tick is None or tick < self._timer_tick):
+            self.arm(tick)
+
+    def arm(self, tick: int):
+        """
+        set the timer to tick the wheel at the given tick.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_at(tick * self.tick, self.on_timer)
+        self._timer_tick = tick
+
+    def on_timer(self):
+        """
+        tick the wheel, and arm the timer for the next tick whose slot has packets, if there is one.
+        """
+        self._timer = None
+        self._timer_tick = None
+        self._expiring = True
+        try:
+            self.advance(asyncio.get_running_loop().time())
+        finally:
+            self._expiring = False
+            self.arm_next()
+
+    def arm_next(self):
+        """
+        arm the timer for the next tick whose slot has packets, if there is one.
+        """
+        if not self._count:  # only acked packets are left, drop them instead of ticking until their slots come up.
+            for slot in self.slots:
+                slot.clear()
+            return
+        for tick in range(self._current_tick + 1, self._current_tick + len(self.slots) + 1):
+            if self.slots[tick % len(self.slots)]:
+                self.arm(tick)
+                return
+
+    def get(self, client_id: int, sequence_number: int):
+        """
+        :return: the packet, or None if it isnt waiting for an ack.
+        """
+        packets = self.clients.get(client_id)
+        if packets is None:
+            return None
+        return packets.get(sequence_number)
+
+    def pop(self, client_id: int, sequence_number: int):
+        """
+        take a packet out of the queue, because it was acked.
+        :return: the packet, or None if it isnt waiting for an ack.
+        """
+        packets = self.clients.get(client_id)
+        if packets is None:
+            return None
+        packet = packets.pop(sequence_number, None)
+        if packet is None:
+            return None
+        if not packets:
+            del self.clients[client_id]
+        packet.done = True
+        self._count -= 1
+        return packet
+
+    def pop_client(self, client_id: int):
+        """
+        take all the packets of a client out of the queue.
+        :return: list of the packets.
+        """
+        packets = list(self.clients.pop(client_id, {}).values())
+        for packet in packets:
+            packet.done = True
+        self._count -= len(packets)
+        return packets
+
+    def advance(self, now: float):
+        """
+        expire the packets whose deadline passed, in the slots of the ticks since the last call.
+        a packet whose expiry raises doesnt stop the others from expiring.
+        :param now: the current time.
+        """
+        now_tick = int(now / self.tick)
+        first_tick = max(self._current_tick + 1, now_tick - len(self.slots) + 1)  # a turn covers all the slots.
+        self._current_tick = now_tick
+
+        for tick in range(first_tick, now_tick + 1):
+            slot_index = tick % len(self.slots)
+            slot = self.slots[slot_index]
+            if not slot:
+                continue
+            self.slots[slot_index] = []
+            for packet in slot:
+                if packet.done:
+                    continue
+                deadline_tick = math.ceil(packet.deadline / self.tick)
+                if deadline_tick > now_tick:  # due on a later turn of the wheel, or pushed back.
+                    self.slots[deadline_tick % len(self.slots)].append(packet)
+                    continue
+                try:
+                    self.expired(packet)
+                except Exception:
+                    # the rest of the slot is still expired. the packet is expired again on the next tick, so it isnt
+                    # left outstanding forever, holding its place in the congestion window.
+                    log.exception(f'expiring a packet failed: (client_id={packet.client_id})'
+                                  f'(seq_num={packet.sequence_number})')
+                    if not packet.done:
+                        self.slots[(now_tick + 1) % len(self.slots)].append(packet)
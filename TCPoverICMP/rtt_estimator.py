@@ -0,0 +1,48 @@
+class RTTEstimator:
+    """
+    estimate the round trip time to the other endpoint, and derive the retransmission timeout from it.
+    follows RFC 6298: a smoothed rtt (srtt) and rtt variance (rttvar), updated on every valid sample.
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+    CLOCK_GRANULARITY = 0.001
+    INITIAL_RTO = 1.0
+    MIN_RTO = 0.2  # like linux. covers the delayed ack of the other endpoint, timer granularity, and event loop lag.
+    MAX_RTO = 4.0
+
+    def __init__(self, initial_rto: float = INITIAL_RTO, min_rto: float = MIN_RTO, max_rto: float = MAX_RTO):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self._bound(initial_rto)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(srtt={self.srtt}, rttvar={self.rttvar}, rto={self.rto})'
+
+    def add_sample(self, rtt: float):
+        """
+        update the estimates with a new rtt measurement.
+        samples of retransmitted packets are ambiguous (Karn's rule), and shouldnt be added.
+        :param rtt: the time in seconds between sending a packet and receiving its ack.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self.rto = self._bound(self.srtt + max(self.CLOCK_GRANULARITY, self.K * self.rttvar))
+
+    def backoff(self, timeout: float):
+        """
+        exponentially back off a retransmission timeout.
+        :param timeout: the timeout that just expired.
+        :return: the timeout to use for the next retransmission.
+        """
+        return self._bound(timeout * 2)
+
+    def _bound(self, timeout: float):
+        return min(max(timeout, self.min_rto), self.max_rto)
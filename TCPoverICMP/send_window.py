@@ -0,0 +1,144 @@
+import asyncio
+
+
+class SendWindow:
+    """
+    the window of data segments of a single client that were sent on the icmp channel, and werent acked yet.
+    bounds the amount of segments in flight, and supports cumulative acks, so one ack can release many segments.
+    if the other endpoint advertises a receive window, the bytes in flight are bounded by it as well (flow control).
+    """
+    DEFAULT_SIZE = 64
+    __slots__ = ('size', 'acked_up_to', 'in_flight', 'in_flight_size', 'advertised_window', '_space_waiter')
+
+    def __init__(self, size: int = DEFAULT_SIZE):
+        self.size = size
+        self.acked_up_to = 0
+        self.in_flight = {}  # sequence_number -> size. dicts keep insertion order, so the oldest segment is first.
+        self.in_flight_size = 0
+        self.advertised_window = None  # bytes, None until the other endpoint advertises a window.
+        self._space_waiter = None  # created only while the client waits, an asyncio.Event is big for every client.
+
+    def __len__(self):
+        return len(self.in_flight)
+
+    @property
+    def is_full(self):
+        return len(self.in_flight) >= self.size
+
+    @property
+    def is_closed(self):
+        """
+        whether the other endpoint has no room for more data, and there is no data in flight whose ack could
+        advertise a new window. in that case the window has to be probed.
+        """
+        return self.advertised_window == 0 and not self.in_flight
+
+    @property
+    def available(self):
+        """
+        the amount of bytes that can be sent right now, as allowed by the advertised window.
+        :return: the amount of bytes, or None if the other endpoint doesnt advertise a window.
+        """
+        if self.advertised_window is None:
+            return None
+        return max(self.advertised_window - self.in_flight_size, 0)
+
+    def has_space(self, size: int = 0):
+        """
+        :param size: the size of the next segment.
+        :return: boolean representing whether the segment can be sent right now.
+        """
+        if self.is_full:
+            return False
+        if self.advertised_window is None:
+            return True
+        if not self.in_flight:  # a window smaller than a segment shouldnt stall the client.
+            return self.advertised_window > 0
+        return self.in_flight_size + size <= self.advertised_window
+
+    async def wait_for_space(self, size: int = 0):
+        """
+        wait until there is room in the window for another segment.
+        :param size: the size of the segment.
+        """
+        while not self.has_space(size):
+            if self._space_waiter is None or self._space_waiter.done():  # the last waiter might have been cancelled.
+                self._space_waiter = asyncio.get_running_loop().create_future()
+            await self._space_waiter
+
+    def add(self, sequence_number: int, size: int = 0):
+        """
+        mark a segment as in flight.
+        :param sequence_number: the sequence number of the segment that is about to be sent.
+        :param size: the size of the segment.
+        """
+        self.in_flight[sequence_number] = size
+        self.in_flight_size += size
+
+    def ack(self, sequence_number: int):
+        """
+        release a single segment from the window.
+        :param sequence_number: the sequence number of the acked segment.
+        :return: boolean representing whether the segment was in flight.
+        """
+        if sequence_number not in self.in_flight:
+            return False
+        self.in_flight_size -= self.in_flight.pop(sequence_number)
+        self._wake()
+        return True
+
+    def ack_cumulative(self, ack_number: int):
+        """
+        release all segments up to (and including) ack_number from the window.
+        :param ack_number: the highest sequence number that the other endpoint received in order.
+        :return: list of the sequence numbers that were released.
+        """
+        if ack_number <= self.acked_up_to:
+            return []
+        self.acked_up_to = ack_number
+
+        released = [sequence_number for sequence_number in self.in_flight if sequence_number <= ack_number]
+        for sequence_number in released:
+            self.in_flight_size -= self.in_flight.pop(sequence_number)
+        self._wake()
+        return released
+
+    def ack_range(self, first: int, last: int):
+        """
+        release the segments in a range of sequence numbers, that the other endpoint received out of order.
+        :param first: the first sequence number of the range.
+        :param last: the last sequence number of the range.
+        :return: list of the sequence numbers that were released.
+        """
+        if last - first < len(self.in_flight):
+            released = [
+                sequence_number for sequence_number in range(first, last + 1) if sequence_number in self.in_flight
+            ]
+        else:  # the range might be huge, the window never is.
+            released = [sequence_number for sequence_number in self.in_flight if first <= sequence_number <= last]
+        for sequence_number in released:
+            self.in_flight_size -= self.in_flight.pop(sequence_number)
+        if released:
+            self._wake()
+        return released
+
+    def update_advertised_window(self, ack_number: int, window: int):
+        """
+        update the receive window advertised by the other endpoint.
+        acks might be reordered on the way, so an advertisement older than the latest cumulative ack is ignored.
+        :param ack_number: the cumulative ack that was sent along with the advertisement.
+        :param window: the amount of bytes the other endpoint can buffer.
+        """
+        if ack_number < self.acked_up_to:
+            return
+        self.advertised_window = window
+        self._wake()
+
+    def _wake(self):
+        """
+        wake up the client waiting for space, to check the window again.
+        """
+        if self._space_waiter is not None:
+            if not self._space_waiter.done():
+                self._space_waiter.set_result(None)
+            self._space_waiter = None
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import collections
+import multiprocessing
+import multiprocessing.connection
+from typing import Callable, Coroutine, Sequence
+
+
+log = logging.getLogger(__name__)
+
+
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+RESTART_DELAY = 0.1  # doubled for every time in a row the worker of a shard failed to start.
+MAX_RESTART_DELAY = 30.0
+STARTUP_TIME = 10.0  # a worker that exits sooner than this failed to start.
+MAX_STARTUP_FAILURES = 5
+
+
+def run_shard(main: Callable[[argparse.Namespace, int, int], Coroutine], args: argparse.Namespace, shard: int, shards: int):
+    """
+    the entry point of a worker process. it exits with 0 if it was stopped, and with a non zero exit code if it failed.
+    """
+    for stop_signal in STOP_SIGNALS:  # the handlers of the pool are inherited, a worker stops on its own signals.
+        signal.signal(stop_signal, signal.default_int_handler)
+    try:
+        asyncio.run(main(args, shard, shards))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    except SystemExit as e:  # a fatal error that the endpoint reported, like running without root.
+        sys.exit(e.code if isinstance(e.code, int) and e.code else 1)
+
+
+def run_shards(
+        main: Callable[[argparse.Namespace, int, int], Coroutine],
+        args: argparse.Namespace,
+        shards: int,
+        forwarded_signals: Sequence[int] = (),
+):
+    """
+    run an endpoint in several worker processes, each with its own event loop and icmp socket.
+    every worker owns the clients whose steering key hashes to it, so the ownership of a client never moves.
+    a worker that dies is restarted with the same shard, so its share of the clients stays served. a worker that fails
+    to start is restarted after a delay that doubles every time in a row, and once it failed MAX_STARTUP_FAILURES
+    times in a row, the whole pool is stopped, since it would fail the same way again (like without root).
+    SIGINT and SIGTERM stop the pool and all its workers.
+    :param main: coroutine function that runs a single worker, given the arguments, its shard and the number of shards.
+    :param args: the parsed arguments of the endpoint.
+    :param shards: the number of workers. with a single worker, the endpoint runs in the current process.
+    :param forwarded_signals: signals that the workers handle, like SIGUSR1 to dump the packet trace. signals sent to
+    the main process are forwarded to all the workers.
+    :return: the exit code of the pool: 0 if it was stopped by a signal, 1 if a worker kept failing to start.
+    """
+    if shards == 1:
+        asyncio.run(main(args, 0, 1))
+        return 0
+
+    def start_worker(shard: int):
+        worker = multiprocessing.Process(target=run_shard, args=(main, args, shard, shards), name=f'shard-{shard}')
+        worker.start()
+        return worker
+
+    workers = {}  # shard -> (worker, the time it was started)
+    restarts = {}  # shard -> the time its worker is restarted at
+    startup_failures = collections.Counter()  # shard -> the times in a row its worker failed to start
+    stop_signals = []
+    wakeup_reader, wakeup_writer = os.pipe()
+
+    def stop(signal_number: int, _):
+        # the pool is stopped by the loop, a signal in the middle of starting a worker would leave it half started.
+        stop_signals.append(signal_number)
+        os.write(wakeup_writer, b'\0')
+
+    def forward_signal(signal_number: int, _):
+        for worker, _ in workers.values():
+            if worker.is_alive():
+                os.kill(worker.pid, signal_number)
+
+    previous_handlers = {stop_signal: signal.signal(stop_signal, stop) for stop_signal in STOP_SIGNALS}
+    for forwarded_signal in forwarded_signals:
+        signal.signal(forwarded_signal, forward_signal)
+
+    try:
+        for shard in range(shards):
+            workers[shard] = (start_worker(shard), time.monotonic())
+
+        while not stop_signals:
+            timeout = max(min(restarts.values()) - time.monotonic(), 0.0) if restarts else None
+            multiprocessing.connection.wait(
+                [wakeup_reader] + [worker.sentinel for worker, _ in workers.values()],
+                timeout,
+            )
+            if stop_signals:
+                break
+
+            now = time.monotonic()
+            for shard, (worker, started) in list(workers.items()):
+                if worker.is_alive():
+                    continue
+                del workers[shard]
+                if now - started < STARTUP_TIME:
+                    startup_failures[shard] += 1
+                else:
+                    startup_failures[shard] = 0
+                if startup_failures[shard] >= MAX_STARTUP_FAILURES:
+                    log.error(f'worker of shard {shard} failed to start {startup_failures[shard]} times in a row '
+                              f'(exitcode={worker.exitcode}), stopping')
+                    return 1
+                delay = min(RESTART_DELAY * 2 ** startup_failures[shard], MAX_RESTART_DELAY)
+                log.warning(f'worker of shard {shard} exited (exitcode={worker.exitcode}), restarting in {delay:.1f}s')
+                restarts[shard] = now + delay
+
+            for shard, restart_time in list(restarts.items()):
+                if restart_time <= now:
+                    del restarts[shard]
+                    workers[shard] = (start_worker(shard), now)
+        return 0
+    finally:
+        for worker, _ in workers.values():
+            worker.terminate()
+        for worker, _ in workers.values():
+            worker.join()
+        for stop_signal, handler in previous_handlers.items():
+            signal.signal(stop_signal, handler)
+        os.close(wakeup_reader)
+        os.close(wakeup_writer)
@@ -2,24 +2,37 @@ import asyncio
 import itertools
 import socket
 import logging
+from typing import Iterator
 
 
 log = logging.getLogger(__name__)
 
 
 class Server:
-    def __init__(self, host: str, port: int, new_connections: asyncio.Queue):
+    BACKLOG = 1024  # connections are accepted as fast as they arrive, and started concurrently.
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            new_connections: asyncio.Queue,
+            client_ids: Iterator[int] = None,
+            reuse_port: bool = False,
+    ):
         self.host = host
         self.port = port
         self.new_connections = new_connections
-        self._client_id = itertools.count()
+        self._client_id = itertools.count() if client_ids is None else client_ids
+        self.reuse_port = reuse_port  # lets several workers listen on the same port.
 
     async def serve_forever(self):
         server = await asyncio.start_server(
             self.handle_new_tcp_connection,
             host=self.host,
             port=self.port,
-            family=socket.AF_INET
+            family=socket.AF_INET,
+            reuse_port=self.reuse_port or None,
+            backlog=self.BACKLOG,
         )
         log.info(f'listening on {self.host}:{self.port}')
         await server.serve_forever()
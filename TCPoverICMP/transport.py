@@ -0,0 +1,95 @@
+import socket
+import logging
+import contextlib
+from typing import Callable
+from TCPoverICMP import icmp_packet, metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class Transport:
+    """
+    the datagram channel a tunnel endpoint sends its packets on, and receives them from.
+    packets are ICMPPackets on every transport, since the endpoint filters and steers packets by the identifier and
+    sequence number of their icmp header. received packets are handed to the endpoint right away, by a callback that is
+    called from the protocol callbacks of the event loop, without going through a queue.
+    """
+    DEFAULT_BUFFERSIZE = 4096
+    DEFAULT_MAX_BATCH_SIZE = 64
+    RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+    # the python socket module doesnt export these on every version, the values are from linux/in.h.
+    IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+    IP_PMTUDISC_WANT = getattr(socket, 'IP_PMTUDISC_WANT', 1)
+    IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+
+    def __init__(
+            self,
+            packet_received: Callable[[icmp_packet.ICMPPacket], None],
+            max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+            max_payload_size: int = DEFAULT_BUFFERSIZE,
+            sequence_number_filter: Callable[[int], bool] = None,
+            endpoint_metrics: metrics.EndpointMetrics = None,
+    ):
+        """
+        :param packet_received: called with every packet received, it must not block.
+        :param max_batch_size: maximal number of packets read from the socket at once.
+        :param max_payload_size: maximal icmp payload size that will be received.
+        :param sequence_number_filter: a filter of received packets by their sequence number, None accepts all of them.
+        :param endpoint_metrics: where to count the packets sent and received.
+        """
+        self.packet_received = packet_received
+        self.max_batch_size = max_batch_size
+        self.max_payload_size = max_payload_size
+        self.sequence_number_filter = sequence_number_filter
+        self.metrics = endpoint_metrics if endpoint_metrics is not None else metrics.EndpointMetrics()
+
+    def attach_filter(self, program: bytes):
+        """
+        attach a classic BPF program that drops foreign packets in the kernel. only transports that receive foreign
+        packets need one, so by default there is nothing to do.
+        :param program: the assembled program, see icmp_filter.
+        """
+
+    async def wait_for_incoming_packet(self):
+        """
+        receive packets, and hand them to packet_received, until cancelled.
+        """
+        raise NotImplementedError()
+
+    def sendto(self, packet: icmp_packet.ICMPPacket, destination: str):
+        """
+        send a packet to the other endpoint.
+        :param packet: an instance of ICMPPacket.
+        :param destination: the IP of the destination.
+        """
+        raise NotImplementedError()
+
+    def send_probe(self, packet: icmp_packet.ICMPPacket, destination: str):
+        """
+        send a path MTU probe, that is dropped on the way, rather than fragmented, if it is too big for the path.
+        :param packet: an instance of ICMPPacket, padded to the probed size.
+        :param destination: the IP of the destination.
+        """
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def dont_fragment(self, sock: socket.socket):
+        """
+        send with the DF flag within the context, even if the packets are bigger than the path MTU the kernel knows of.
+        """
+        sock.setsockopt(socket.IPPROTO_IP, self.IP_MTU_DISCOVER, self.IP_PMTUDISC_PROBE)
+        try:
+            yield
+        finally:
+            sock.setsockopt(socket.IPPROTO_IP, self.IP_MTU_DISCOVER, self.IP_PMTUDISC_WANT)
+
+    def deliver(self, packet: icmp_packet.ICMPPacket, size: int):
+        """
+        count a received packet, and hand it to the endpoint.
+        :param packet: the packet.
+        :param size: the size of the packet, as received.
+        """
+        self.metrics.packets_received.value += 1
+        self.metrics.bytes_received.value += size
+        self.packet_received(packet)
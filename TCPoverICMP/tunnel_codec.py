@@ -0,0 +1,256 @@
+import struct
+from google.protobuf import message
+from TCPoverICMP import exceptions
+from TCPoverICMP.proto import Tunnel
+from TCPoverICMP.tunnel_packet import TunnelPacket, Action, Direction
+
+
+ACTIONS = tuple(Action)
+DIRECTIONS = tuple(Direction)
+
+
+class ProtobufCodec:
+    """
+    the original encoding of tunnel packets, as a Tunnel protobuf message. kept for compatibility with older endpoints.
+    """
+    # the tags and maximal varints of client_id, sequence_number, action, direction, ack_number, window and
+    # compressed, and the tag and length of the payload.
+    MAX_DATA_HEADER_SIZE = 6 + 6 + 2 + 2 + 6 + 6 + 2 + 3
+    @staticmethod
+    def encode(tunnel_packet: TunnelPacket):
+        """
+        :param tunnel_packet: the packet to encode.
+        :return: the packet, serialized as a Tunnel message.
+        """
+        tunnel = Tunnel(
+            client_id=tunnel_packet.client_id,
+            sequence_number=tunnel_packet.sequence_number,
+            action=tunnel_packet.action,
+            direction=tunnel_packet.direction,
+        )
+        # only set the optional fields that are used, older endpoints dont expect the rest.
+        if tunnel_packet.ip:
+            tunnel.ip = tunnel_packet.ip
+        if tunnel_packet.port:
+            tunnel.port = tunnel_packet.port
+        if tunnel_packet.payload:
+            tunnel.payload = bytes(tunnel_packet.payload)
+        if tunnel_packet.ack_number:
+            tunnel.ack_number = tunnel_packet.ack_number
+        if tunnel_packet.capabilities:
+            tunnel.capabilities = tunnel_packet.capabilities
+        if tunnel_packet.window is not None:
+            tunnel.window = tunnel_packet.window
+        if tunnel_packet.compressed:
+            tunnel.compressed = True
+        if tunnel_packet.sack_blocks:  # flattened, the first and last sequence numbers of every block.
+            tunnel.sack_blocks.extend(number for block in tunnel_packet.sack_blocks for number in block)
+        return tunnel.SerializeToString()
+
+    @staticmethod
+    def decode(data: bytes):
+        """
+        :param data: a serialized Tunnel message.
+        :return: the decoded TunnelPacket.
+        """
+        tunnel = Tunnel()
+        try:
+            tunnel.ParseFromString(data)
+        except message.DecodeError as e:
+            raise exceptions.InvalidTunnelPacket(e)
+        if len(tunnel.sack_blocks) % 2:
+            raise exceptions.InvalidTunnelPacket('sack block without its last sequence number')
+
+        return TunnelPacket(
+            client_id=tunnel.client_id,
+            sequence_number=tunnel.sequence_number,
+            action=ACTIONS[tunnel.action],
+            direction=DIRECTIONS[tunnel.direction],
+            ip=tunnel.ip,
+            port=tunnel.port,
+            payload=tunnel.payload,
+            ack_number=tunnel.ack_number,
+            capabilities=tunnel.capabilities,
+            window=tunnel.window if tunnel.HasField('window') else None,
+            compressed=tunnel.compressed,
+            sack_blocks=tuple(zip(tunnel.sack_blocks[::2], tunnel.sack_blocks[1::2])),
+        )
+
+
+class BinaryCodec:
+    """
+    versioned fixed layout encoding of tunnel packets. the header is:
+    magic (includes the version), action, flags, options length, client_id, sequence_number, ack_number, payload length.
+    it is followed by type-length-value options, for the fields that most packets dont carry, and by the payload.
+    """
+    VERSION = 1
+    MAGIC = 0xb0 | VERSION  # a Tunnel message never starts with this byte, so both encodings can be told apart.
+    HEADER_STRUCT = struct.Struct('>BBBBIIIH')
+    OPTION_STRUCT = struct.Struct('>BB')
+    PORT_STRUCT = struct.Struct('>H')
+    CAPABILITIES_STRUCT = struct.Struct('>I')
+    WINDOW_STRUCT = struct.Struct('>I')
+    SACK_BLOCK_STRUCT = struct.Struct('>II')
+    MAX_DATA_HEADER_SIZE = HEADER_STRUCT.size + OPTION_STRUCT.size + WINDOW_STRUCT.size  # the only option of data.
+
+    FLAGS_OFFSET = 2  # the offset of the flags in the header, for filters that look at the raw packet.
+    FLAG_TO_FORWARDER = 0x01
+    FLAG_COMPRESSED = 0x02
+
+    OPTION_IP = 1
+    OPTION_PORT = 2
+    OPTION_CAPABILITIES = 3
+    OPTION_WINDOW = 4
+    OPTION_SACK = 5
+
+    @classmethod
+    def encode(cls, tunnel_packet: TunnelPacket):
+        """
+        :param tunnel_packet: the packet to encode.
+        :return: the packet, in the binary encoding.
+        """
+        options = cls._encode_options(tunnel_packet)
+        flags = cls.FLAG_TO_FORWARDER if tunnel_packet.direction == Direction.to_forwarder else 0
+        if tunnel_packet.compressed:
+            flags |= cls.FLAG_COMPRESSED
+
+        header = cls.HEADER_STRUCT.pack(
+            cls.MAGIC,
+            tunnel_packet.action,
+            flags,
+            len(options),
+            tunnel_packet.client_id,
+            tunnel_packet.sequence_number,
+            tunnel_packet.ack_number,
+            len(tunnel_packet.payload),
+        )
+        return b''.join((header, options, tunnel_packet.payload))
+
+    @classmethod
+    def decode(cls, data: bytes):
+        """
+        :param data: a packet in the binary encoding.
+        :return: the decoded TunnelPacket. if data is a memoryview, the payload is a view of it, and isnt copied.
+        """
+        tunnel_packet, _ = cls.decode_from(data)
+        return tunnel_packet
+
+    @classmethod
+    def decode_all(cls, data: bytes):
+        """
+        decode all the packets in a buffer, as coalesced by the sending endpoint.
+        :param data: the buffer containing one or more packets, one after the other.
+        :return: list of the decoded TunnelPackets.
+        """
+        tunnel_packets = []
+        offset = 0
+        while offset < len(data):
+            tunnel_packet, offset = cls.decode_from(data, offset)
+            tunnel_packets.append(tunnel_packet)
+        return tunnel_packets
+
+    @classmethod
+    def decode_from(cls, data: bytes, offset: int = 0):
+        """
+        decode a single packet from a buffer.
+        :param data: the buffer containing the packet.
+        :param offset: where the packet starts in the buffer.
+        :return: tuple of the decoded TunnelPacket, and the offset right after it.
+        """
+        view = memoryview(data)
+        if len(view) - offset < cls.HEADER_STRUCT.size:
+            raise exceptions.InvalidTunnelPacket('truncated header')
+
+        magic, action, flags, options_length, client_id, sequence_number, ack_number, payload_length = \
+            cls.HEADER_STRUCT.unpack_from(view, offset)
+        if magic != cls.MAGIC:
+            raise exceptions.InvalidTunnelPacket(f'unsupported binary encoding (magic={magic})')
+        if action >= len(ACTIONS):
+            raise exceptions.InvalidTunnelPacket(f'unknown action {action}')
+
+        tunnel_packet = TunnelPacket(
+            client_id=client_id,
+            sequence_number=sequence_number,
+            action=ACTIONS[action],
+            direction=Direction.to_forwarder if flags & cls.FLAG_TO_FORWARDER else Direction.to_proxy,
+            ack_number=ack_number,
+            compressed=bool(flags & cls.FLAG_COMPRESSED),
+        )
+
+        offset += cls.HEADER_STRUCT.size
+        if options_length:
+            cls._decode_options(view[offset:offset + options_length], tunnel_packet)
+        offset += options_length
+
+        if len(view) - offset < payload_length:
+            raise exceptions.InvalidTunnelPacket('truncated payload')
+        tunnel_packet.payload = view[offset:offset + payload_length]
+        return tunnel_packet, offset + payload_length
+
+    @classmethod
+    def _encode_options(cls, tunnel_packet: TunnelPacket):
+        options = []
+        if tunnel_packet.ip:
+            options.append((cls.OPTION_IP, tunnel_packet.ip.encode()))
+        if tunnel_packet.port:
+            options.append((cls.OPTION_PORT, cls.PORT_STRUCT.pack(tunnel_packet.port)))
+        if tunnel_packet.capabilities:
+            options.append((cls.OPTION_CAPABILITIES, cls.CAPABILITIES_STRUCT.pack(tunnel_packet.capabilities)))
+        if tunnel_packet.window is not None:
+            options.append((cls.OPTION_WINDOW, cls.WINDOW_STRUCT.pack(tunnel_packet.window)))
+        if tunnel_packet.sack_blocks:
+            options.append((cls.OPTION_SACK, b''.join(
+                cls.SACK_BLOCK_STRUCT.pack(first, last) for first, last in tunnel_packet.sack_blocks)))
+
+        return b''.join(cls.OPTION_STRUCT.pack(option_type, len(value)) + value for option_type, value in options)
+
+    @classmethod
+    def _decode_options(cls, options: memoryview, tunnel_packet: TunnelPacket):
+        offset = 0
+        while offset < len(options):
+            if len(options) - offset < cls.OPTION_STRUCT.size:
+                raise exceptions.InvalidTunnelPacket('truncated option')
+            option_type, length = cls.OPTION_STRUCT.unpack_from(options, offset)
+            offset += cls.OPTION_STRUCT.size
+            value = options[offset:offset + length]
+            offset += length
+            if len(value) != length:
+                raise exceptions.InvalidTunnelPacket('truncated option')
+
+            try:
+                if option_type == cls.OPTION_IP:
+                    tunnel_packet.ip = bytes(value).decode()
+                elif option_type == cls.OPTION_PORT:
+                    tunnel_packet.port, = cls.PORT_STRUCT.unpack(value)
+                elif option_type == cls.OPTION_CAPABILITIES:
+                    tunnel_packet.capabilities, = cls.CAPABILITIES_STRUCT.unpack(value)
+                elif option_type == cls.OPTION_WINDOW:
+                    tunnel_packet.window, = cls.WINDOW_STRUCT.unpack(value)
+                elif option_type == cls.OPTION_SACK:
+                    tunnel_packet.sack_blocks = tuple(cls.SACK_BLOCK_STRUCT.iter_unpack(value))
+                # unknown options are skipped, so newer endpoints can add options.
+            except (struct.error, UnicodeDecodeError) as e:
+                raise exceptions.InvalidTunnelPacket(e)
+
+
+def decode(data: bytes):
+    """
+    decode a tunnel packet of either encoding. the binary encoding is recognized by its first byte.
+    :param data: the encoded packet.
+    :return: the decoded TunnelPacket.
+    """
+    if len(data) and data[0] == BinaryCodec.MAGIC:
+        return BinaryCodec.decode(data)
+    return ProtobufCodec.decode(data)
+
+
+def decode_all(data: bytes):
+    """
+    decode all the tunnel packets in an icmp payload.
+    binary packets may have been coalesced into one payload, a protobuf payload always holds a single packet.
+    :param data: the icmp payload.
+    :return: list of the decoded TunnelPackets.
+    """
+    if len(data) and data[0] == BinaryCodec.MAGIC:
+        return BinaryCodec.decode_all(data)
+    return [ProtobufCodec.decode(data)]
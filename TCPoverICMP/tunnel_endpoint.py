@@ -1,7 +1,13 @@
+import signal
+import socket
 import asyncio
 import logging
-from TCPoverICMP import client_manager, icmp_socket, icmp_packet
-from TCPoverICMP.proto import Tunnel
+from typing import Callable, Coroutine
+from TCPoverICMP import client_manager, icmp_socket, icmp_packet, rtt_estimator, congestion, tunnel_codec, exceptions
+from TCPoverICMP import coalescer, path_mtu, delayed_ack, client_session, compression, icmp_filter
+from TCPoverICMP import multipath, metrics, transport, packet_tracer, retransmission
+from TCPoverICMP.tunnel_packet import TunnelPacket, Action, Direction, Capability
+from TCPoverICMP.packet_tracer import TraceEvent
 
 
 log = logging.getLogger(__name__)
@@ -10,116 +16,721 @@ log = logging.getLogger(__name__)
 class TunnelEndpoint:
     MAGIC_IDENTIFIER = 0xcafe
     MAGIC_SEQUENCE_NUMBER = 0xbabe
-    ACK_WAITING_TIME = 0.7
+    RETRANSMISSION_BUDGET = 10.0
+    FAST_RETRANSMIT_THRESHOLD = 3  # acks of later packets that tell a packet was lost, rather than reordered.
+    MAX_FAST_RETRANSMIT_THRESHOLD = 16
+    MAX_STALE_CONNECTIONS = 1024
+    DEFAULT_METRICS_HOST = '127.0.0.1'
+    DEFAULT_TRACE_PATH = 'tunnel.trace'
 
-    def __init__(self, other_endpoint):
-        self.other_endpoint = other_endpoint
-        log.info(f'other tunnel endpoint: {self.other_endpoint}')
+    def __init__(
+            self,
+            other_endpoint,
+            max_congestion_window: int = congestion.CongestionController.MAX_WINDOW,
+            max_send_rate: float = congestion.Pacer.MAX_RATE,
+            binary_codec: bool = True,
+            receive_batch_size: int = transport.Transport.DEFAULT_MAX_BATCH_SIZE,
+            coalescing: bool = True,
+            coalescing_delay: float = coalescer.Coalescer.DEFAULT_FLUSH_DELAY,
+            path_mtu_discovery: bool = True,
+            max_payload_size: int = path_mtu.PathMTUProber.DEFAULT_MAX_PAYLOAD_SIZE,
+            delayed_acks: bool = True,
+            segments_per_ack: int = delayed_ack.DelayedAcks.DEFAULT_SEGMENTS_PER_ACK,
+            ack_delay: float = delayed_ack.DelayedAcks.DEFAULT_DELAY,
+            flow_control: bool = True,
+            receive_window: int = client_session.ClientSession.DEFAULT_RECEIVE_BUFFER_SIZE,
+            max_clients: int = 0,
+            max_clients_per_peer: int = 0,
+            idle_timeout: float = 0.0,
+            keepalive: float = client_manager.ClientManager.DEFAULT_KEEPALIVE,
+            payload_compression: bool = True,
+            compression_level: int = compression.StreamCompressor.DEFAULT_LEVEL,
+            selective_ack: bool = True,
+            early_data: bool = True,
+            shard: int = 0,
+            shards: int = 1,
+            kernel_filter: bool = True,
+            metrics_port: int = None,
+            metrics_host: str = DEFAULT_METRICS_HOST,
+            transport: Callable[..., transport.Transport] = icmp_socket.ICMPSocket,
+            trace_capacity: int = 0,
+            trace_sample_every: int = packet_tracer.PacketTracer.DEFAULT_SAMPLE_EVERY,
+            trace_path: str = DEFAULT_TRACE_PATH,
+    ):
+        # the other endpoint might have several addresses, the tunnel is striped across the paths to all of them.
+        addresses = [other_endpoint] if isinstance(other_endpoint, str) else list(other_endpoint)
+        self.paths = multipath.PathScheduler(addresses)
+        self.other_endpoint = addresses[0]
+        log.info(f'other tunnel endpoint: {", ".join(addresses)}')
+        self.shard = shard
+        self.shards = shards
+        self.steer_outgoing_packets = False
+        self.metrics = metrics.EndpointMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        # packet tracing is off by default. when it is off, the hot path only checks that there is no tracer.
+        self.tracer = packet_tracer.PacketTracer(trace_capacity, trace_sample_every) if trace_capacity else None
+        self.trace_path = trace_path if shards == 1 else f'{trace_path}.{shard}'
 
-        self.stale_tcp_connections = asyncio.Queue()
-        self.incoming_from_icmp_channel = asyncio.Queue()
-        self.incoming_from_tcp_channel = asyncio.Queue()
+        self.stale_tcp_connections = asyncio.Queue(self.MAX_STALE_CONNECTIONS)
+        self.tasks = set()
 
-        self.icmp_socket = icmp_socket.ICMPSocket(self.incoming_from_icmp_channel)
-        self.client_manager = client_manager.ClientManager(self.stale_tcp_connections, self.incoming_from_tcp_channel)
+        # the transport factory takes the arguments of Transport. the icmp transport is the default.
+        self.transport = transport(
+            self.handle_icmp_packet,
+            receive_batch_size,
+            max_payload_size,
+            self.accepts_sequence_number if shards > 1 else None,
+            self.metrics,
+        )
+        if kernel_filter:
+            self.attach_kernel_filter()
+        self.client_manager = client_manager.ClientManager(
+            self.stale_tcp_connections,
+            self.send_data,
+            receive_buffer_size=receive_window,
+            compression_level=compression_level,
+            max_clients=max_clients,
+            max_clients_per_peer=max_clients_per_peer,
+            idle_timeout=idle_timeout,
+            keepalive=keepalive,
+        )
 
-        self.packets_requiring_ack = {}
+        self.rtt_estimator = rtt_estimator.RTTEstimator()
+        self.congestion_controller = congestion.CongestionController(self.rtt_estimator, max_congestion_window)
+        self.pacer = congestion.Pacer(max_send_rate)
+        self.coalescer = coalescer.Coalescer(self.transmit_icmp_packet, flush_delay=coalescing_delay)
+        self.path_mtu_prober = path_mtu.PathMTUProber(
+            self.send_path_mtu_probe,
+            self.rtt_estimator,
+            self.set_payload_size,
+            max_payload_size,
+        )
+        self.path_mtu_negotiated = asyncio.Event()
+        self.delayed_acks = delayed_ack.DelayedAcks(self.send_cumulative_ack, segments_per_ack, ack_delay)
+        self.retransmissions = retransmission.RetransmissionQueue(self.retransmission_timeout)
+        self.acked_out_of_order = {}  # client_id -> segments acked out of order, by the packet being handled.
+        self.closed_windows = set()  # clients whose receive window on the other endpoint was advertised as closed.
+        self.fast_retransmit_threshold = self.FAST_RETRANSMIT_THRESHOLD  # grows as reordering is seen, see ack_packet.
         self.coroutines_to_run = []
 
+        # received packets are dispatched from the protocol callbacks of the transport, so the handlers cant block.
+        # the handlers of start and end requests wait for connections to open and close, so they run in tasks.
+        self.actions = {
+            Action.start: self.in_task(self.handle_start_request),
+            Action.end: self.in_task(self.handle_end_request),
+            Action.data: self.handle_data_request,
+            Action.ack: self.handle_ack_request,
+            Action.probe: self.handle_probe_request,
+            Action.probe_reply: self.handle_probe_reply_request,
+        }
+
+        self.capabilities = Capability(0)
+        if binary_codec:
+            self.capabilities |= Capability.binary_codec
+            if coalescing:  # only binary packets are self delimiting, so they are the only ones that can be coalesced.
+                self.capabilities |= Capability.coalescing
+        if path_mtu_discovery:
+            self.capabilities |= Capability.path_mtu_discovery
+        if delayed_acks:
+            self.capabilities |= Capability.delayed_ack
+        if flow_control:
+            self.capabilities |= Capability.flow_control
+        if payload_compression:
+            self.capabilities |= Capability.compression
+        if selective_ack:
+            self.capabilities |= Capability.selective_ack
+        if early_data:
+            self.capabilities |= Capability.early_data
+        if shards > 1:
+            self.capabilities |= Capability.sharded
+        self.negotiated_capabilities = Capability(0)
+        self.set_payload_size(self.path_mtu_prober.payload_size)
+        self.register_metrics()
+
     @property
     def direction(self):
         raise NotImplementedError()
 
-    async def handle_start_request(self, tunnel_packet: Tunnel):
+    @property
+    def codec(self):
+        """
+        the codec of outgoing packets. the binary codec is used once both endpoints advertised support for it.
+        """
+        if self.negotiated_capabilities & Capability.binary_codec:
+            return tunnel_codec.BinaryCodec
+        return tunnel_codec.ProtobufCodec
+
+    def attach_kernel_filter(self):
+        """
+        have the kernel drop every icmp packet that isnt headed to this endpoint, before it wakes up the event loop:
+        other icmp traffic, packets of other shards, and automatic echo replies to the packets of this endpoint.
+        the direction is only checked in binary encoded packets, and everything is checked again after parsing.
+        """
+        try:
+            source_addresses = [socket.gethostbyname(path.address) for path in self.paths.paths]
+        except OSError:
+            source_addresses = []
+
+        incoming_direction = Direction.to_proxy if self.direction == Direction.to_forwarder else Direction.to_forwarder
+        program = icmp_filter.tunnel_filter(
+            icmp_types=tuple(icmp_type.value for icmp_type in icmp_packet.ICMPType),
+            identifier=self.MAGIC_IDENTIFIER,
+            sequence_number=self.MAGIC_SEQUENCE_NUMBER,
+            source_addresses=source_addresses,
+            shard=self.shard,
+            shards=self.shards,
+            marker_offset=0,
+            marker=tunnel_codec.BinaryCodec.MAGIC,
+            direction_offset=tunnel_codec.BinaryCodec.FLAGS_OFFSET,
+            direction_mask=tunnel_codec.BinaryCodec.FLAG_TO_FORWARDER,
+            direction=tunnel_codec.BinaryCodec.FLAG_TO_FORWARDER if incoming_direction == Direction.to_forwarder else 0,
+        )
+        try:
+            self.transport.attach_filter(program)
+        except OSError as e:
+            log.warning(f'cant attach the kernel filter ({e}), filtering after parsing only')
+
+    def register_metrics(self):
+        """
+        register the metrics that are collected from the state of the endpoint when they are scraped.
+        """
+        def client_bytes(attribute: str):
+            return lambda: {
+                (client_id,): getattr(client.session, attribute)
+                for client_id, client in self.client_manager.clients.items()
+            }
+
+        def paths(value):
+            return lambda: {(path.address,): value(path) for path in self.paths.paths}
+
+        self.metrics.collected(
+            'tunnel_stale_connections',
+            'clients waiting to be ended',
+            lambda: self.stale_tcp_connections.qsize(),
+        )
+        self.metrics.collected(
+            'tunnel_tasks',
+            'tasks handling start and end requests, and ending clients',
+            lambda: len(self.tasks),
+        )
+        self.metrics.collected(
+            'tunnel_packets_requiring_ack',
+            'tunnel packets sent and waiting for their ack',
+            lambda: len(self.retransmissions),
+        )
+        self.metrics.collected('tunnel_clients', 'connected clients', lambda: len(self.client_manager.clients))
+        self.metrics.collected(
+            'tunnel_client_bytes_read_total',
+            'bytes read from the tcp connection of a client, to send on the tunnel',
+            client_bytes('bytes_read'),
+            ('client_id',),
+            metrics.COUNTER,
+        )
+        self.metrics.collected(
+            'tunnel_client_bytes_written_total',
+            'bytes received on the tunnel and written to the tcp connection of a client',
+            client_bytes('bytes_written'),
+            ('client_id',),
+            metrics.COUNTER,
+        )
+        self.metrics.collected(
+            'tunnel_congestion_window',
+            'congestion window, in packets',
+            lambda: self.congestion_controller.window,
+        )
+        self.metrics.collected(
+            'tunnel_path_srtt_seconds',
+            'smoothed round trip time of a path',
+            paths(lambda path: path.rtt.srtt or 0.0),
+            ('address',),
+        )
+        self.metrics.collected(
+            'tunnel_path_loss_ratio',
+            'smoothed loss rate of a path',
+            paths(lambda path: path.loss_rate),
+            ('address',),
+        )
+        self.metrics.collected(
+            'tunnel_path_up',
+            'whether a path is in the rotation',
+            paths(lambda path: int(path.is_up)),
+            ('address',),
+        )
+
+    @staticmethod
+    def steering_key(client_id: int):
+        """
+        the key that steers the packets of a client to the worker that owns it. it is carried in the sequence number
+        of the icmp header, so workers can drop the packets of other workers without parsing them.
+        """
+        return client_id & 0xffff
+
+    def owns(self, client_id: int):
+        """
+        whether the client belongs to this worker. with a single worker, every client does.
+        """
+        return self.steering_key(client_id) % self.shards == self.shard
+
+    def accepts_sequence_number(self, sequence_number: int):
+        """
+        whether a received icmp packet might have packets of this worker, judging by its sequence number.
+        packets that arent steered, like start requests and path MTU probes, are accepted by all the workers.
+        """
+        return sequence_number == self.MAGIC_SEQUENCE_NUMBER or sequence_number % self.shards == self.shard
+
+    def negotiate_capabilities(self, tunnel_packet: TunnelPacket):
+        """
+        capabilities are advertised on start requests and on their acks. use the ones both endpoints support.
+        a start request always resets them, since the other endpoint might have been replaced by an older one.
+        the sharded capability is the exception, it only tells that the other endpoint wants its packets steered.
+        :param tunnel_packet: a start request or an ack, possibly advertising the capabilities of the other endpoint.
+        """
+        if tunnel_packet.action == Action.start or tunnel_packet.capabilities:
+            negotiated_capabilities = self.capabilities & tunnel_packet.capabilities & ~Capability.sharded
+            if negotiated_capabilities != self.negotiated_capabilities:
+                log.info(f'negotiated capabilities: {negotiated_capabilities!r}')
+            self.negotiated_capabilities = negotiated_capabilities
+            self.steer_outgoing_packets = bool(tunnel_packet.capabilities & Capability.sharded)
+            self.set_payload_size(self.path_mtu_prober.payload_size)  # the header size depends on the codec.
+            self.client_manager.compression = bool(negotiated_capabilities & Capability.compression)
+            if negotiated_capabilities & Capability.path_mtu_discovery:
+                self.path_mtu_negotiated.set()
+            else:
+                self.path_mtu_negotiated.clear()
+
+    def set_payload_size(self, payload_size: int):
+        """
+        set the size of the icmp payloads sent to the other endpoint, as found by path MTU discovery.
+        data is segmented so a data packet fills a whole payload.
+        :param payload_size: the maximal icmp payload size.
+        """
+        self.coalescer.max_payload_size = payload_size
+        self.client_manager.segment_size = payload_size - self.codec.MAX_DATA_HEADER_SIZE
+
+    async def handle_start_request(self, tunnel_packet: TunnelPacket):
         raise NotImplementedError()
 
-    async def handle_end_request(self, tunnel_packet: Tunnel):
+    async def handle_end_request(self, tunnel_packet: TunnelPacket):
         """
-        generic handle for end request. remove client and send ack
+        generic handle for end request. remove client and send ack.
+        a repeated end request (the ack was lost) is acked again.
         :param tunnel_packet: packet containing the client_id to remove.
         :return:
         """
-        await self.client_manager.remove_client(tunnel_packet.client_id)
+        if self.client_manager.client_exists(tunnel_packet.client_id):
+            await self.remove_client(tunnel_packet.client_id)
         self.send_ack(tunnel_packet)
 
-    async def handle_data_request(self, tunnel_packet: Tunnel):
+    async def remove_client(self, client_id: int):
+        """
+        remove a client. its pending delayed ack is sent first, since the other endpoint keeps resending the data it
+        acks until it is acked, and data of removed clients isnt acked. its packets that are still waiting for an ack
+        are given up on, they wont be acked either.
+        :param client_id: the client to remove.
+        """
+        self.delayed_acks.flush(client_id)
+        await self.client_manager.remove_client(client_id)
+        self.closed_windows.discard(client_id)
+        for packet in self.retransmissions.pop_client(client_id):
+            self.finish_packet(packet, False)
+
+    def handle_probe_request(self, tunnel_packet: TunnelPacket):
+        """
+        reply to a path MTU probe. the reply is small, only the probe itself has to get through.
+        :param tunnel_packet: the probe. its sequence_number is its size.
+        """
+        new_tunnel_packet = TunnelPacket(
+            sequence_number=tunnel_packet.sequence_number,
+            action=Action.probe_reply,
+            direction=self.direction,
+        )
+        self.send_icmp_packet(icmp_packet.ICMPType.EchoReply, self.codec.encode(new_tunnel_packet))
+
+    def handle_probe_reply_request(self, tunnel_packet: TunnelPacket):
+        """
+        a probe of ours got through to the other endpoint.
+        :param tunnel_packet: the reply. its sequence_number is the size of the probe.
+        """
+        self.path_mtu_prober.probe_replied(tunnel_packet.sequence_number)
+
+    def handle_data_request(self, tunnel_packet: TunnelPacket):
         """
         generic handle for data request. forwards to the proper client and sends an ack.
+        a data packet without a sequence number is a probe of a closed receive window, and is only acked.
+        if delayed acks were negotiated, segments that arrive in order are acked later, and cumulatively.
+        duplicate and out of order segments are still acked right away, so the other endpoint doesnt resend them, and
+        learns about the missing segments as soon as possible. so are segments that fill a gap while others remain.
+        the packet might carry a piggybacked ack of the data sent to the client, which is handled first.
+        data of a client that was already removed is ignored.
         :param tunnel_packet: the packet to send.
         """
-        await self.client_manager.write_to_client(
+        if not self.client_manager.client_exists(tunnel_packet.client_id):
+            self.drop_tunnel_packet('unknown_client', tunnel_packet)
+            return
+
+        self.handle_cumulative_ack(tunnel_packet)
+
+        previously_acked_up_to = self.client_manager.acked_up_to(tunnel_packet.client_id)
+        if not self.client_manager.write_to_client(
             tunnel_packet.client_id,
             tunnel_packet.sequence_number,
-            tunnel_packet.payload
-        )
-        self.send_ack(tunnel_packet)
+            tunnel_packet.payload,
+            tunnel_packet.compressed,
+        ):
+            self.drop_tunnel_packet('receive_buffer_full', tunnel_packet)
+            return  # the receive buffer of the client is full. dont ack, so the packet is resent later.
+        in_order = previously_acked_up_to < tunnel_packet.sequence_number <= \
+            self.client_manager.acked_up_to(tunnel_packet.client_id)
+
+        if in_order and self.negotiated_capabilities & Capability.delayed_ack and \
+                not self.client_manager.sack_blocks(tunnel_packet.client_id):
+            self.delayed_acks.on_segment(tunnel_packet.client_id)
+        else:
+            self.send_ack(tunnel_packet)
 
-    async def handle_ack_request(self, tunnel_packet: Tunnel):
+    def handle_ack_request(self, tunnel_packet: TunnelPacket):
         """
         generic handle for an ack request.
-        packet can be recognized singularly by combining client_id and sequence_number
+        packet can be recognized singularly by combining client_id and sequence_number.
+        if the ack carries an ack_number, all the data segments of the client up to it are acked as well.
         :param tunnel_packet: the packet to ack.
         """
-        packet_id = (tunnel_packet.client_id, tunnel_packet.sequence_number)
-        if packet_id in self.packets_requiring_ack:
-            self.packets_requiring_ack[packet_id].set()
+        window = self.client_manager.send_window(tunnel_packet.client_id)
+        if window is not None:
+            window.ack(tunnel_packet.sequence_number)
+
+        packet = self.ack_packet(tunnel_packet.client_id, tunnel_packet.sequence_number)
+        self.handle_cumulative_ack(tunnel_packet, packet)
+
+    def handle_cumulative_ack(self, tunnel_packet: TunnelPacket, acked_packet: retransmission.OutstandingPacket = None):
+        """
+        ack all the data segments of a client up to ack_number, as received in order by the other endpoint, and the
+        ones in its sack blocks, as received out of order. segments acked out of order tell which of the segments
+        before them are missing, see detect_losses. losses are detected once all the tunnel packets that arrived in the
+        same icmp packet were handled, since coalesced acks might ack the segments that seem missing.
+        then update the receive window the other endpoint advertised along with the ack.
+        :param tunnel_packet: an ack, or a data packet with a piggybacked ack.
+        :param acked_packet: the packet the ack is for, if it was waiting for its ack.
+        """
+        window = self.client_manager.send_window(tunnel_packet.client_id)
+        if window is None:
+            return
+
+        if tunnel_packet.ack_number:
+            for sequence_number in window.ack_cumulative(tunnel_packet.ack_number):
+                self.ack_packet(tunnel_packet.client_id, sequence_number)
+
+        acked_out_of_order = []
+        if acked_packet is not None and acked_packet.action == Action.data and \
+                acked_packet.sequence_number > window.acked_up_to:
+            acked_out_of_order.append(acked_packet)
+        for first, last in tunnel_packet.sack_blocks:
+            for sequence_number in window.ack_range(first, last):
+                packet = self.ack_packet(tunnel_packet.client_id, sequence_number)
+                if packet is not None:
+                    acked_out_of_order.append(packet)
+        if acked_out_of_order and self.capabilities & Capability.selective_ack:
+            self.acked_out_of_order.setdefault(tunnel_packet.client_id, []).extend(acked_out_of_order)
+
+        if tunnel_packet.window is not None:
+            window.update_advertised_window(tunnel_packet.ack_number, tunnel_packet.window)
+            if window.advertised_window == 0:
+                self.closed_windows.add(tunnel_packet.client_id)
+            else:
+                self.closed_windows.discard(tunnel_packet.client_id)
+
+    def detect_losses(self):
+        """
+        fast retransmit: a segment that is still in flight, while segments of the client that were sent after it are
+        acked, is reported missing by every such ack. once it was reported missing fast_retransmit_threshold times, it
+        is sent again right away, instead of stalling the client until its retransmission timeout. a few reports are
+        needed, since segments might have been reordered on the way, and only segments sent after the last
+        transmission of a segment report it, so it isnt resent again because of acks that were already on the way.
+        a small window might not have enough segments after a lost one to report it, so the threshold is lowered to
+        fit the window (early retransmit, RFC 5827).
+        the segments acked out of order are taken from acked_out_of_order.
+        """
+        missing = []
+        for client_id, acked_packets in self.acked_out_of_order.items():
+            window = self.client_manager.send_window(client_id)
+            if window is None:
+                continue
+            highest_acked = max(packet.sequence_number for packet in acked_packets)
+            threshold = max(min(self.fast_retransmit_threshold, len(window.in_flight) + len(acked_packets) - 1), 1)
+            for sequence_number in window.in_flight:  # the oldest segment is first, so only the gaps are visited.
+                if sequence_number >= highest_acked:
+                    break
+                packet = self.retransmissions.get(client_id, sequence_number)
+                if packet is None:
+                    continue
+                packet.missing_reports += sum(1 for acked_packet in acked_packets if acked_packet.sent > packet.sent)
+                if packet.missing_reports >= threshold:
+                    missing.append(packet)
+        self.acked_out_of_order.clear()
+
+        for packet in missing:
+            self.report_loss(packet)
+            self.retransmit(packet, asyncio.get_running_loop().time(), fast=True)
+
+    def drop_tunnel_packet(self, reason: str, tunnel_packet: TunnelPacket):
+        """
+        count a received tunnel packet that is ignored, and trace it.
+        :param reason: one of EndpointMetrics.DROP_REASONS.
+        :param tunnel_packet: the ignored packet.
+        """
+        self.metrics.drop(reason, len(tunnel_packet.payload))
+        if self.tracer is not None:
+            self.tracer.record(
+                TraceEvent.dropped,
+                tunnel_packet.client_id,
+                tunnel_packet.sequence_number,
+                tunnel_packet.action,
+                len(tunnel_packet.payload),
+            )
+
+    def ack_packet(self, client_id: int, sequence_number: int):
+        """
+        a packet that waits for its ack was acked. the rtt sample and the ack are reported to the rtt estimator, the
+        congestion controller and the path the packet was sent on.
+        start requests arent sampled: the other endpoint acks them once the destination is connected, so the sample
+        would count the connection time as a round trip, and inflate the retransmission timeout and the pacing rate.
+        a fast retransmitted packet that is acked within half a round trip was only reordered, the ack is of the
+        original packet. the fast retransmit threshold is raised, to tolerate reordering of that extent.
+        :return: the packet, or None if it wasnt waiting for an ack.
+        """
+        packet = self.retransmissions.pop(client_id, sequence_number)
+        if packet is None:
+            return
+
+        acked = asyncio.get_running_loop().time()
+        # Karn's rule: the ack of a retransmitted packet is ambiguous, so dont sample it.
+        rtt = None if packet.retransmitted or packet.action == Action.start else acked - packet.sent
+        if rtt is not None:
+            self.rtt_estimator.add_sample(rtt)
+            self.metrics.rtt.observe(rtt)
+        elif packet.fast_retransmitted and self.rtt_estimator.srtt is not None and \
+                acked - packet.sent < self.rtt_estimator.srtt / 2:
+            self.fast_retransmit_threshold = min(self.fast_retransmit_threshold + 1, self.MAX_FAST_RETRANSMIT_THRESHOLD)
+        self.metrics.ack_latency.observe(acked - packet.first_sent)
+        if self.tracer is not None:
+            self.tracer.record(
+                TraceEvent.acked,
+                packet.client_id,
+                packet.sequence_number,
+                packet.action,
+                len(packet.payload),
+            )
+        if packet.single_path:  # otherwise, any of the paths might have delivered the packet.
+            packet.path.on_ack(rtt)
+        self.congestion_controller.on_ack()
+        self.pacer.set_rate(self.congestion_controller.pacing_rate)
+        self.finish_packet(packet, True)
+        return packet
+
+    def create_task(self, coroutine: Coroutine):
+        """
+        run a coroutine in a task, that is referenced until it is done.
+        :return: the task.
+        """
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def in_task(self, handler: Callable[[TunnelPacket], Coroutine]):
+        """
+        :return: a handler that runs the coroutine of the given handler in a task, for the dispatch table.
+        """
+        return lambda tunnel_packet: self.create_task(handler(tunnel_packet))
 
     async def run(self):
         """
         run the whole tunnel endpoint, which pretty much means run all the basic tasks and gather them.
         """
         constant_coroutines = [
-            self.handle_incoming_from_tcp_channel(),
-            self.handle_incoming_from_icmp_channel(),
             self.wait_for_stale_connection(),
-            self.icmp_socket.wait_for_incoming_packet(),
+            self.transport.wait_for_incoming_packet(),
+            self.discover_path_mtu(),
+            self.probe_closed_windows(),
+            self.client_manager.reap_forever(),
         ]
+        if self.metrics_port is not None:  # every worker serves its own metrics, on a port of its own.
+            constant_coroutines.append(self.metrics.serve(self.metrics_host, self.metrics_port + self.shard))
+        if self.tracer is not None:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.dump_trace)
         running_tasks = [asyncio.create_task(coroutine) for coroutine in self.coroutines_to_run + constant_coroutines]
 
         await asyncio.gather(*running_tasks)
 
-    async def handle_incoming_from_icmp_channel(self):
+    def dump_trace(self):
+        """
+        write the packet trace to trace_path, on SIGUSR1. read it with `python -m TCPoverICMP.packet_tracer`.
+        """
+        try:
+            self.tracer.dump(self.trace_path)
+        except OSError as e:
+            log.warning(f'cant dump the packet trace to {self.trace_path} ({e})')
+
+    async def discover_path_mtu(self):
         """
-        listen for new tunnel packets from the icmp channel. parse and execute them.
+        discover the path MTU periodically, once the other endpoint is known to reply to probes.
+        """
+        await self.path_mtu_negotiated.wait()
+        await self.path_mtu_prober.run()
+
+    async def probe_closed_windows(self):
+        """
+        every retransmission timeout, probe the clients whose receive window on the other endpoint was advertised as
+        closed, in case the ack that opened it again was lost.
+        only the clients in closed_windows are checked, not all of them, so an endpoint with many idle clients doesnt
+        spend every timeout going over them.
         """
         while True:
-            new_icmp_packet = await self.incoming_from_icmp_channel.get()
-            if new_icmp_packet.identifier != self.MAGIC_IDENTIFIER or new_icmp_packet.sequence_number != self.MAGIC_SEQUENCE_NUMBER:
-                log.debug(f'wrong magic (identifier={new_icmp_packet.identifier})'
-                          f'(seq_num={new_icmp_packet.sequence_number}), ignoring')
-                continue
+            await asyncio.sleep(self.rtt_estimator.rto)
+            for client_id in list(self.closed_windows):
+                window = self.client_manager.send_window(client_id)
+                if window is None:  # the client was removed.
+                    self.closed_windows.discard(client_id)
+                elif window.is_closed:
+                    self.send_window_probe(client_id)
 
-            tunnel_packet = Tunnel()
-            tunnel_packet.ParseFromString(new_icmp_packet.payload)
-            log.debug(f'received:\n{tunnel_packet}')
+    def handle_icmp_packet(self, new_icmp_packet: icmp_packet.ICMPPacket):
+        """
+        parse a single icmp packet, and execute the tunnel packets in it.
+        called by the transport for every packet it receives, as soon as it is received.
+        :param new_icmp_packet: a packet received on the transport.
+        """
+        if new_icmp_packet.identifier != self.MAGIC_IDENTIFIER or (
+                self.shards == 1 and new_icmp_packet.sequence_number != self.MAGIC_SEQUENCE_NUMBER):
+            self.metrics.drop('wrong_magic', len(new_icmp_packet.payload))
+            return
 
-            if tunnel_packet.direction == self.direction:
-                log.debug('ignoring packet headed in the wrong direction')
-                continue
+        try:
+            tunnel_packets = tunnel_codec.decode_all(new_icmp_packet.payload)
+        except exceptions.InvalidTunnelPacket as e:
+            log.debug(f'invalid tunnel packet ({e}), ignoring')
+            self.metrics.drop('invalid_tunnel_packet', len(new_icmp_packet.payload))
+            return
 
-            actions = {
-                Tunnel.Action.start: self.handle_start_request,
-                Tunnel.Action.end: self.handle_end_request,
-                Tunnel.Action.data: self.handle_data_request,
-                Tunnel.Action.ack: self.handle_ack_request,
-            }
-            await actions[tunnel_packet.action](tunnel_packet)
+        for tunnel_packet in tunnel_packets:
+            self.handle_tunnel_packet(tunnel_packet)
+        if self.acked_out_of_order:
+            self.detect_losses()
 
-    async def handle_incoming_from_tcp_channel(self):
+    def handle_tunnel_packet(self, tunnel_packet: TunnelPacket):
         """
-        await on the incoming_from_tcp_channel queue for new data packets to send on the icmp channel.
+        execute a single tunnel packet.
+        :param tunnel_packet: a packet received from the other endpoint.
         """
-        while True:
-            data, client_id, sequence_number = await self.incoming_from_tcp_channel.get()
-
-            new_tunnel_packet = Tunnel(
-                client_id=client_id,
-                sequence_number=sequence_number,
-                action=Tunnel.Action.data,
-                direction=self.direction,
-                payload=data,
+        if self.tracer is not None:
+            self.tracer.record(
+                TraceEvent.received,
+                tunnel_packet.client_id,
+                tunnel_packet.sequence_number,
+                tunnel_packet.action,
+                len(tunnel_packet.payload),
             )
-            asyncio.create_task(self.send_icmp_packet_and_wait_for_ack(new_tunnel_packet))
+
+        if tunnel_packet.direction == self.direction:
+            self.drop_tunnel_packet('wrong_direction', tunnel_packet)
+            return
+
+        # probe replies are handled by every worker, since any of them might have sent the probe.
+        if not self.owns(tunnel_packet.client_id) and tunnel_packet.action != Action.probe_reply:
+            return
+
+        if tunnel_packet.action in (Action.start, Action.ack):
+            self.negotiate_capabilities(tunnel_packet)
+
+        self.actions[tunnel_packet.action](tunnel_packet)
+
+    async def send_data(self, data: memoryview, client_id: int, sequence_number: int, compressed: bool):
+        """
+        send a data segment read from a client, once the congestion window has room for it, and the pacer allows it.
+        the reader of the client only waits for these, the ack is waited for by the retransmission queue.
+        :param data: the segment.
+        :param client_id: the client the segment was read from.
+        :param sequence_number: the sequence number of the segment.
+        :param compressed: whether the segment is a part of the compressed stream of the client.
+        """
+        await self.congestion_controller.acquire()
+        try:
+            await self.pacer.wait()
+        except asyncio.CancelledError:  # the client is being removed.
+            self.congestion_controller.release()
+            raise
+
+        new_tunnel_packet = TunnelPacket(
+            client_id=client_id,
+            sequence_number=sequence_number,
+            action=Action.data,
+            direction=self.direction,
+            payload=data,
+            ack_number=self.piggybacked_ack_number(client_id),
+            compressed=compressed,
+        )
+        if new_tunnel_packet.ack_number:
+            new_tunnel_packet.window = self.advertised_window(client_id)
+        self.send_reliably(new_tunnel_packet, in_window=True)
+
+    @property
+    def peer_ack_delay(self):
+        """
+        the time the other endpoint might hold an ack, if delayed acks were negotiated. its ack delay isnt advertised,
+        so it is assumed to be the same as ours. it is added to the retransmission timeouts (like the max_ack_delay of
+        RFC 9002), since the ack of the last segment of a flight is always delayed, and the rtt variance doesnt cover
+        it: it would time out right before its ack arrives.
+        """
+        if not self.negotiated_capabilities & Capability.delayed_ack:
+            return 0.0
+        return self.delayed_acks.delay
+
+    @property
+    def loss_probe_timeout(self):
+        """
+        the time a data segment waits for its ack before the window is probed for lost acks, see probe_tail_loss. two
+        round trips, and the delay of a delayed ack (the PTO of RFC 8985).
+        :return: the timeout in seconds, or None if there is no rtt estimate or the other endpoint doesnt send sack
+        blocks, which the probe relies on.
+        """
+        if self.rtt_estimator.srtt is None or not self.negotiated_capabilities & Capability.selective_ack:
+            return None
+        return 2 * self.rtt_estimator.srtt + self.peer_ack_delay
+
+    def piggybacked_ack_number(self, client_id: int):
+        """
+        the cumulative ack to piggyback on a data packet sent to the other endpoint, which makes a pending delayed ack
+        of the client redundant.
+        :param client_id: the client the data belongs to.
+        :return: the ack_number for the data packet, or 0 if the other endpoint doesnt expect one.
+        """
+        if not self.negotiated_capabilities & Capability.delayed_ack:
+            return 0
+        self.delayed_acks.take(client_id)
+        return self.client_manager.acked_up_to(client_id)
+
+    def advertised_window(self, client_id: int):
+        """
+        the receive window of a client, to advertise to the other endpoint along with a cumulative ack.
+        :param client_id: the client the window belongs to.
+        :return: the window in bytes, or None if the other endpoint doesnt expect one.
+        """
+        if not self.negotiated_capabilities & Capability.flow_control:
+            return None
+        if not self.client_manager.client_exists(client_id):
+            return None
+        return self.client_manager.receive_window(client_id)
+
+    def selective_ack_blocks(self, client_id: int):
+        """
+        the ranges of data a client received out of order, to report to the other endpoint along with a cumulative ack.
+        :param client_id: the client the data belongs to.
+        :return: tuple of (first, last) pairs, empty if the other endpoint doesnt expect them.
+        """
+        if not self.negotiated_capabilities & Capability.selective_ack:
+            return ()
+        return self.client_manager.sack_blocks(client_id)
 
     async def wait_for_stale_connection(self):
         """
@@ -127,67 +738,298 @@ class TunnelEndpoint:
         """
         while True:
             client_id = await self.stale_tcp_connections.get()
+            self.create_task(self.end_client(client_id))
+
+    async def end_client(self, client_id: int):
+        """
+        notify the other endpoint that a client ended, and remove it.
+        the pending delayed ack of the client is sent before the end request, otherwise the other endpoint removes the
+        client and gives up on its last segments before their ack arrives. for short connections, these are often the
+        only rtt samples and the only acks that grow the congestion window.
+        :param client_id: the stale client.
+        """
+        if not self.client_manager.client_exists(client_id):  # already removed, or already being removed.
+            return
+
+        self.delayed_acks.flush(client_id)
 
-            new_tunnel_packet = Tunnel(client_id=client_id, action=Tunnel.Action.end, direction=self.direction)
+        new_tunnel_packet = TunnelPacket(client_id=client_id, action=Action.end, direction=self.direction)
 
-            await self.send_icmp_packet_and_wait_for_ack(new_tunnel_packet)
-            await self.client_manager.remove_client(client_id)  # remove client, doesnt matter if the packet was acked.
+        await self.send_icmp_packet_and_wait_for_ack(new_tunnel_packet)
+        if self.client_manager.client_exists(client_id):  # remove client, doesnt matter if the packet was acked.
+            await self.remove_client(client_id)
 
-    def send_ack(self, tunnel_packet: Tunnel):
+    def send_ack(self, tunnel_packet: TunnelPacket):
         """
-        send an ack for a given packet using echoReply
+        send an ack for a given packet using echoReply.
+        the ack also carries the highest sequence number written in order to the client, acking everything before it.
+        acks of start requests advertise the capabilities of this endpoint.
         :param tunnel_packet: the packet to ack
         """
-        new_tunnel_packet = Tunnel(
+        self.delayed_acks.take(tunnel_packet.client_id)  # the ack_number acks everything that was pending.
+        new_tunnel_packet = TunnelPacket(
             client_id=tunnel_packet.client_id,
             sequence_number=tunnel_packet.sequence_number,
-            action=Tunnel.Action.ack,
+            action=Action.ack,
             direction=self.direction,
+            ack_number=self.client_manager.acked_up_to(tunnel_packet.client_id),
+            window=self.advertised_window(tunnel_packet.client_id),
+            capabilities=self.capabilities if tunnel_packet.action == Action.start else 0,
+            sack_blocks=self.selective_ack_blocks(tunnel_packet.client_id),
         )
         self.send_icmp_packet(
             icmp_packet.ICMPType.EchoReply,
-            new_tunnel_packet.SerializeToString(),
+            self.codec.encode(new_tunnel_packet),
+            tunnel_packet.client_id,
+        )
+
+    def send_cumulative_ack(self, client_id: int):
+        """
+        send a delayed ack, acking all the data of a client that was written in order.
+        :param client_id: the client to ack.
+        """
+        ack_number = self.client_manager.acked_up_to(client_id)
+        if not ack_number:  # the client was removed in the meanwhile.
+            return
+
+        new_tunnel_packet = TunnelPacket(
+            client_id=client_id,
+            sequence_number=ack_number,
+            action=Action.ack,
+            direction=self.direction,
+            ack_number=ack_number,
+            window=self.advertised_window(client_id),
+            sack_blocks=self.selective_ack_blocks(client_id),
         )
+        self.send_icmp_packet(icmp_packet.ICMPType.EchoReply, self.codec.encode(new_tunnel_packet), client_id)
 
-    async def send_icmp_packet_and_wait_for_ack(self, tunnel_packet: Tunnel):
+    def send_window_probe(self, client_id: int):
+        """
+        probe a closed receive window. the probe is a data packet without data, that the other endpoint acks with its
+        current window. it doesnt have to be acked, the next probe is sent anyway if the window is still closed.
+        :param client_id: the client whose window is closed.
         """
-        coroutine that tries to send a icmp packet and assert that an ack was received. if an ack wasnt received, send again, up to 3 times.
-        :param tunnel_packet: the packet to send on the icmp socket.
+        new_tunnel_packet = TunnelPacket(client_id=client_id, action=Action.data, direction=self.direction)
+        self.send_icmp_packet(icmp_packet.ICMPType.EchoRequest, self.codec.encode(new_tunnel_packet), client_id)
+
+    async def send_icmp_packet_and_wait_for_ack(self, tunnel_packet: TunnelPacket):
+        """
+        send a packet reliably, see send_reliably, and wait until it is acked or given up on.
+        :param tunnel_packet: the packet to send.
         :return: boolean representing wether the packet was successfully acked.
         """
-        self.packets_requiring_ack[(tunnel_packet.client_id, tunnel_packet.sequence_number)] = asyncio.Event()
+        waiter = asyncio.get_running_loop().create_future()
+        await self.pacer.wait()
+        self.send_reliably(tunnel_packet, waiter=waiter)
+        return await waiter
+
+    def send_reliably(self, tunnel_packet: TunnelPacket, in_window: bool = False, waiter: asyncio.Future = None):
+        """
+        send a packet that requires an ack, on the path the scheduler picks. the packet is encoded once, and waits for
+        its ack in the retransmission queue. if it isnt acked within the retransmission timeout, it is sent again by
+        retransmission_timeout.
+        :param tunnel_packet: the packet to send.
+        :param in_window: whether the packet took a place in the congestion window, that is freed when it is done.
+        :param waiter: a future that is set to whether the packet was acked, when it is done.
+        """
+        packet = retransmission.OutstandingPacket(
+            tunnel_packet.client_id,
+            tunnel_packet.sequence_number,
+            tunnel_packet.action,
+            self.codec.encode(tunnel_packet),
+            in_window,
+            waiter,
+        )
+        packet.path = self.paths.choose()
+        packet.timeout = packet.path.rtt.rto + self.peer_ack_delay
+        packet.first_sent = asyncio.get_running_loop().time()
+        self.transmit_reliably(packet, packet.first_sent)
+        self.retransmissions.add(packet)
 
-        for _ in range(3):
-            self.send_icmp_packet(
-                icmp_packet.ICMPType.EchoRequest,
-                tunnel_packet.SerializeToString(),
+    def transmit_reliably(self, packet: retransmission.OutstandingPacket, now: float):
+        """
+        send a packet that waits for its ack, and set its retransmission deadline.
+        """
+        if self.tracer is not None:
+            self.tracer.record(
+                TraceEvent.retransmitted if packet.retransmitted else TraceEvent.sent,
+                packet.client_id,
+                packet.sequence_number,
+                packet.action,
+                len(packet.payload),
             )
-            try:
-                await asyncio.wait_for(
-                    self.packets_requiring_ack[(tunnel_packet.client_id, tunnel_packet.sequence_number)].wait(),
-                    self.ACK_WAITING_TIME
-                )
-                self.packets_requiring_ack.pop((tunnel_packet.client_id, tunnel_packet.sequence_number))  # if i reached here, means that ack was received. can remove event.
-                return True
-            except asyncio.TimeoutError:
-                log.debug(f'failed to send, resending:\n{tunnel_packet}')
-        log.info(f'message failed to send:\n{tunnel_packet}\nremoving client.')
-        await self.stale_tcp_connections.put(tunnel_packet.client_id)  # remove client, cannot send his messages.
+        self.send_icmp_packet(icmp_packet.ICMPType.EchoRequest, packet.payload, packet.client_id, packet.path.address)
+        packet.sent = now
+        packet.deadline = now + packet.timeout
+        loss_probe_timeout = self.loss_probe_timeout if packet.action == Action.data else None
+        if loss_probe_timeout is not None and loss_probe_timeout < packet.timeout:
+            packet.deadline = now + loss_probe_timeout  # see probe_tail_loss.
+
+    def retransmission_timeout(self, packet: retransmission.OutstandingPacket):
+        """
+        a packet wasnt acked in time. report the loss, and send it again with an exponentially backed off timeout,
+        until RETRANSMISSION_BUDGET seconds have passed since it was first sent. then the client is given up on, and
+        removed.
+        :param packet: the packet whose deadline passed.
+        """
+        if packet.deadline < packet.sent + packet.timeout:  # only its loss probe timeout passed.
+            self.probe_tail_loss(packet)
+            return
+        self.report_loss(packet)
+
+        now = asyncio.get_running_loop().time()
+        if now - packet.first_sent >= self.RETRANSMISSION_BUDGET:
+            self.retransmissions.pop(packet.client_id, packet.sequence_number)
+            self.finish_packet(packet, False)
+            log.info(f'packet failed to send: (client_id={packet.client_id})(seq_num={packet.sequence_number})'
+                     f'(action={packet.action.name}). removing client.')
+            self.client_manager.mark_stale(packet.client_id)  # remove client, cannot send his messages.
+            return
+        if packet.action == Action.data and not self.client_manager.client_exists(packet.client_id):
+            self.retransmissions.pop(packet.client_id, packet.sequence_number)  # it wont be acked.
+            self.finish_packet(packet, False)
+            return
+
+        packet.timeout = self.rtt_estimator.backoff(packet.timeout)
+        self.retransmit(packet, now)
+        self.retransmissions.schedule(packet)
+
+    def probe_tail_loss(self, packet: retransmission.OutstandingPacket):
+        """
+        a data segment wasnt acked within the loss probe timeout. the acks of a whole flight are often lost together,
+        since they are coalesced into a single icmp packet, and a full window sends nothing else that would be acked.
+        instead of waiting for the retransmission timeout, the window of the client is probed: the ack of the probe
+        carries the cumulative ack and the sack blocks, so it acks what arrived, and the segments that are still missing
+        are fast retransmitted (tail loss probe, RFC 8985). nothing is reported lost, and the segment keeps waiting for
+        its ack until its retransmission timeout. only the oldest segment in flight probes, so a flight sends one probe.
+        :param packet: the segment whose loss probe timeout passed.
+        """
+        packet.deadline = packet.sent + packet.timeout
+        self.retransmissions.schedule(packet)
+        window = self.client_manager.send_window(packet.client_id)
+        if window is not None and next(iter(window.in_flight), None) == packet.sequence_number:
+            self.metrics.loss_probes.value += 1
+            self.send_window_probe(packet.client_id)
+
+    def report_loss(self, packet: retransmission.OutstandingPacket):
+        """
+        report a lost packet to the path it was sent on, and to the congestion controller.
+        """
+        packet.path.on_loss()
+        self.congestion_controller.on_loss()
+        self.pacer.set_rate(self.congestion_controller.pacing_rate)
+
+    def retransmit(self, packet: retransmission.OutstandingPacket, now: float, fast: bool = False):
+        """
+        send a packet that waits for its ack again, on the path the scheduler picks, and push back its deadline.
+        retransmissions arent delayed by the pacer, but they take its tokens, so they delay new packets.
+        :param packet: the lost packet.
+        :param now: the current time.
+        :param fast: whether the packet was reported missing, rather than timed out.
+        """
+        packet.retransmitted = True
+        packet.fast_retransmitted = fast
+        packet.missing_reports = 0
+        if fast:
+            self.metrics.packets_fast_retransmitted.value += 1
+        path = self.paths.choose()
+        if path is not packet.path:
+            packet.single_path = False
+            packet.path = path
+        self.metrics.packets_retransmitted.value += 1
+        self.metrics.bytes_retransmitted.value += len(packet.payload)
+        self.pacer.take()
+        self.transmit_reliably(packet, now)
+
+    def finish_packet(self, packet: retransmission.OutstandingPacket, acked: bool):
+        """
+        free the place of a packet in the congestion window, and wake up whoever waits for it, once it is done.
+        :param packet: a packet that was acked or given up on.
+        :param acked: whether it was acked.
+        """
+        if packet.in_window:
+            self.congestion_controller.release()
+        if packet.waiter is not None and not packet.waiter.done():
+            packet.waiter.set_result(acked)
 
     def send_icmp_packet(
             self,
             type: icmp_packet.ICMPType,
-            payload: bytes
+            payload: bytes,
+            client_id: int = None,
+            address: str = None,
+    ):
+        """
+        send an encoded tunnel packet on the icmp socket.
+        if both endpoints support it, small packets are coalesced into a single icmp packet first.
+        if the other endpoint is sharded, the packet is steered to the worker that owns the client.
+        :param type: wether to send an echoRequest or an echoReply
+        :param payload: the encoded tunnel packet
+        :param client_id: the client the packet belongs to, None if the packet shouldnt be steered.
+        :param address: the address of the path to send the packet on, None to let the scheduler pick one.
+        """
+        if address is None:
+            address = self.paths.choose().address
+        sequence_number = self.MAGIC_SEQUENCE_NUMBER
+        if self.steer_outgoing_packets and client_id is not None:
+            sequence_number = self.steering_key(client_id)
+
+        if self.negotiated_capabilities & Capability.coalescing:
+            self.coalescer.add(type, payload, sequence_number, address)
+        else:
+            self.transmit_icmp_packet(type, payload, sequence_number, address)
+
+    def transmit_icmp_packet(
+            self,
+            type: icmp_packet.ICMPType,
+            payload: bytes,
+            sequence_number: int = MAGIC_SEQUENCE_NUMBER,
+            address: str = None,
     ):
         """
-        build and send an icmp packet on the icmp socket.
+        build and send an icmp packet on the icmp socket right away.
+        a packet that the socket fails to send (no buffer space, the network is unreachable) is dropped, like it would
+        have been on the way. reliable packets are sent again once their retransmission timeout passes.
         :param type: wether to send an echoRequest or an echoReply
         :param payload: the payload to push into the icmp
+        :param sequence_number: the sequence number of the icmp header.
+        :param address: the address to send the packet to, None for the primary address of the other endpoint.
         """
         new_icmp_packet = icmp_packet.ICMPPacket(
             type=type,
             identifier=self.MAGIC_IDENTIFIER,
-            sequence_number=self.MAGIC_SEQUENCE_NUMBER,
+            sequence_number=sequence_number,
             payload=payload
         )
-        self.icmp_socket.sendto(new_icmp_packet, self.other_endpoint)
+        try:
+            self.transport.sendto(new_icmp_packet, address or self.other_endpoint)
+        except OSError as e:
+            log.debug(f'cant send icmp packet ({e}), dropping it')
+            self.metrics.drop('send_failed', len(payload))
+
+    def send_path_mtu_probe(self, payload_size: int):
+        """
+        send a path MTU probe, padded so the icmp payload is exactly payload_size bytes.
+        probes are never coalesced, and are sent with the DF flag, on the path to the primary address.
+        :param payload_size: the size to probe.
+        """
+        new_tunnel_packet = TunnelPacket(
+            sequence_number=payload_size,
+            action=Action.probe,
+            direction=self.direction,
+        )
+        padding_size = payload_size - len(self.codec.encode(new_tunnel_packet))
+        while True:  # the protobuf length of the padding grows with it, so it might take another round.
+            new_tunnel_packet.payload = bytes(max(padding_size, 0))
+            payload = self.codec.encode(new_tunnel_packet)
+            if len(payload) <= payload_size:
+                break
+            padding_size -= len(payload) - payload_size
+
+        new_icmp_packet = icmp_packet.ICMPPacket(
+            type=icmp_packet.ICMPType.EchoRequest,
+            identifier=self.MAGIC_IDENTIFIER,
+            sequence_number=self.MAGIC_SEQUENCE_NUMBER,
+            payload=payload,
+        )
+        self.transport.send_probe(new_icmp_packet, self.other_endpoint)
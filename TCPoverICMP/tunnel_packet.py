@@ -0,0 +1,85 @@
+import enum
+
+
+class Action(enum.IntEnum):
+    start = 0
+    end = 1
+    data = 2
+    ack = 3
+    probe = 4
+    probe_reply = 5
+
+
+class Direction(enum.IntEnum):
+    to_proxy = 0
+    to_forwarder = 1
+
+
+class Capability(enum.IntFlag):
+    binary_codec = 1
+    coalescing = 2
+    path_mtu_discovery = 4
+    delayed_ack = 8
+    flow_control = 16
+    compression = 32
+    sharded = 64  # the endpoint runs several workers, and wants its packets steered to them.
+    selective_ack = 128
+    early_data = 256  # start requests may carry the first data segment of the client.
+
+
+class TunnelPacket:
+    """
+    a single tunnel packet, independent of the codec that puts it on the wire.
+    the fields mirror the Tunnel protobuf message.
+    """
+    __slots__ = (
+        'client_id',
+        'sequence_number',
+        'action',
+        'direction',
+        'ip',
+        'port',
+        'payload',
+        'ack_number',
+        'capabilities',
+        'window',
+        'compressed',
+        'sack_blocks',
+    )
+
+    def __init__(
+            self,
+            client_id: int = 0,
+            sequence_number: int = 0,
+            action: Action = Action.start,
+            direction: Direction = Direction.to_proxy,
+            ip: str = '',
+            port: int = 0,
+            payload: bytes = b'',
+            ack_number: int = 0,
+            capabilities: int = 0,
+            window: int = None,
+            compressed: bool = False,
+            sack_blocks: tuple = (),
+    ):
+        self.client_id = client_id
+        self.sequence_number = sequence_number
+        self.action = action
+        self.direction = direction
+        self.ip = ip
+        self.port = port
+        self.payload = payload
+        self.ack_number = ack_number
+        self.capabilities = capabilities
+        self.window = window  # None if no receive window is advertised, 0 is a closed window.
+        self.compressed = compressed
+        self.sack_blocks = sack_blocks  # (first, last) ranges of sequence numbers received above ack_number.
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{self.__class__.__name__}({fields})'
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
@@ -0,0 +1,120 @@
+import socket
+import asyncio
+import logging
+import contextlib
+from typing import Callable
+from TCPoverICMP import icmp_packet, metrics, transport
+
+
+log = logging.getLogger(__name__)
+
+
+class UDPTransport(transport.Transport, asyncio.DatagramProtocol):
+    """
+    the udp transport, for networks where udp is allowed: every tunnel packet is sent as a udp datagram, with the
+    icmp header in front of it. the kernel only hands the socket the datagrams sent to its port, so nothing is sniffed
+    or filtered, and the udp checksum already covers the datagram, so the icmp checksum is neither computed nor checked.
+    """
+    DEFAULT_PORT = 0xcafe
+    HEADER_STRUCT = icmp_packet.ICMPPacket.ICMP_STRUCT
+
+    def __init__(
+            self,
+            packet_received: Callable[[icmp_packet.ICMPPacket], None],
+            max_batch_size: int = transport.Transport.DEFAULT_MAX_BATCH_SIZE,
+            max_payload_size: int = transport.Transport.DEFAULT_BUFFERSIZE,
+            sequence_number_filter: Callable[[int], bool] = None,
+            endpoint_metrics: metrics.EndpointMetrics = None,
+            port: int = DEFAULT_PORT,
+            peer_port: int = None,
+            host: str = '',
+    ):
+        """
+        :param port: the local port to receive on.
+        :param peer_port: the port of the other endpoint, the local port by default.
+        :param host: the local address to receive on, all of them by default.
+        """
+        super(UDPTransport, self).__init__(
+            packet_received,
+            max_batch_size,
+            max_payload_size,
+            sequence_number_filter,
+            endpoint_metrics,
+        )
+        self.peer_port = peer_port or port
+        self._udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp_socket.setblocking(False)
+        with contextlib.suppress(OSError):
+            self._udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER_SIZE)
+        with contextlib.suppress(OSError):  # fragment big datagrams, like the icmp transport does.
+            self._udp_socket.setsockopt(socket.IPPROTO_IP, self.IP_MTU_DISCOVER, self.IP_PMTUDISC_WANT)
+        self._udp_socket.bind((host, port))
+        self._header_buffer = bytearray(self.HEADER_STRUCT.size)
+
+    async def wait_for_incoming_packet(self):
+        """
+        receive datagrams through an asyncio datagram endpoint, until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        datagram_transport, _ = await loop.create_datagram_endpoint(lambda: self, sock=self._udp_socket)
+        try:
+            await loop.create_future()  # never completes, datagram_received does the work.
+        finally:
+            datagram_transport.close()
+
+    def datagram_received(self, data: bytes, address: tuple):
+        if len(data) < self.HEADER_STRUCT.size:
+            self.metrics.drop('invalid_icmp', len(data))
+            return
+
+        raw_type, code, _, identifier, sequence_number = self.HEADER_STRUCT.unpack_from(data)
+        if code != icmp_packet.ICMPPacket.CODE or raw_type not in icmp_packet.ICMPPacket.TYPES:
+            self.metrics.drop('invalid_icmp', len(data))
+            return
+        if self.sequence_number_filter is not None and not self.sequence_number_filter(sequence_number):
+            return
+
+        self.deliver(
+            icmp_packet.ICMPPacket(
+                icmp_packet.ICMPPacket.TYPES[raw_type],
+                identifier,
+                sequence_number,
+                data[self.HEADER_STRUCT.size:],
+            ),
+            len(data),
+        )
+
+    def error_received(self, exc: Exception):
+        log.debug(f'udp error: {exc}')
+
+    def sendto(self, packet: icmp_packet.ICMPPacket, destination: str):
+        """
+        send a packet as a single datagram. the header and the payload are sent with scatter-gather io.
+        a datagram that doesnt fit in the socket buffer is dropped, like it would have been on the way.
+        :param packet: an instance of ICMPPacket.
+        :param destination: the IP of the destination.
+        """
+        self.HEADER_STRUCT.pack_into(
+            self._header_buffer,
+            0,
+            packet.type.value,
+            icmp_packet.ICMPPacket.CODE,
+            0,
+            packet.identifier,
+            packet.sequence_number,
+        )
+        try:
+            self._udp_socket.sendmsg((self._header_buffer, packet.payload), (), 0, (destination, self.peer_port))
+        except BlockingIOError:
+            log.debug('udp socket buffer is full, dropping packet')
+            return
+        self.metrics.packets_sent.value += 1
+        self.metrics.bytes_sent.value += len(self._header_buffer) + len(packet.payload)
+
+    def send_probe(self, packet: icmp_packet.ICMPPacket, destination: str):
+        """
+        send a path MTU probe, with the DF flag.
+        raises OSError if the probe is bigger than the MTU of the local interface.
+        """
+        with self.dont_fragment(self._udp_socket):
+            self.sendto(packet, destination)
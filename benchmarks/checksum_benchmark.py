@@ -0,0 +1,61 @@
+import os
+import socket
+import timeit
+import argparse
+from TCPoverICMP import checksum
+
+
+PAYLOAD_SIZES = (64, 128, 256, 512, 1024, 1400)
+
+
+def legacy_checksum(data: bytes):
+    """
+    the previous per-word implementation of ICMPPacket.compute_checksum, kept as the baseline.
+    """
+    count_to = (int(len(data) / 2)) * 2
+    total = 0
+    count = 0
+
+    while count < count_to:
+        total += int.from_bytes(data[count:count+2], byteorder='little')
+        count += 2
+
+    if count_to < len(data):
+        total += data[-1]
+
+    total &= 0xffffffff
+    total = (total >> 16) + (total & 0xffff)
+    total += (total >> 16)
+    result = ~total & 0xffff
+    return socket.htons(result)
+
+
+def bench(function, data: bytes, number: int):
+    """
+    :return: the average time of a single call, in microseconds.
+    """
+    return min(timeit.repeat(lambda: function(data), number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare the legacy per-word checksum with the whole-buffer checksum')
+    parser.add_argument('--number', type=int, default=2000, help='calls per measurement')
+    args = parser.parse_args()
+
+    print(f'{"payload":>8} {"legacy [us]":>12} {"fast [us]":>10} {"speedup":>8}')
+    for size in PAYLOAD_SIZES:
+        data = os.urandom(size)
+        assert legacy_checksum(data) == checksum.internet_checksum(data)
+
+        legacy_time = bench(legacy_checksum, data, args.number)
+        fast_time = bench(checksum.internet_checksum, data, args.number)
+        print(f'{size:>7}B {legacy_time:>12.2f} {fast_time:>10.2f} {legacy_time / fast_time:>7.1f}x')
+
+    data = os.urandom(1400)
+    full_time = bench(checksum.internet_checksum, data, args.number)
+    incremental_time = bench(lambda _: checksum.update_checksum(0x1234, 0x0800, 0x0000), data, args.number)
+    print(f'header change on a 1400B packet: full {full_time:.2f}us, incremental (RFC 1624) {incremental_time:.2f}us')
+
+
+if __name__ == '__main__':
+    main()
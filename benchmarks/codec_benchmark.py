@@ -0,0 +1,63 @@
+import os
+import timeit
+import argparse
+from TCPoverICMP import tunnel_codec
+from TCPoverICMP.tunnel_packet import TunnelPacket, Action, Direction, Capability
+
+
+SAMPLE_PACKETS = {
+    'data': TunnelPacket(
+        client_id=17,
+        sequence_number=100000,
+        action=Action.data,
+        direction=Direction.to_forwarder,
+        payload=os.urandom(1024),
+    ),
+    'ack': TunnelPacket(
+        client_id=17,
+        sequence_number=100000,
+        action=Action.ack,
+        direction=Direction.to_proxy,
+        ack_number=99990,
+    ),
+    'start': TunnelPacket(
+        client_id=17,
+        action=Action.start,
+        direction=Direction.to_proxy,
+        ip='10.0.0.1',
+        port=8080,
+        capabilities=Capability.binary_codec,
+    ),
+}
+CODECS = {
+    'protobuf': tunnel_codec.ProtobufCodec,
+    'binary': tunnel_codec.BinaryCodec,
+}
+
+
+def bench(function, number: int):
+    """
+    :return: the average time of a single call, in microseconds.
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare the protobuf and binary encodings of tunnel packets')
+    parser.add_argument('--number', type=int, default=20000, help='calls per measurement')
+    args = parser.parse_args()
+
+    print(f'{"packet":>6} {"codec":>9} {"header [B]":>11} {"encode [us]":>12} {"decode [us]":>12}')
+    for packet_name, tunnel_packet in SAMPLE_PACKETS.items():
+        for codec_name, codec in CODECS.items():
+            encoded = codec.encode(tunnel_packet)
+            assert tunnel_codec.decode(encoded) == tunnel_packet
+
+            header_size = len(encoded) - len(tunnel_packet.payload)
+            encode_time = bench(lambda: codec.encode(tunnel_packet), args.number)
+            decode_time = bench(lambda: tunnel_codec.decode(encoded), args.number)
+            print(f'{packet_name:>6} {codec_name:>9} {header_size:>11} {encode_time:>12.2f} {decode_time:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
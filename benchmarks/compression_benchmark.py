@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import argparse
+from TCPoverICMP import compression
+from benchmarks import tunnel_benchmark
+
+
+def transfer(payload: str, compress: bool, args: argparse.Namespace):
+    """
+    upload the payload through a forwarder and a proxy, over a bandwidth limited memory network.
+    :return: the results of the bulk workload, see tunnel_benchmark.run_workload.
+    """
+    argv = [
+        '--workloads', 'bulk',
+        '--payload', payload,
+        '--bulk-size', str(args.size),
+        '--bandwidth', str(args.bandwidth),
+        '--latency', str(args.latency),
+        '--compression-level', str(args.level),
+        '--timeout', str(args.timeout),
+    ]
+    if not compress:
+        argv.append('--no-compression')
+    results = asyncio.run(tunnel_benchmark.run(tunnel_benchmark.parse_args(argv)))
+    return results[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='goodput of bulk uploads through the tunnel, with and without compression, on json and random data',
+    )
+    parser.add_argument('--size', type=int, default=8 * 1024 * 1024, help='bytes to upload per sample')
+    parser.add_argument('--bandwidth', type=float, default=1.0, help='bandwidth of the channel, in MB/s')
+    parser.add_argument('--latency', type=float, default=0.01, help='one way latency of the channel, in seconds')
+    parser.add_argument('--level', type=int, default=compression.StreamCompressor.DEFAULT_LEVEL)
+    parser.add_argument('--timeout', type=float, default=300.0, help='seconds an upload may take')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f'{"sample":>7} {"compression":>12} {"wire [MB]":>10} {"cpu [ms/MB]":>12} {"goodput [MB/s]":>15}')
+    for payload in tunnel_benchmark.PAYLOADS:
+        for compress in (False, True):
+            result = transfer(payload, compress, args)
+            print(f'{payload:>7} {"on" if compress else "off":>12} {result["wire_bytes"] / 1e6:>10.2f} '
+                  f'{result["cpu_ms_per_mb"]:>12.1f} {result["goodput_mb_per_second"]:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import time
+import asyncio
+import argparse
+import tracemalloc
+from TCPoverICMP import client_manager
+
+
+class MemoryStreamTransport(asyncio.Transport):
+    """
+    the transport of an idle tcp connection, without a socket, so tens of thousands of them fit in the fd limit.
+    writes are discarded.
+    """
+    def __init__(self, protocol: asyncio.Protocol, peer: tuple):
+        super(MemoryStreamTransport, self).__init__()
+        self.protocol = protocol
+        self.peer = peer
+        self.closing = False
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self.peer
+        return default
+
+    def write(self, data):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        if not self.closing:
+            self.closing = True
+            asyncio.get_running_loop().call_soon(self.protocol.connection_lost, None)
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+def open_stream(peer: tuple):
+    """
+    :return: tuple of reader and writer of an idle connection.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    protocol = asyncio.StreamReaderProtocol(reader)
+    transport = MemoryStreamTransport(protocol, peer)
+    protocol.connection_made(transport)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+async def send_segment(data: memoryview, client_id: int, sequence_number: int, compressed: bool):
+    pass
+
+
+async def measure(sessions: int, peers: int):
+    """
+    add idle clients to a client manager, and measure the memory and the time it takes.
+    :return: dict of the results.
+    """
+    manager = client_manager.ClientManager(
+        asyncio.Queue(), send_segment, max_clients_per_peer=sessions, idle_timeout=3600,
+    )
+
+    tracemalloc.start()
+    streams = [open_stream((f'10.0.{client_id % peers // 256}.{client_id % peers % 256}', 40000 + client_id % 20000))
+               for client_id in range(sessions)]
+    streams_memory, _ = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    for client_id, (reader, writer) in enumerate(streams):
+        peer, _ = writer.get_extra_info('peername')
+        manager.admit(peer)
+        manager.add_client(client_id, reader, writer, peer=peer)
+    add_time = time.perf_counter() - start
+    del streams
+    await asyncio.sleep(0)  # let the readers start waiting for data.
+    await asyncio.sleep(0)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for client_id in range(sessions):
+        manager.client_exists(client_id)
+        manager.receive_window(client_id)
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    manager.reap(asyncio.get_running_loop().time())  # none of them are idle for long enough, the whole sweep is done.
+    sweep_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for client_id in range(sessions):
+        await manager.remove_client(client_id)
+    remove_time = time.perf_counter() - start
+
+    return {
+        'sessions': sessions,
+        'bytes_per_session': memory / sessions,
+        'manager_bytes_per_session': (memory - streams_memory) / sessions,
+        'add_us': add_time / sessions * 1e6,
+        'lookup_us': lookup_time / sessions * 1e6,
+        'sweep_ms': sweep_time * 1e3,
+        'remove_us': remove_time / sessions * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='memory and cpu cost of idle clients in the session table. the tcp connections are in memory, so '
+                    'the memory of the sockets in the kernel isnt included.',
+    )
+    parser.add_argument(
+        '--sessions',
+        type=lambda value: [int(count) for count in value.split(',')],
+        default=[10000, 50000],
+        help='comma separated numbers of clients to measure',
+    )
+    parser.add_argument('--peers', type=int, default=100, help='number of addresses the clients connect from')
+    args = parser.parse_args()
+
+    print(f'{"sessions":>9} {"bytes/session":>14} {"manager bytes/session":>22} {"add [us]":>9} {"lookup [us]":>12} '
+          f'{"sweep [ms]":>11} {"remove [us]":>12}')
+    for sessions in args.sessions:
+        result = asyncio.run(measure(sessions, args.peers))
+        print(f'{result["sessions"]:>9} {result["bytes_per_session"]:>14.0f} '
+              f'{result["manager_bytes_per_session"]:>22.0f} {result["add_us"]:>9.1f} {result["lookup_us"]:>12.2f} '
+              f'{result["sweep_ms"]:>11.1f} {result["remove_us"]:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
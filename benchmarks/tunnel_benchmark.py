@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import platform
+import functools
+from TCPoverICMP import forwarder, proxy, endpoint_arguments, memory_transport, udp_transport
+
+
+FORWARDER_ADDRESS = '10.0.0.1'
+PROXY_ADDRESS = '10.0.0.2'
+LOCALHOST = '127.0.0.1'
+REQUEST_HEADER = struct.Struct('>II')  # request size, response size.
+READ_SIZE = 65536
+
+
+def free_port(kind: int = socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind((LOCALHOST, 0))
+        return sock.getsockname()[1]
+
+
+def transports(args: argparse.Namespace):
+    """
+    :return: tuple of the addresses of the forwarder and the proxy, and a transport factory for each of them.
+    """
+    if args.transport == 'udp':  # real udp sockets on the loopback interface, the impairments dont apply.
+        forwarder_port, proxy_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_DGRAM)
+        return (
+            LOCALHOST,
+            LOCALHOST,
+            functools.partial(udp_transport.UDPTransport, port=forwarder_port, peer_port=proxy_port, host=LOCALHOST),
+            functools.partial(udp_transport.UDPTransport, port=proxy_port, peer_port=forwarder_port, host=LOCALHOST),
+        )
+
+    network = memory_transport.MemoryNetwork(
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        duplicate=args.duplicate,
+        reorder=args.reorder,
+        bandwidth=args.bandwidth * 1e6,
+        mtu=args.mtu,
+        seed=args.seed,
+    )
+    return FORWARDER_ADDRESS, PROXY_ADDRESS, network.transport(FORWARDER_ADDRESS), network.transport(PROXY_ADDRESS)
+
+
+def json_lines(size: int):
+    """
+    :return: size bytes of json logs, like an http api would write.
+    """
+    lines = []
+    length = 0
+    while length < size:
+        line = json.dumps({
+            'id': len(lines),
+            'user': f'user{random.randrange(1000)}',
+            'path': f'/api/v1/items/{random.randrange(100000)}',
+            'status': random.choice((200, 200, 200, 404, 500)),
+            'latency_ms': round(random.random() * 100, 3),
+        })
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines).encode()[:size]
+
+
+PAYLOADS = {
+    'random': os.urandom,
+    'json': json_lines,
+}
+
+
+@functools.lru_cache(maxsize=1)
+def bulk_payload(kind: str, size: int):
+    """
+    :return: the data the bulk workload uploads. it is generated before the workload is measured.
+    """
+    return PAYLOADS[kind](size)
+
+
+def percentile(values: list, fraction: float):
+    """
+    :return: the nearest rank percentile of the values, None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def read_exactly(reader: asyncio.StreamReader, size: int):
+    """
+    read and discard size bytes, without buffering all of them.
+    """
+    while size:
+        data = await reader.read(min(size, READ_SIZE))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', size)
+        size -= len(data)
+
+
+async def serve_requests(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    the destination of the tunnel. every request has a header with its size and the size of the response to it.
+    """
+    try:
+        while True:
+            request_size, response_size = REQUEST_HEADER.unpack(await reader.readexactly(REQUEST_HEADER.size))
+            await read_exactly(reader, request_size)
+            writer.write(os.urandom(response_size))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def request(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        request_size: int,
+        response_size: int,
+        data: bytes = None,
+):
+    """
+    send a request through the tunnel, and wait for the whole response.
+    :param data: the body of the request, random bytes if it isnt given.
+    :return: the latency of the request, in seconds.
+    """
+    start = time.perf_counter()
+    writer.write(REQUEST_HEADER.pack(request_size, response_size) + (data or os.urandom(request_size)))
+    await writer.drain()
+    await read_exactly(reader, response_size)
+    return time.perf_counter() - start
+
+
+async def bulk(port: int, args: argparse.Namespace):
+    """
+    a single connection that uploads bulk_size bytes of the payload.
+    :return: tuple of the bytes that went through the tunnel, and the latencies of the operations.
+    """
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    latency = await request(reader, writer, args.bulk_size, 1, bulk_payload(args.payload, args.bulk_size))
+    writer.close()
+    return args.bulk_size + 1, [latency]
+
+
+async def rpc(port: int, args: argparse.Namespace):
+    """
+    a single connection that makes rpc_count small requests, one after the other.
+    """
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    latencies = [await request(reader, writer, args.rpc_size, args.rpc_size) for _ in range(args.rpc_count)]
+    writer.close()
+    return 2 * args.rpc_size * args.rpc_count, latencies
+
+
+async def concurrent(port: int, args: argparse.Namespace):
+    """
+    many connections at once, each connecting and making a few small requests. the latency is of whole connections.
+    """
+    async def connection():
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(LOCALHOST, port)
+        for _ in range(args.requests_per_connection):
+            await request(reader, writer, args.rpc_size, args.rpc_size)
+        writer.close()
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*[connection() for _ in range(args.connections)])
+    return 2 * args.rpc_size * args.requests_per_connection * args.connections, list(latencies)
+
+
+async def connect(port: int, args: argparse.Namespace):
+    """
+    connections one after the other, each making a single small request. the latency is the time to the first byte of
+    the response, from connecting.
+    """
+    latencies = []
+    for _ in range(args.connect_count):
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(LOCALHOST, port)
+        writer.write(REQUEST_HEADER.pack(args.rpc_size, args.rpc_size) + os.urandom(args.rpc_size))
+        await read_exactly(reader, 1)
+        latencies.append(time.perf_counter() - start)
+        await read_exactly(reader, args.rpc_size - 1)
+        writer.close()
+    return 2 * args.rpc_size * args.connect_count, latencies
+
+
+WORKLOADS = {
+    'bulk': bulk,
+    'rpc': rpc,
+    'concurrent': concurrent,
+    'connect': connect,
+}
+
+
+def reliable_transmissions(endpoints: list):
+    """
+    :return: tuple of the transmissions of packets that require an ack, and how many of them were retransmissions.
+    """
+    retransmitted = sum(endpoint.metrics.packets_retransmitted.value for endpoint in endpoints)
+    acked = sum(endpoint.metrics.ack_latency.count for endpoint in endpoints)
+    return acked + retransmitted, retransmitted
+
+
+def packets_handled(endpoints: list):
+    """
+    :return: the packets sent and received by the endpoints, on the transport.
+    """
+    return sum(endpoint.metrics.packets_sent.value + endpoint.metrics.packets_received.value for endpoint in endpoints)
+
+
+def bytes_sent(endpoints: list):
+    """
+    :return: the bytes the endpoints sent on the transport.
+    """
+    return sum(endpoint.metrics.bytes_sent.value for endpoint in endpoints)
+
+
+async def run_workload(name: str, port: int, endpoints: list, args: argparse.Namespace):
+    transmissions_before, retransmissions_before = reliable_transmissions(endpoints)
+    packets_before = packets_handled(endpoints)
+    bytes_before = bytes_sent(endpoints)
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    size, latencies = await asyncio.wait_for(WORKLOADS[name](port, args), args.timeout)
+    duration = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+    transmissions_after, retransmissions_after = reliable_transmissions(endpoints)
+    packets = packets_handled(endpoints) - packets_before
+    wire_bytes = bytes_sent(endpoints) - bytes_before
+
+    transmissions = transmissions_after - transmissions_before
+    return {
+        'workload': name,
+        'bytes': size,
+        'wire_bytes': wire_bytes,
+        'seconds': duration,
+        'goodput_mb_per_second': size / duration / 1e6,
+        'operations': len(latencies),
+        'latency_p50_ms': percentile(latencies, 0.5) * 1e3,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1e3,
+        'retransmit_ratio': (retransmissions_after - retransmissions_before) / transmissions if transmissions else 0.0,
+        'cpu_ms_per_mb': cpu_time * 1e3 / (size / 1e6),
+        'packets_per_cpu_second': packets / cpu_time,
+    }
+
+
+async def run(args: argparse.Namespace):
+    forwarder_address, proxy_address, forwarder_transport, proxy_transport = transports(args)
+    endpoint_kwargs = endpoint_arguments.endpoint_kwargs(args)
+    endpoint_kwargs.pop('transport', None)
+    trace_path = endpoint_kwargs.pop('trace_path')
+    server = await asyncio.start_server(serve_requests, LOCALHOST, 0, backlog=args.connections)
+    server_port = server.sockets[0].getsockname()[1]
+    port = free_port()
+
+    endpoints = [
+        proxy.Proxy(
+            forwarder_address,
+            transport=proxy_transport,
+            trace_path=f'{trace_path}.proxy',
+            **endpoint_arguments.proxy_kwargs(args),
+            **endpoint_kwargs,
+        ),
+        forwarder.Forwarder(
+            proxy_address,
+            port,
+            LOCALHOST,
+            server_port,
+            transport=forwarder_transport,
+            trace_path=f'{trace_path}.forwarder',
+            **endpoint_kwargs,
+        ),
+    ]
+    tasks = [asyncio.create_task(endpoint.run()) for endpoint in endpoints]
+    await asyncio.sleep(0.1)  # let the forwarder start listening.
+    if 'bulk' in args.workloads:
+        bulk_payload(args.payload, args.bulk_size)
+
+    try:
+        return [await run_workload(name, port, endpoints, args) for name in args.workloads]
+    finally:
+        for task in tasks:
+            task.cancel()
+        server.close()
+        for endpoint in endpoints:
+            if endpoint.tracer is not None:
+                endpoint.dump_trace()
+
+
+def print_results(results: list, baseline: list = None):
+    baseline = {result['workload']: result for result in baseline or ()}
+    print(f'{"workload":>10} {"goodput [MB/s]":>15} {"p50 [ms]":>9} {"p99 [ms]":>9} {"retransmits":>12} '
+          f'{"cpu [ms/MB]":>12} {"packets/cpu s":>14}')
+    for result in results:
+        print(f'{result["workload"]:>10} {result["goodput_mb_per_second"]:>15.2f} {result["latency_p50_ms"]:>9.1f} '
+              f'{result["latency_p99_ms"]:>9.1f} {result["retransmit_ratio"]:>12.2%} {result["cpu_ms_per_mb"]:>12.1f} '
+              f'{result.get("packets_per_cpu_second", 0.0):>14.0f}')
+        if result['workload'] in baseline:
+            previous = baseline[result['workload']]
+            print(f'{"baseline":>10} {previous["goodput_mb_per_second"]:>15.2f} {previous["latency_p50_ms"]:>9.1f} '
+                  f'{previous["latency_p99_ms"]:>9.1f} {previous["retransmit_ratio"]:>12.2%} '
+                  f'{previous["cpu_ms_per_mb"]:>12.1f} {previous.get("packets_per_cpu_second", 0.0):>14.0f}')
+
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description='run a forwarder and a proxy in one process, over the memory transport with simulated impairments, '
+                    'or over udp, and measure workloads through them. no root is needed. the endpoint arguments tune '
+                    'both endpoints.',
+    )
+    parser.add_argument(
+        '--workloads',
+        type=lambda value: value.split(','),
+        default=list(WORKLOADS),
+        help=f'comma separated workloads to run, out of {",".join(WORKLOADS)}',
+    )
+    parser.add_argument('--bulk-size', type=int, default=8 * 1024 * 1024, help='bytes uploaded by the bulk workload')
+    parser.add_argument('--payload', choices=PAYLOADS, default='random', help='data uploaded by the bulk workload')
+    parser.add_argument('--rpc-size', type=int, default=128, help='bytes of every request and response')
+    parser.add_argument('--rpc-count', type=int, default=500, help='requests made by the rpc workload')
+    parser.add_argument('--connections', type=int, default=100, help='connections of the concurrent workload')
+    parser.add_argument('--requests-per-connection', type=int, default=5)
+    parser.add_argument('--connect-count', type=int, default=100, help='connections made by the connect workload')
+    parser.add_argument('--timeout', type=float, default=300.0, help='seconds a workload may take')
+
+    channel = parser.add_argument_group('simulated channel, of the memory transport')
+    channel.add_argument('--latency', type=float, default=0.01, help='one way latency, in seconds')
+    channel.add_argument('--jitter', type=float, default=0.0, help='maximal extra one way latency, in seconds')
+    channel.add_argument('--loss', type=float, default=0.0, help='probability of losing a packet')
+    channel.add_argument('--duplicate', type=float, default=0.0, help='probability of duplicating a packet')
+    channel.add_argument('--reorder', type=float, default=0.0, help='probability of delaying a packet past others')
+    channel.add_argument('--bandwidth', type=float, default=0.0, help='MB/s in each direction, 0 for unlimited')
+    channel.add_argument('--mtu', type=int, default=memory_transport.MemoryNetwork.DEFAULT_MTU)
+    channel.add_argument('--seed', type=int, help='seed of the impairments, for reproducible runs')
+
+    parser.add_argument('--output', help='save the results to this json file')
+    parser.add_argument('--baseline', help='compare to the results saved by a previous run')
+    endpoint_arguments.add_endpoint_arguments(parser.add_argument_group('endpoints'), transports=('memory', 'udp'))
+    endpoint_arguments.add_proxy_arguments(parser.add_argument_group('proxy'))
+    return parser.parse_args(argv)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    unknown_workloads = set(args.workloads) - set(WORKLOADS)
+    if unknown_workloads:
+        sys.exit(f'unknown workloads: {", ".join(sorted(unknown_workloads))}')
+
+    results = asyncio.run(run(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(
+                {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'arguments': vars(args),
+                    'results': results,
+                },
+                output_file,
+                indent=4,
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import os
+from TCPoverICMP import tunnel_codec
+from TCPoverICMP.tunnel_packet import Capability
+from tests import tunnel_harness
+
+
+# an endpoint that predates every capability, like the original protobuf-only stop and wait endpoints.
+NO_CAPABILITIES = {
+    'binary_codec': False,
+    'path_mtu_discovery': False,
+    'delayed_acks': False,
+    'flow_control': False,
+    'payload_compression': False,
+    'selective_ack': False,
+    'early_data': False,
+}
+
+
+async def test_both_endpoints_use_all_their_capabilities():
+    async with tunnel_harness.tunnel() as tunnel:
+        data = os.urandom(64 * 1024)
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        for endpoint in (tunnel.forwarder, tunnel.proxy):
+            assert endpoint.negotiated_capabilities == endpoint.capabilities & ~Capability.sharded
+            assert endpoint.codec is tunnel_codec.BinaryCodec
+
+
+async def test_capabilities_of_an_older_proxy():
+    """
+    a forwarder in front of a proxy without any capability falls back to the original protocol, and still works.
+    """
+    sent_to_proxy = []
+
+    def observe(destination: str, tunnel_packets: list):
+        if destination == tunnel_harness.PROXY_ADDRESS:
+            sent_to_proxy.extend(tunnel_packets)
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe)
+    async with tunnel_harness.tunnel(network, proxy_kwargs=NO_CAPABILITIES) as tunnel:
+        data = os.urandom(64 * 1024)
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        assert tunnel.forwarder.negotiated_capabilities == 0
+        assert tunnel.forwarder.codec is tunnel_codec.ProtobufCodec
+        # nothing that needs a capability was sent to the proxy once the capabilities were negotiated.
+        assert all(tunnel_packet.window is None and not tunnel_packet.sack_blocks and not tunnel_packet.compressed
+                   for tunnel_packet in sent_to_proxy)
+
+
+async def test_capabilities_of_an_older_forwarder():
+    async with tunnel_harness.tunnel(forwarder_kwargs=NO_CAPABILITIES) as tunnel:
+        data = os.urandom(64 * 1024)
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        assert tunnel.proxy.negotiated_capabilities == 0
+        assert tunnel.proxy.codec is tunnel_codec.ProtobufCodec
+
+
+async def test_capabilities_are_the_common_ones():
+    async with tunnel_harness.tunnel(proxy_kwargs={'binary_codec': False, 'early_data': False}) as tunnel:
+        data = os.urandom(64 * 1024)
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        negotiated = tunnel.forwarder.negotiated_capabilities
+        assert not negotiated & (Capability.binary_codec | Capability.coalescing | Capability.early_data)
+        assert negotiated & Capability.selective_ack
+        assert negotiated & Capability.flow_control
+        assert tunnel.proxy.negotiated_capabilities == negotiated
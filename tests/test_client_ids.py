@@ -0,0 +1,39 @@
+import itertools
+from TCPoverICMP import forwarder, memory_transport
+from tests import tunnel_harness
+
+
+SHARDS = 4
+CLIENTS = 100
+
+
+def client_ids_of_a_run(network: memory_transport.MemoryNetwork, shard: int):
+    """
+    :return: the ids of the first CLIENTS clients of a new run of the worker of a shard.
+    """
+    endpoint = forwarder.Forwarder(
+        tunnel_harness.PROXY_ADDRESS,
+        tunnel_harness.free_port(),
+        tunnel_harness.LOCALHOST,
+        tunnel_harness.free_port(),
+        transport=network.transport(tunnel_harness.FORWARDER_ADDRESS),
+        shard=shard,
+        shards=SHARDS,
+    )
+    for coroutine in endpoint.coroutines_to_run:  # the worker isnt run.
+        coroutine.close()
+    return set(itertools.islice(endpoint.new_client_ids(), CLIENTS))
+
+
+async def test_a_restarted_worker_doesnt_reuse_client_ids():
+    """
+    the worker of a shard that is restarted takes ids of its own shard, but not the ids of its previous run, that the
+    proxy might still hold.
+    """
+    network = memory_transport.MemoryNetwork()
+    runs = [client_ids_of_a_run(network, 1) for _ in range(2)]
+    for client_ids in runs:
+        assert len(client_ids) == CLIENTS
+        assert all(forwarder.Forwarder.steering_key(client_id) % SHARDS == 1 for client_id in client_ids)
+        assert all(0 <= client_id <= forwarder.Forwarder.MAX_CLIENT_ID for client_id in client_ids)
+    assert not runs[0] & runs[1]
@@ -0,0 +1,130 @@
+import asyncio
+from TCPoverICMP.tunnel_packet import Action
+from tests import tunnel_harness
+
+
+REFUSED_CLIENTS = 3
+IDLE_TIMEOUT = 0.3
+CLOSE_TIMEOUT = 1.0
+
+
+async def is_closed(reader: asyncio.StreamReader, timeout: float = CLOSE_TIMEOUT):
+    """
+    :return: boolean representing whether the connection was closed by the tunnel before the timeout.
+    """
+    try:
+        return await asyncio.wait_for(reader.read(), timeout) == b''
+    except ConnectionError:
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def test_refused_clients_are_closed_right_away():
+    """
+    clients beyond the limit of the proxy are refused with an end request, so the forwarder closes them right away,
+    instead of retransmitting their start requests until it gives up. every client is counted once.
+    """
+    async with tunnel_harness.tunnel(proxy_kwargs={'max_clients': 1}) as tunnel:
+        reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        writer.write(b'admitted')
+        assert await reader.readexactly(len(b'admitted')) == b'admitted'
+
+        refused = [await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port) for _ in range(REFUSED_CLIENTS)]
+        for refused_reader, refused_writer in refused:
+            refused_writer.write(b'refused')
+        assert all(await asyncio.gather(*(is_closed(refused_reader) for refused_reader, _ in refused)))
+        for _, refused_writer in refused:
+            refused_writer.close()
+
+        assert await tunnel_harness.wait_for(lambda: not tunnel.forwarder.retransmissions, timeout=CLOSE_TIMEOUT)
+        assert tunnel.proxy.metrics.clients_rejected.value == REFUSED_CLIENTS
+        assert len(tunnel.connections) == 1
+        assert not tunnel.forwarder.starting_clients
+        assert tunnel.forwarder.client_manager.admitted == 0
+        assert tunnel.forwarder.client_manager.peers == {tunnel_harness.LOCALHOST: 1}
+
+        # the admitted client isnt affected.
+        writer.write(b'still here')
+        assert await reader.readexactly(len(b'still here')) == b'still here'
+        writer.close()
+
+
+async def test_clients_whose_destination_refuses_are_closed_right_away():
+    """
+    a client whose destination refuses the connection is refused with an end request, instead of the forwarder
+    retransmitting its start request until it gives up, and reporting every timeout as a loss.
+    """
+    async def refuse(host: str, port: int):
+        raise ConnectionRefusedError()
+
+    async with tunnel_harness.tunnel() as tunnel:
+        tunnel.proxy.connection_pool.connect = refuse
+        reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        writer.write(b'refused')
+        assert await is_closed(reader)
+        writer.close()
+
+        assert await tunnel_harness.wait_for(lambda: not tunnel.forwarder.retransmissions, timeout=CLOSE_TIMEOUT)
+        assert tunnel.forwarder.metrics.packets_retransmitted.value == 0
+        assert not tunnel.forwarder.starting_clients
+        assert not tunnel.forwarder.client_manager.peers
+        assert not tunnel.proxy.client_manager.peers
+        assert len(tunnel.proxy.rejected_clients) == 1
+
+
+async def test_clients_beyond_the_peer_limit_arent_started():
+    starts = []
+
+    def observe(destination: str, tunnel_packets: list):
+        starts.extend(tunnel_packet.client_id for tunnel_packet in tunnel_packets
+                      if tunnel_packet.action == Action.start)
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe)
+    async with tunnel_harness.tunnel(network, forwarder_kwargs={'max_clients_per_peer': 1}) as tunnel:
+        reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        writer.write(b'admitted')
+        assert await reader.readexactly(len(b'admitted')) == b'admitted'
+
+        refused_reader, refused_writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        assert await is_closed(refused_reader)
+        refused_writer.close()
+        assert tunnel.forwarder.metrics.clients_rejected.value == 1
+        assert len(starts) == 1
+        writer.close()
+
+
+async def test_idle_clients_are_reaped():
+    """
+    a client without data in either direction for idle_timeout is ended on both endpoints, and its places are given
+    back. a client that keeps sending isnt.
+    """
+    async with tunnel_harness.tunnel(idle_timeout=IDLE_TIMEOUT) as tunnel:
+        idle_reader, idle_writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        idle_writer.write(b'hello')
+        assert await idle_reader.readexactly(len(b'hello')) == b'hello'
+        active_reader, active_writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+
+        async def keep_sending():
+            for _ in range(int(4 * IDLE_TIMEOUT / 0.05)):
+                active_writer.write(b'ping')
+                assert await active_reader.readexactly(len(b'ping')) == b'ping'
+                await asyncio.sleep(0.05)
+
+        sender = asyncio.create_task(keep_sending())
+        assert await is_closed(idle_reader, timeout=4 * IDLE_TIMEOUT)
+        idle_writer.close()
+        await sender
+        assert len(tunnel.forwarder.client_manager.clients) == 1
+        assert len(tunnel.proxy.client_manager.clients) == 1
+        assert tunnel.connections[0].is_closing()
+
+        active_writer.close()
+        assert await tunnel_harness.wait_for(
+            lambda: not tunnel.forwarder.client_manager.clients and not tunnel.proxy.client_manager.clients,
+            timeout=4 * IDLE_TIMEOUT,
+        )
+        for endpoint in (tunnel.forwarder, tunnel.proxy):
+            assert not endpoint.client_manager.peers
+            assert endpoint.client_manager.admitted == 0
@@ -0,0 +1,88 @@
+import os
+import asyncio
+from TCPoverICMP import compression, client_session
+from tests import tunnel_harness
+
+
+RECEIVE_WINDOW = 64 * 1024
+INFLATED_SIZE = 16 * 1024 * 1024
+STALL = 0.3
+
+
+def test_round_trip_of_split_segments():
+    compressor = compression.StreamCompressor()
+    decompressor = compression.StreamDecompressor()
+    blocks = [os.urandom(100) * 50 for _ in range(10)]
+    decompressed = bytearray()
+    for block in blocks:
+        data, compressed = compressor.compress(block)
+        assert compressed
+        for start in range(0, len(data), 100):  # segments split the compressed blocks arbitrarily.
+            decompressed.extend(decompressor.decompress(data[start:start + 100], len(block)))
+    assert decompressed == b''.join(blocks)
+    assert not decompressor.pending
+
+
+def test_output_is_bounded():
+    """
+    a small segment that inflates to much more than the output bound is decompressed a bound at a time.
+    """
+    segment, _ = compression.StreamCompressor().compress(bytes(INFLATED_SIZE))
+    decompressor = compression.StreamDecompressor()
+    decompressed = bytearray(decompressor.decompress(segment, RECEIVE_WINDOW))
+    assert len(decompressed) == RECEIVE_WINDOW
+    assert decompressor.pending
+    while decompressor.pending:
+        output = decompressor.decompress(b'', RECEIVE_WINDOW)
+        assert len(output) <= RECEIVE_WINDOW
+        decompressed.extend(output)
+    assert decompressed == bytes(INFLATED_SIZE)
+
+
+async def test_a_segment_is_decompressed_as_the_client_drains():
+    """
+    a segment that inflates far beyond the receive window is written to the client as it drains, instead of all at
+    once, and the segments after it wait for it.
+    """
+    segment, compressed = compression.StreamCompressor(level=9).compress(bytes(INFLATED_SIZE))
+    assert compressed and len(segment) < RECEIVE_WINDOW
+    received = bytearray()
+    reading = asyncio.Event()
+
+    async def stalled_sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await reading.wait()
+        while True:
+            data = await reader.read(tunnel_harness.READ_SIZE)
+            if not data:
+                break
+            received.extend(data)
+
+    server = await asyncio.start_server(stalled_sink, tunnel_harness.LOCALHOST, 0)
+    reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, server.sockets[0].getsockname()[1])
+    session = client_session.ClientSession(1, reader, writer, RECEIVE_WINDOW)
+    assert session.write(1, segment, compressed=True)
+    assert session.write(2, b'after')
+
+    max_buffered = 0
+    for _ in range(int(STALL / 0.01)):
+        max_buffered = max(max_buffered, writer.transport.get_write_buffer_size())
+        await asyncio.sleep(0.01)
+    assert session.decompressing
+    assert session.last_written == 1  # the segment after it waits.
+    assert max_buffered <= RECEIVE_WINDOW + 2 * session.MIN_DECOMPRESS_SIZE
+
+    reading.set()
+    assert await tunnel_harness.wait_for(lambda: len(received) == INFLATED_SIZE + len(b'after'))
+    assert received == bytes(INFLATED_SIZE) + b'after'
+    assert session.last_written == 2
+    assert not session.decompressing
+    await session.stop()
+    server.close()
+
+
+async def test_compressible_transfer():
+    data = b''.join(f'GET /items/{i} HTTP/1.1\r\nHost: example.com\r\n\r\n'.encode() for i in range(100000))
+    async with tunnel_harness.tunnel() as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        assert tunnel.forwarder.metrics.bytes_sent.value < len(data) / 2
@@ -0,0 +1,101 @@
+import copy
+import time
+import asyncio
+from TCPoverICMP import memory_transport
+from TCPoverICMP.tunnel_packet import Action
+from tests import tunnel_harness
+
+
+LATENCY = 0.05
+ROUND_TRIP = 2 * LATENCY
+REQUEST = b'GET / HTTP/1.1\r\n\r\n'
+RESPONSE = b'HTTP/1.1 200 OK\r\n\r\n'
+
+
+async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    a destination that answers a single request, and closes the connection.
+    """
+    await reader.read(tunnel_harness.READ_SIZE)
+    writer.write(RESPONSE)
+    await writer.drain()
+    writer.close()
+
+
+async def request(port: int):
+    """
+    open a connection through the tunnel, send a request right away, and read the whole response.
+    :return: tuple of the response, and the seconds from connecting until it was read.
+    """
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, port)
+    writer.write(REQUEST)
+    response = await asyncio.wait_for(reader.read(), tunnel_harness.TIMEOUT)
+    writer.close()
+    return response, time.perf_counter() - start
+
+
+async def test_first_data_is_sent_with_the_start():
+    starts = []
+
+    def observe(destination: str, tunnel_packets: list):
+        starts.extend(bytes(tunnel_packet.payload) for tunnel_packet in tunnel_packets
+                      if tunnel_packet.action == Action.start)
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe, latency=LATENCY)
+    async with tunnel_harness.tunnel(network, destination=respond) as tunnel:
+        # the capabilities are negotiated on the first start, so it cant carry data.
+        response, _ = await request(tunnel.port)
+        assert response == RESPONSE
+        assert starts == [b'']
+
+        response, seconds = await request(tunnel.port)
+        assert response == RESPONSE
+        assert starts == [b'', REQUEST]
+        # the start and the request share the first round trip, the response is the second half of it.
+        assert seconds < 1.5 * ROUND_TRIP
+
+
+async def test_without_early_data():
+    network = memory_transport.MemoryNetwork(latency=LATENCY)
+    async with tunnel_harness.tunnel(network, destination=respond, early_data=False) as tunnel:
+        await request(tunnel.port)
+        response, seconds = await request(tunnel.port)
+        assert response == RESPONSE
+        assert seconds > 2 * ROUND_TRIP  # the request is only sent once the start is acked.
+
+
+async def test_late_start_isnt_replayed():
+    """
+    a copy of a start request that arrives after its client ended, like a duplicate or a retransmission whose ack was
+    lost, is acked again, instead of connecting to the destination again and sending it the early data again.
+    """
+    starts = []
+    acked_starts = []
+
+    def observe(destination: str, tunnel_packets: list):
+        for tunnel_packet in tunnel_packets:
+            if tunnel_packet.action == Action.start:
+                start = copy.copy(tunnel_packet)
+                start.payload = bytes(tunnel_packet.payload)
+                starts.append(start)
+            elif tunnel_packet.action == Action.ack and tunnel_packet.capabilities:  # acks of starts advertise them.
+                acked_starts.append(tunnel_packet.client_id)
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe, latency=0.01)
+    async with tunnel_harness.tunnel(network, destination=respond) as tunnel:
+        await request(tunnel.port)
+        response, _ = await request(tunnel.port)
+        assert response == RESPONSE
+        late_start = starts[-1]
+        assert late_start.payload == REQUEST
+        assert await tunnel_harness.wait_for(
+            lambda: not tunnel.proxy.client_manager.clients and not tunnel.proxy.retransmissions)
+
+        tunnel.proxy.handle_tunnel_packet(late_start)
+        assert await tunnel_harness.wait_for(lambda: acked_starts.count(late_start.client_id) == 2)
+        await asyncio.sleep(0.1)
+        assert len(tunnel.connections) == 2
+        assert not tunnel.proxy.client_manager.clients
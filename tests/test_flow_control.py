@@ -0,0 +1,63 @@
+import os
+import asyncio
+from TCPoverICMP.tunnel_packet import Action
+from tests import tunnel_harness
+
+
+RECEIVE_WINDOW = 64 * 1024
+STALL = 0.5
+
+
+async def test_slow_destination():
+    """
+    a destination that stops reading fills the receive buffer of its client on the proxy, which advertises a closed
+    window. the forwarder stops sending, instead of the proxy buffering everything or dropping it, and probes the
+    window until the destination reads again.
+    the data is more than the sockets on the way buffer, so the window closes.
+    """
+    data = os.urandom(8 * 1024 * 1024)
+    received = bytearray()
+    window_closed = asyncio.Event()
+    probes = []
+
+    async def slow_sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await window_closed.wait()
+        await asyncio.sleep(STALL)
+        while len(received) < len(data):
+            chunk = await reader.read(tunnel_harness.READ_SIZE)
+            if not chunk:
+                break
+            received.extend(chunk)
+
+    def observe(destination: str, tunnel_packets: list):
+        probes.extend(tunnel_packet for tunnel_packet in tunnel_packets
+                      if tunnel_packet.action == Action.data and not tunnel_packet.sequence_number)
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe, latency=0.005)
+    async with tunnel_harness.tunnel(network, destination=slow_sink, receive_window=RECEIVE_WINDOW) as tunnel:
+        max_buffered = 0
+
+        async def sample_buffers():
+            nonlocal max_buffered
+            while True:
+                for client in tunnel.proxy.client_manager.clients.values():
+                    max_buffered = max(max_buffered, client.session.buffered_size)
+                await asyncio.sleep(0.005)
+
+        sampler = asyncio.create_task(sample_buffers())
+        reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        writer.write(data)
+        assert await tunnel_harness.wait_for(lambda: tunnel.forwarder.closed_windows)
+        probes_before_stall = len(probes)
+        window_closed.set()
+        assert await tunnel_harness.wait_for(lambda: len(received) == len(data))
+        sampler.cancel()
+        writer.close()
+
+        assert received == data
+        assert len(probes) > probes_before_stall  # nothing is in flight while the window is closed, these are probes.
+        # segments that are next in sequence may overshoot the window, up to twice its size.
+        assert 0 < max_buffered <= 2 * RECEIVE_WINDOW
+        assert tunnel.proxy.metrics.packets_dropped['receive_buffer_full'].value == 0
+        assert not tunnel.forwarder.closed_windows
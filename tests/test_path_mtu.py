@@ -0,0 +1,47 @@
+import asyncio
+from TCPoverICMP import path_mtu, rtt_estimator
+
+
+PATH_PAYLOAD_SIZE = 1000
+PREVIOUS_PAYLOAD_SIZE = 1400
+PROBE_RTO = 0.01
+
+
+def new_prober(gets_through):
+    """
+    :param gets_through: called with the size of every probe sent, returns whether it gets through.
+    :return: tuple of a prober whose probes are replied right away if they get through, and the sizes it changed to.
+    """
+    changes = []
+
+    def send_probe(payload_size: int):
+        if gets_through(payload_size):
+            asyncio.get_running_loop().call_soon(prober.probe_replied, payload_size)
+
+    rtt = rtt_estimator.RTTEstimator(initial_rto=PROBE_RTO, min_rto=PROBE_RTO)
+    prober = path_mtu.PathMTUProber(send_probe, rtt, changes.append)
+    return prober, changes
+
+
+async def test_discover():
+    prober, changes = new_prober(lambda payload_size: payload_size <= PATH_PAYLOAD_SIZE)
+    assert await prober.discover()
+    assert prober.payload_size == PATH_PAYLOAD_SIZE
+    assert changes == [PATH_PAYLOAD_SIZE]
+
+
+async def test_discover_the_minimal_mtu():
+    prober, _ = new_prober(lambda payload_size: payload_size <= path_mtu.PathMTUProber.MIN_PAYLOAD_SIZE)
+    assert await prober.discover()
+    assert prober.payload_size == path_mtu.PathMTUProber.MIN_PAYLOAD_SIZE
+
+
+async def test_unreachable_endpoint_keeps_the_payload_size():
+    """
+    when no probe gets through, the other endpoint is unreachable, which says nothing about the MTU of the path.
+    """
+    prober, changes = new_prober(lambda payload_size: False)
+    prober.payload_size = PREVIOUS_PAYLOAD_SIZE
+    assert not await prober.discover()
+    assert prober.payload_size == PREVIOUS_PAYLOAD_SIZE
+    assert not changes
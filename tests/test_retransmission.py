@@ -0,0 +1,80 @@
+import os
+import errno
+import asyncio
+from TCPoverICMP import retransmission, memory_transport
+from TCPoverICMP.tunnel_packet import Action
+from tests import tunnel_harness
+
+
+CONNECT_DELAY = 0.5
+
+
+async def test_a_failing_expiry_doesnt_stop_the_wheel():
+    """
+    when expiring a packet raises, the other packets of its slot are still expired, the failed one is expired again,
+    and the timer keeps ticking.
+    """
+    expired = []
+    failed = []
+
+    def expire(packet: retransmission.OutstandingPacket):
+        if not failed:
+            failed.append(packet.sequence_number)
+            raise OSError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+        expired.append(packet.sequence_number)
+        queue.pop(packet.client_id, packet.sequence_number)
+
+    queue = retransmission.RetransmissionQueue(expire)
+    now = asyncio.get_running_loop().time()
+    for sequence_number in range(1, 4):
+        packet = retransmission.OutstandingPacket(1, sequence_number, Action.data, b'')
+        packet.deadline = now
+        queue.add(packet)
+
+    assert await tunnel_harness.wait_for(lambda: not queue, timeout=1)
+    assert sorted(expired) == [1, 2, 3]
+    assert failed == [1]
+
+
+async def test_packets_that_fail_to_send_are_retransmitted():
+    """
+    a packet that the socket fails to send is counted as dropped, and sent again like a packet lost on the way.
+    """
+    sent = []
+
+    def observe(destination: str, tunnel_packets: list):
+        if destination == tunnel_harness.PROXY_ADDRESS and any(
+                tunnel_packet.action == Action.data for tunnel_packet in tunnel_packets):
+            sent.append(destination)
+            if len(sent) % 10 == 0:
+                raise OSError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe, latency=0.005)
+    data = os.urandom(256 * 1024)
+    async with tunnel_harness.tunnel(network) as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        metrics = tunnel.forwarder.metrics
+        assert metrics.packets_dropped['send_failed'].value >= 1
+        assert metrics.packets_retransmitted.value >= 1
+        assert await tunnel_harness.wait_for(lambda: not tunnel.forwarder.retransmissions)
+
+
+async def test_start_requests_arent_rtt_samples():
+    """
+    the time it takes the proxy to connect to the destination isnt counted as a round trip.
+    """
+    network = memory_transport.MemoryNetwork(latency=0.005)
+    async with tunnel_harness.tunnel(network) as tunnel:
+        connect = tunnel.proxy.connection_pool.connect
+
+        async def slow_connect(host: str, port: int):
+            await asyncio.sleep(CONNECT_DELAY)
+            return await connect(host, port)
+
+        tunnel.proxy.connection_pool.connect = slow_connect
+        for _ in range(3):
+            received, _ = await tunnel_harness.echo_through(tunnel.port, b'x' * 1024)
+            assert received == b'x' * 1024
+        assert tunnel.forwarder.rtt_estimator.srtt < CONNECT_DELAY / 10
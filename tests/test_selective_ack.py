@@ -0,0 +1,93 @@
+import os
+import asyncio
+from TCPoverICMP import memory_transport
+from TCPoverICMP.tunnel_packet import Action
+from tests import tunnel_harness
+
+
+LOST_SEQUENCE_NUMBER = 20
+
+
+async def test_lost_segment_is_fast_retransmitted():
+    """
+    a lost segment in the middle of a transfer is reported by the sack blocks of the acks of the segments after it,
+    and sent again right away, instead of when its retransmission timeout passes.
+    """
+    sack_blocks = []
+    lost = []
+
+    def observe(destination: str, tunnel_packets: list):
+        if destination == tunnel_harness.FORWARDER_ADDRESS:
+            sack_blocks.extend(tunnel_packet.sack_blocks for tunnel_packet in tunnel_packets
+                               if tunnel_packet.sack_blocks)
+            return False
+        if lost:
+            return False
+        if any(tunnel_packet.action == Action.data and tunnel_packet.sequence_number == LOST_SEQUENCE_NUMBER
+               for tunnel_packet in tunnel_packets):
+            lost.append(LOST_SEQUENCE_NUMBER)
+            return True
+        return False
+
+    network = tunnel_harness.ObservedNetwork(observe, latency=0.01)
+    data = os.urandom(256 * 1024)
+    async with tunnel_harness.tunnel(network) as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        assert lost
+        assert sack_blocks
+        metrics = tunnel.forwarder.metrics
+        assert metrics.packets_fast_retransmitted.value >= 1
+        assert metrics.packets_retransmitted.value == metrics.packets_fast_retransmitted.value  # no timeouts.
+
+
+async def test_reordering_isnt_a_loss():
+    """
+    segments that are only reordered are acked before they are reported missing enough times to be sent again.
+    """
+    network = memory_transport.MemoryNetwork(latency=0.01, reorder=0.05, reorder_delay=0.002, seed=1)
+    data = os.urandom(1024 * 1024)
+    async with tunnel_harness.tunnel(network) as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        packets_sent = tunnel.forwarder.metrics.packets_sent.value
+        assert tunnel.forwarder.metrics.packets_retransmitted.value < packets_sent * 0.01
+
+
+async def test_lost_acks_are_probed():
+    """
+    when the acks of the last segments sent are lost, nothing else would be acked until their retransmission timeout.
+    the window is probed instead, and the ack of the probe acks them, so they arent sent again.
+    """
+    received = bytearray()
+    dropping = []
+
+    async def sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            data = await reader.read(tunnel_harness.READ_SIZE)
+            if not data:
+                break
+            received.extend(data)
+
+    def observe(destination: str, tunnel_packets: list):
+        # the ack of a probe acks sequence number 0, the acks of data segments ack their own sequence numbers.
+        return bool(dropping) and destination == tunnel_harness.FORWARDER_ADDRESS and all(
+            tunnel_packet.action == Action.ack and tunnel_packet.sequence_number for tunnel_packet in tunnel_packets)
+
+    network = tunnel_harness.ObservedNetwork(observe, latency=0.01)
+    async with tunnel_harness.tunnel(network, destination=sink) as tunnel:
+        reader, writer = await asyncio.open_connection(tunnel_harness.LOCALHOST, tunnel.port)
+        writer.write(b'x' * 16 * 1024)  # rtt samples for the loss probe timeout.
+        await writer.drain()
+        assert await tunnel_harness.wait_for(lambda: len(received) == 16 * 1024)
+        assert await tunnel_harness.wait_for(lambda: not tunnel.forwarder.retransmissions)
+        retransmitted = tunnel.forwarder.metrics.packets_retransmitted.value
+
+        dropping.append(True)
+        writer.write(b'y' * 3 * 1024)
+        await writer.drain()
+        assert await tunnel_harness.wait_for(lambda: len(received) == 19 * 1024)
+        assert await tunnel_harness.wait_for(lambda: not tunnel.forwarder.retransmissions)
+        assert tunnel.forwarder.metrics.loss_probes.value >= 1
+        assert tunnel.forwarder.metrics.packets_retransmitted.value == retransmitted
+        writer.close()
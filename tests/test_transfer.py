@@ -0,0 +1,61 @@
+import os
+import asyncio
+from TCPoverICMP import memory_transport
+from tests import tunnel_harness
+
+
+LOSS = 0.05
+MTU = 1000
+
+
+async def test_lossless_transfer():
+    data = os.urandom(4 * 1024 * 1024)
+    async with tunnel_harness.tunnel() as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        assert tunnel.forwarder.metrics.packets_retransmitted.value == 0
+        assert tunnel.proxy.metrics.packets_retransmitted.value == 0
+
+
+async def test_concurrent_transfers():
+    data = [os.urandom(256 * 1024) for _ in range(8)]
+    async with tunnel_harness.tunnel(memory_transport.MemoryNetwork(latency=0.005)) as tunnel:
+        results = await asyncio.gather(*(tunnel_harness.echo_through(tunnel.port, client_data) for client_data in data))
+        assert [received for received, _ in results] == data
+        assert len(tunnel.connections) == len(data)
+
+
+async def test_lossy_transfer():
+    """
+    the data arrives intact and in order through loss, reordering and duplication. the losses are recovered by fast
+    retransmits, rather than by a retransmission timeout every time, and reordered or duplicated packets arent sent
+    again.
+    """
+    network = memory_transport.MemoryNetwork(latency=0.01, loss=LOSS, reorder=0.05, duplicate=0.02, seed=1)
+    data = os.urandom(1024 * 1024)
+    async with tunnel_harness.tunnel(network) as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        for endpoint in (tunnel.forwarder, tunnel.proxy):
+            metrics = endpoint.metrics
+            retransmitted = metrics.packets_retransmitted.value
+            timed_out = retransmitted - metrics.packets_fast_retransmitted.value
+            assert 0 < retransmitted < 2 * LOSS * metrics.packets_sent.value
+            assert timed_out <= retransmitted / 4
+
+
+async def test_transfer_after_mtu_change():
+    """
+    a path whose MTU is lower than the default payload is found, and data is segmented to fit it.
+    packets bigger than the MTU are fragmented on the way, rather than dropped, so the data would arrive even if they
+    were sent. the sizes the endpoints settled on are checked instead.
+    """
+    network = memory_transport.MemoryNetwork(latency=0.005, mtu=MTU)
+    data = os.urandom(512 * 1024)
+    payload_size = MTU - network.HEADERS_SIZE
+    async with tunnel_harness.tunnel(network) as tunnel:
+        received, _ = await tunnel_harness.echo_through(tunnel.port, data)
+        assert received == data
+        for endpoint in (tunnel.forwarder, tunnel.proxy):
+            assert await tunnel_harness.wait_for(lambda: endpoint.path_mtu_prober.payload_size == payload_size)
+            assert endpoint.client_manager.segment_size + endpoint.codec.MAX_DATA_HEADER_SIZE == payload_size
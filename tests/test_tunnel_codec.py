@@ -0,0 +1,107 @@
+import pytest
+from TCPoverICMP import tunnel_codec, exceptions
+from TCPoverICMP.tunnel_packet import TunnelPacket, Action, Direction, Capability
+
+
+CODECS = (tunnel_codec.ProtobufCodec, tunnel_codec.BinaryCodec)
+MAX_NUMBER = 2 ** 32 - 1
+HEADER = tunnel_codec.BinaryCodec.HEADER_STRUCT
+
+
+def full_packet():
+    return TunnelPacket(
+        client_id=7,
+        sequence_number=1234,
+        action=Action.start,
+        direction=Direction.to_forwarder,
+        ip='10.1.2.3',
+        port=8080,
+        payload=b'GET / HTTP/1.1\r\n\r\n',
+        ack_number=99,
+        capabilities=Capability.binary_codec | Capability.early_data,
+        window=65536,
+        compressed=True,
+        sack_blocks=((101, 103), (110, 110)),
+    )
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_round_trip(codec):
+    tunnel_packet = full_packet()
+    assert codec.decode(codec.encode(tunnel_packet)) == tunnel_packet
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_round_trip_of_a_bare_packet(codec):
+    tunnel_packet = TunnelPacket(client_id=1, sequence_number=2, action=Action.ack)
+    decoded = codec.decode(codec.encode(tunnel_packet))
+    assert decoded == tunnel_packet
+    assert decoded.window is None  # no window was advertised, which is different from a closed window.
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_closed_window_round_trip(codec):
+    tunnel_packet = TunnelPacket(client_id=1, action=Action.ack, window=0)
+    assert codec.decode(codec.encode(tunnel_packet)).window == 0
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_decode_recognizes_the_codec(codec):
+    tunnel_packet = full_packet()
+    assert tunnel_codec.decode(codec.encode(tunnel_packet)) == tunnel_packet
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_max_data_header_size(codec):
+    tunnel_packet = TunnelPacket(
+        client_id=MAX_NUMBER,
+        sequence_number=MAX_NUMBER,
+        action=Action.data,
+        direction=Direction.to_forwarder,
+        payload=b'x' * 1400,
+        ack_number=MAX_NUMBER,
+        window=MAX_NUMBER,
+        compressed=True,
+    )
+    assert len(codec.encode(tunnel_packet)) - len(tunnel_packet.payload) <= codec.MAX_DATA_HEADER_SIZE
+
+
+def test_decode_all_of_coalesced_packets():
+    tunnel_packets = [
+        TunnelPacket(client_id=client_id, sequence_number=client_id + 1, action=Action.data, payload=bytes([client_id]))
+        for client_id in range(5)
+    ]
+    tunnel_packets.append(TunnelPacket(client_id=3, action=Action.ack, ack_number=4, sack_blocks=((6, 8),)))
+    data = b''.join(tunnel_codec.BinaryCodec.encode(tunnel_packet) for tunnel_packet in tunnel_packets)
+    assert tunnel_codec.decode_all(data) == tunnel_packets
+
+
+def test_decode_all_of_a_protobuf_packet():
+    tunnel_packet = full_packet()
+    assert tunnel_codec.decode_all(tunnel_codec.ProtobufCodec.encode(tunnel_packet)) == [tunnel_packet]
+
+
+def test_unknown_options_are_skipped():
+    tunnel_packet = TunnelPacket(client_id=1, action=Action.start, ip='10.0.0.1', port=80)
+    options = tunnel_codec.BinaryCodec._encode_options(tunnel_packet) + \
+        tunnel_codec.BinaryCodec.OPTION_STRUCT.pack(200, 3) + b'new'
+    header = HEADER.pack(tunnel_codec.BinaryCodec.MAGIC, Action.start, 0, len(options), 1, 0, 0, 0)
+    assert tunnel_codec.BinaryCodec.decode(header + options) == tunnel_packet
+
+
+@pytest.mark.parametrize('data', (
+    b'',
+    tunnel_codec.BinaryCodec.encode(full_packet())[:10],  # truncated header.
+    tunnel_codec.BinaryCodec.encode(full_packet())[:-1],  # truncated payload.
+    HEADER.pack(tunnel_codec.BinaryCodec.MAGIC, 100, 0, 0, 1, 0, 0, 0),  # unknown action.
+    HEADER.pack(tunnel_codec.BinaryCodec.MAGIC, Action.ack, 0, 1, 1, 0, 0, 0) + b'\x01',  # bad option.
+    HEADER.pack(tunnel_codec.BinaryCodec.MAGIC + 1, Action.ack, 0, 0, 1, 0, 0, 0),  # unknown version.
+))
+def test_invalid_binary_packets(data):
+    with pytest.raises(exceptions.InvalidTunnelPacket):
+        tunnel_codec.BinaryCodec.decode(data)
+
+
+def test_invalid_protobuf_packet():
+    with pytest.raises(exceptions.InvalidTunnelPacket):
+        tunnel_codec.decode(b'\xff\xff\xff')
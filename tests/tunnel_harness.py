@@ -0,0 +1,159 @@
+import time
+import socket
+import asyncio
+import contextlib
+import collections
+from typing import Callable, Awaitable
+from TCPoverICMP import forwarder, proxy, memory_transport, tunnel_codec, icmp_packet
+
+
+LOCALHOST = '127.0.0.1'
+FORWARDER_ADDRESS = '10.0.0.1'
+PROXY_ADDRESS = '10.0.0.2'
+READ_SIZE = 65536
+TIMEOUT = 60.0
+
+
+Tunnel = collections.namedtuple('Tunnel', ('forwarder', 'proxy', 'port', 'connections'))
+
+
+class ObservedNetwork(memory_transport.MemoryNetwork):
+    """
+    a memory network that shows the tunnel packets sent on it to an observer, which may drop them.
+    """
+    def __init__(self, observe: Callable[[str, list], bool], **kwargs):
+        """
+        :param observe: called with the destination and the decoded tunnel packets of every icmp packet sent. returns
+        whether to drop the icmp packet. the payloads of the tunnel packets are only valid during the call.
+        :param kwargs: the impairments of the network, see MemoryNetwork.
+        """
+        super(ObservedNetwork, self).__init__(**kwargs)
+        self.observe = observe
+
+    def send(self, packet: icmp_packet.ICMPPacket, destination: str, dont_fragment: bool = False):
+        if self.observe(destination, tunnel_codec.decode_all(packet.payload)):
+            return
+        super(ObservedNetwork, self).send(packet, destination, dont_fragment)
+
+
+async def echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    a destination that sends back everything it receives.
+    """
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((LOCALHOST, 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def tunnel(
+        network: memory_transport.MemoryNetwork = None,
+        destination: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable] = echo,
+        proxy_kwargs: dict = None,
+        forwarder_kwargs: dict = None,
+        **endpoint_kwargs,
+):
+    """
+    run a forwarder and a proxy in this process, over a memory network, forwarding to a local destination server.
+    :param network: the network between the endpoints, a lossless one by default.
+    :param destination: serves the connections that the proxy opens to the destination, echo by default.
+    :param proxy_kwargs: arguments of the proxy only.
+    :param forwarder_kwargs: arguments of the forwarder only.
+    :param endpoint_kwargs: arguments of both endpoints.
+    :return: a Tunnel of the endpoints, the port the forwarder listens on, and the writers of the connections the
+    destination accepted.
+    """
+    network = network or memory_transport.MemoryNetwork()
+    connections = []
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections.append(writer)
+        await destination(reader, writer)
+
+    server = await asyncio.start_server(serve, LOCALHOST, 0)
+    port = free_port()
+    endpoints = Tunnel(
+        forwarder.Forwarder(
+            PROXY_ADDRESS,
+            port,
+            LOCALHOST,
+            server.sockets[0].getsockname()[1],
+            transport=network.transport(FORWARDER_ADDRESS),
+            **endpoint_kwargs,
+            **forwarder_kwargs or {},
+        ),
+        proxy.Proxy(
+            FORWARDER_ADDRESS,
+            transport=network.transport(PROXY_ADDRESS),
+            **endpoint_kwargs,
+            **proxy_kwargs or {},
+        ),
+        port,
+        connections,
+    )
+    tasks = [asyncio.create_task(endpoint.run()) for endpoint in (endpoints.forwarder, endpoints.proxy)]
+    await asyncio.sleep(0.1)  # let the forwarder start listening.
+    try:
+        yield endpoints
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        server.close()
+
+
+async def echo_through(port: int, data: bytes):
+    """
+    send data through the tunnel to an echo destination, and read it back.
+    :param port: the port the forwarder listens on.
+    :param data: the data to send.
+    :return: tuple of the data that came back, and the seconds it took.
+    """
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+
+    async def send():
+        writer.write(data)
+        await writer.drain()
+
+    async def receive():
+        received = bytearray()
+        while len(received) < len(data):
+            chunk = await reader.read(READ_SIZE)
+            if not chunk:
+                break
+            received.extend(chunk)
+        return bytes(received)
+
+    try:
+        _, received = await asyncio.wait_for(asyncio.gather(send(), receive()), TIMEOUT)
+    finally:
+        writer.close()
+    return received, time.perf_counter() - start
+
+
+async def wait_for(condition: Callable[[], bool], timeout: float = TIMEOUT, interval: float = 0.01):
+    """
+    wait until a condition holds.
+    :return: boolean representing whether it held before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True